@@ -7,11 +7,28 @@ import json
 from dateutil import parser
 import time
 import botocore.exceptions
+from urllib.parse import unquote_plus
+import csv
+import gzip
+import io
+import re
+import tempfile
+
+def rebuild_S3_files(account_settings, inventory_manifest=None):
+    """
+    Synchronize the File table for an account with the contents of its bucket.
+
+    Args:
+        account_settings: Setting object containing AWS credentials
+        inventory_manifest: Optional S3 Inventory manifest.json location, either an
+            s3://bucket/key URI or a local path. When given, the catalog is rebuilt
+            from the inventory report instead of listing the bucket.
 
-def rebuild_S3_files(account_settings):
+    Returns:
+        List of affected File objects
+    """
     retries = 3
     account_id = account_settings.account_id
-    affected_files = []  # Track affected files
 
     # Validate required settings
     if not account_settings.aws_access_key_id or not account_settings.aws_secret_access_key or not account_settings.bucket_name:
@@ -31,63 +48,18 @@ def rebuild_S3_files(account_settings):
 
     for attempt in range(retries):
         try:
-            # Get all current files in database for this account
-            db_files = {file.key: file for file in File.query.filter_by(account_id=account_id).all()}
-            s3_files = set()  # Track S3 files we've seen
-
-            continuation_token = None
-            while True:
-                list_params = {'Bucket': account_settings.bucket_name, 'Prefix': ''}
-                if continuation_token:
-                    list_params['ContinuationToken'] = continuation_token
-
-                response = s3_client.list_objects_v2(**list_params)
-
-                # Process each file from S3
-                if 'Contents' in response:
-                    for obj in response['Contents']:
-                        file_key = obj['Key']
-                            
-                        s3_files.add(file_key)
-
-                        # rewrite all right now, check version in the future to minimize db operations
-                        if file_key in db_files:
-                            existing_file = db_files[file_key]
-                            # Only add to affected_files if last_modified has changed
-                            if existing_file.last_modified != obj['LastModified']:
-                                affected_files.append(existing_file)
-                            existing_file.size = obj['Size']
-                            existing_file.last_modified = obj['LastModified']
-                            existing_file.url = generate_s3_url(account_settings.bucket_name, file_key)
-                            db.session.add(existing_file)
-                        else:
-                            # New file - create new entry with version 1
-                            new_file = File(
-                                account_id=account_id,
-                                key=file_key,
-                                url=generate_s3_url(account_settings.bucket_name, file_key),
-                                size=obj['Size'],
-                                last_modified=obj['LastModified'],
-                                last_checked=datetime.now(timezone.utc),
-                                version=1
-                            )
-                            db.session.add(new_file)
-                            affected_files.append(new_file)
-
-                # Handle pagination
-                if response.get('IsTruncated'):
-                    continuation_token = response.get('NextContinuationToken')
-                else:
-                    break
-
-            # Remove files that exist in DB but not in S3
-            for key in db_files:
-                if key not in s3_files:
-                    # Add to affected_files before deleting
-                    affected_files.append(db_files[key])
-                    db.session.delete(db_files[key])
-
-            db.session.commit()
+            if inventory_manifest:
+                manifest = load_inventory_manifest(s3_client, inventory_manifest, account_settings.bucket_name)
+                s3_objects = iter_inventory_objects(s3_client, inventory_manifest, manifest)
+                # The report is a snapshot: leave rows it can't speak for alone
+                affected_files = _sync_listed_objects(
+                    account_settings, s3_objects,
+                    snapshot_time=inventory_snapshot_time(manifest),
+                    prefix=inventory_prefix(s3_client, inventory_manifest, account_settings.bucket_name)
+                )
+            else:
+                s3_objects = _iter_bucket_objects(s3_client, account_settings.bucket_name)
+                affected_files = _sync_listed_objects(account_settings, s3_objects)
             logging.info(f"Successfully synchronized files for account {account_id}")
 
             # Only sync source files in non-production environments
@@ -97,12 +69,267 @@ def rebuild_S3_files(account_settings):
             return affected_files
 
         except Exception as e:
+            db.session.rollback()
             logging.error(f"Attempt {attempt + 1} failed accessing S3 bucket: {e}")
             if attempt < retries - 1:
                 logging.debug("Retrying...")
             else:
                 return []
 
+def _iter_bucket_objects(s3_client, bucket_name):
+    """Yield every object in a bucket using paginated list_objects_v2 calls."""
+    continuation_token = None
+    while True:
+        list_params = {'Bucket': bucket_name, 'Prefix': ''}
+        if continuation_token:
+            list_params['ContinuationToken'] = continuation_token
+
+        response = s3_client.list_objects_v2(**list_params)
+
+        for obj in response.get('Contents', []):
+            yield obj
+
+        # Handle pagination
+        if response.get('IsTruncated'):
+            continuation_token = response.get('NextContinuationToken')
+        else:
+            break
+
+def _sync_listed_objects(account_settings, s3_objects, snapshot_time=None, prefix=''):
+    """
+    Diff a full listing of the bucket against the File table and apply the changes.
+
+    Args:
+        account_settings: Setting object for the account being synchronized
+        s3_objects: Iterable of dicts with Key, Size and LastModified entries
+        snapshot_time: When the listing was taken, for listings that may be out of
+            date (inventory reports); rows modified since then are left as they are
+        prefix: Only rows under this prefix are deleted when missing from the
+            listing; None deletes nothing
+
+    Returns:
+        List of affected File objects
+    """
+    account_id = account_settings.account_id
+    affected_files = []
+
+    def predates_snapshot(file):
+        return snapshot_time is None or file.last_modified is None or _as_utc(file.last_modified) < snapshot_time
+
+    # Get all current files in database for this account
+    db_files = {file.key: file for file in File.query.filter_by(account_id=account_id).all()}
+    s3_files = set()  # Track S3 files we've seen
+
+    # Process each file from S3
+    for obj in s3_objects:
+        file_key = obj['Key']
+            
+        s3_files.add(file_key)
+
+        etag = normalize_etag(obj.get('ETag'))
+
+        # rewrite all right now, check version in the future to minimize db operations
+        if file_key in db_files:
+            existing_file = db_files[file_key]
+            if not predates_snapshot(existing_file):
+                continue  # Changed after the snapshot; its row is newer than the listing
+            # Only bump the version for real content changes, not timestamp noise
+            if file_content_changed(existing_file, obj['Size'], obj['LastModified'], etag):
+                existing_file.version += 1
+                affected_files.append(existing_file)
+            existing_file.size = obj['Size']
+            existing_file.last_modified = obj['LastModified']
+            existing_file.etag = etag or existing_file.etag
+            existing_file.url = generate_s3_url(account_settings.bucket_name, file_key)
+            db.session.add(existing_file)
+        else:
+            # New file - create new entry with version 1
+            new_file = File(
+                account_id=account_id,
+                key=file_key,
+                url=generate_s3_url(account_settings.bucket_name, file_key),
+                size=obj['Size'],
+                last_modified=obj['LastModified'],
+                etag=etag,
+                last_checked=datetime.now(timezone.utc),
+                version=1
+            )
+            db.session.add(new_file)
+            affected_files.append(new_file)
+
+    # Remove files that exist in DB but not in S3
+    for key in db_files:
+        if (key not in s3_files and prefix is not None and key.startswith(prefix)
+                and predates_snapshot(db_files[key])):
+            # Add to affected_files before deleting
+            affected_files.append(db_files[key])
+            db.session.delete(db_files[key])
+
+    db.session.commit()
+    return affected_files
+
+def _open_inventory_file(s3_client, location):
+    """Open an inventory file (s3://bucket/key or local path) as a binary stream."""
+    if location.startswith('s3://'):
+        bucket, _, key = location[len('s3://'):].partition('/')
+        # Spool to a temporary file so large reports never sit in memory and
+        # columnar readers get the seekable file they need
+        spooled = tempfile.TemporaryFile()
+        s3_client.download_fileobj(bucket, key, spooled)
+        spooled.seek(0)
+        return spooled
+    return open(location, 'rb')
+
+def _inventory_data_location(manifest_location, manifest, data_key):
+    """Resolve where a data file listed in an inventory manifest lives."""
+    if manifest_location.startswith('s3://'):
+        # destinationBucket is an ARN such as arn:aws:s3:::inventory-bucket
+        destination_bucket = manifest.get('destinationBucket', '').split(':')[-1]
+        if not destination_bucket:
+            destination_bucket = manifest_location[len('s3://'):].partition('/')[0]
+        return f"s3://{destination_bucket}/{data_key}"
+
+    # Local copies: accept the data file next to manifest.json or in the
+    # sibling data/ directory that S3 Inventory writes
+    manifest_dir = os.path.dirname(os.path.abspath(manifest_location))
+    file_name = os.path.basename(data_key)
+    candidates = [
+        os.path.join(manifest_dir, file_name),
+        os.path.join(manifest_dir, 'data', file_name),
+        os.path.join(os.path.dirname(manifest_dir), 'data', file_name)
+    ]
+    for candidate in candidates:
+        if os.path.exists(candidate):
+            return candidate
+    raise FileNotFoundError(f"Inventory data file {data_key} not found near {manifest_location}")
+
+def _inventory_row_to_object(row):
+    """Convert an inventory row (column name -> value) into a list_objects_v2 style dict."""
+    if str(row.get('is_latest', 'true')).lower() == 'false':
+        return None
+    if str(row.get('is_delete_marker', 'false')).lower() == 'true':
+        return None
+
+    last_modified = row.get('last_modified_date')
+    if isinstance(last_modified, str):
+        last_modified = parser.parse(last_modified)
+    if last_modified is not None and last_modified.tzinfo is None:
+        last_modified = last_modified.replace(tzinfo=timezone.utc)
+
+    return {
+        'Key': row['key'],
+        'Size': int(row.get('size') or 0),
+        'LastModified': last_modified,
+        'ETag': row.get('e_tag')
+    }
+
+def _inventory_column_name(name):
+    """Normalize inventory column names (LastModifiedDate, last_modified_date) to snake case."""
+    name = name.strip()
+    if '_' in name or name.islower():
+        return name.lower()
+    return re.sub(r'(?<!^)(?=[A-Z])', '_', name).lower()
+
+def load_inventory_manifest(s3_client, manifest_location, bucket_name):
+    """
+    Read an S3 Inventory manifest.json and check it describes the expected bucket.
+
+    Args:
+        s3_client: boto3 S3 client used for s3:// locations
+        manifest_location: manifest.json location (s3://bucket/key or local path)
+        bucket_name: Bucket the inventory is expected to describe
+
+    Returns:
+        The parsed manifest dict
+    """
+    with _open_inventory_file(s3_client, manifest_location) as manifest_file:
+        manifest = json.load(manifest_file)
+
+    source_bucket = manifest.get('sourceBucket')
+    if source_bucket and source_bucket != bucket_name:
+        raise ValueError(f"Inventory manifest describes bucket {source_bucket}, expected {bucket_name}")
+    return manifest
+
+def inventory_snapshot_time(manifest):
+    """When an inventory report was taken (creationTimestamp, epoch milliseconds), as UTC."""
+    created = manifest.get('creationTimestamp')
+    if not created:
+        raise ValueError("Inventory manifest has no creationTimestamp")
+    return datetime.fromtimestamp(int(created) / 1000, tz=timezone.utc)
+
+def inventory_prefix(s3_client, manifest_location, bucket_name):
+    """
+    The object prefix an inventory report is filtered to ('' for the whole bucket).
+
+    The manifest doesn't record the filter, so it is read from the inventory
+    configuration named in the manifest path
+    (<destination prefix>/<source bucket>/<configuration id>/<date>/manifest.json).
+
+    Returns:
+        The prefix, or None if the configuration can't be read
+    """
+    parts = manifest_location.rstrip('/').split('/')
+    if not manifest_location.startswith('s3://') or len(parts) < 4:
+        return None
+    try:
+        configuration = s3_client.get_bucket_inventory_configuration(Bucket=bucket_name, Id=parts[-3])
+        return configuration['InventoryConfiguration'].get('Filter', {}).get('Prefix', '')
+    except Exception as e:
+        logging.warning(f"Could not read inventory configuration {parts[-3]} for bucket {bucket_name}, "
+                        f"no files will be removed: {e}")
+        return None
+
+def iter_inventory_objects(s3_client, manifest_location, manifest):
+    """
+    Stream the objects listed in an S3 Inventory report.
+
+    Args:
+        s3_client: boto3 S3 client used for s3:// locations
+        manifest_location: manifest.json location (s3://bucket/key or local path)
+        manifest: The manifest, as read by load_inventory_manifest
+
+    Yields:
+        Dicts with Key, Size, LastModified and ETag entries, one per current object
+    """
+    bucket_name = manifest.get('sourceBucket', '')
+    file_format = manifest.get('fileFormat', 'CSV').upper()
+    logging.info(f"Reading {len(manifest.get('files', []))} {file_format} inventory files for bucket {bucket_name}")
+
+    for entry in manifest.get('files', []):
+        location = _inventory_data_location(manifest_location, manifest, entry['key'])
+
+        with _open_inventory_file(s3_client, location) as data_file:
+            if file_format == 'CSV':
+                # CSV reports are gzipped, headerless and described by fileSchema
+                columns = [_inventory_column_name(col) for col in manifest['fileSchema'].split(',')]
+                text_stream = io.TextIOWrapper(gzip.GzipFile(fileobj=data_file), encoding='utf-8', newline='')
+                for values in csv.reader(text_stream):
+                    row = dict(zip(columns, values))
+                    # Keys in CSV reports are URL-encoded
+                    row['key'] = unquote_plus(row.get('key', ''))
+                    obj = _inventory_row_to_object(row)
+                    if obj:
+                        yield obj
+
+            elif file_format in ('PARQUET', 'ORC'):
+                if file_format == 'PARQUET':
+                    import pyarrow.parquet as pq
+                    batches = pq.ParquetFile(data_file).iter_batches(batch_size=10000)
+                else:
+                    import pyarrow.orc as orc
+                    orc_file = orc.ORCFile(data_file)
+                    batches = (orc_file.read_stripe(i) for i in range(orc_file.nstripes))
+
+                for batch in batches:
+                    columns = [_inventory_column_name(col) for col in batch.schema.names]
+                    for values in zip(*[column.to_pylist() for column in batch.columns]):
+                        obj = _inventory_row_to_object(dict(zip(columns, values)))
+                        if obj:
+                            yield obj
+
+            else:
+                raise ValueError(f"Unsupported inventory file format: {file_format}")
+
 def generate_download_link(account_settings, key, expires_in=3600):
     # Validate that required settings are not empty
     if not account_settings.aws_access_key_id or not account_settings.aws_secret_access_key or not account_settings.bucket_name:
@@ -160,24 +387,66 @@ def get_latest_files(account_id, total=1000, days=None, device_id=None):
         return []
 
 def do_files_exist(account_id, files):
+    """
+    Check which files a gateway already has in the bucket.
+
+    Args:
+        account_id: ID of the account
+        files: List of dicts with 'filename' and 'size', plus an optional 'etag'
+            (S3 ETag as computed by the client) or 'checksum' (hex MD5 of the content)
+
+    Returns:
+        List of booleans, True where the stored file has the same content
+    """
     try:
         # Extract filenames from the provided list of dictionaries
         filenames = [file['filename'] for file in files]
         
         # Query the File table for entries matching the given account_id and filenames
         existing_files = File.query.filter(File.account_id == account_id, File.key.in_(filenames)).all()
-        existing_file_dict = {file.key: file.size for file in existing_files}
+        existing_file_dict = {file.key: file for file in existing_files}
+
+        result = []
+        for file in files:
+            existing_file = existing_file_dict.get(file['filename'])
+            if existing_file is None or existing_file.size != file.get('size'):
+                result.append(False)
+                continue
 
-        # Generate a list of booleans indicating if each filename exists and has the same size
-        result = [
-            file['filename'] in existing_file_dict and existing_file_dict[file['filename']] == file['size']
-            for file in files
-        ]
+            client_etag = normalize_etag(file.get('etag'))
+            checksum = normalize_etag(file.get('checksum'))
+            if client_etag and existing_file.etag:
+                result.append(client_etag == existing_file.etag)
+            elif checksum and existing_file.etag and '-' not in existing_file.etag:
+                # Single-part uploads use the MD5 of the content as their ETag
+                result.append(checksum == existing_file.etag)
+            else:
+                # No comparable checksum, fall back to matching size
+                result.append(True)
         return result
     except Exception as e:
         logging.error(f"Error in 'do_files_exist' function: {e}")
         return [False] * len(files)
 
+def normalize_etag(etag):
+    """Strip the quotes S3 wraps around ETags and lowercase them; None if empty."""
+    if not etag:
+        return None
+    return str(etag).strip().strip('"').lower() or None
+
+def file_content_changed(existing_file, size, last_modified, etag=None):
+    """
+    Decide whether an object differs from the stored File row.
+
+    When both ETags are known they decide on their own, so a rewritten object with
+    identical content (timestamp noise) is not treated as a change while a same-size
+    edit is. Otherwise size and last_modified are compared.
+    """
+    if existing_file.etag and etag:
+        return existing_file.etag != etag
+    return (existing_file.size != size or
+            _as_utc(existing_file.last_modified) != _as_utc(last_modified))
+
 def generate_s3_url(bucket_name, key):
     """Generate a publicly accessible HTTPS URL for a given bucket and key"""
     return f"https://{bucket_name}.s3.amazonaws.com/{key}"
@@ -256,6 +525,137 @@ def download_source_file(account_settings, source):
         logging.error(f"Error downloading source file for {source.name}: {e}")
         return None
 
+def upload_source_file(account_settings, source_name, content, extension='csv', metadata=None):
+    """
+    Upload a built source artifact to .hublink/source/ in the account's bucket.
+
+    Args:
+        account_settings: Setting object containing AWS credentials
+        source_name: Name of the source, used as the file name
+        content: File content as bytes
+        extension: 'csv' for the source CSV, 'parquet' for the columnar artifact,
+            'rollup.parquet' for the rollups (see rollups.py) or 'pyramid.parquet'
+            for the downsample pyramid (see pyramid.py)
+        metadata: Optional dict stored as S3 object metadata
+
+    Returns:
+        Tuple of (key, etag), or (None, None) if error
+    """
+    key = f".hublink/source/{source_name}.{extension}"
+    try:
+        s3_client = boto3.client(
+            's3',
+            aws_access_key_id=account_settings.aws_access_key_id,
+            aws_secret_access_key=account_settings.aws_secret_access_key,
+            region_name=os.getenv('AWS_REGION', 'us-east-1')
+        )
+        response = s3_client.put_object(
+            Bucket=account_settings.bucket_name,
+            Key=key,
+            Body=content,
+            ContentType='text/csv' if extension == 'csv' else 'application/vnd.apache.parquet',
+            Metadata=metadata or {}
+        )
+        return key, normalize_etag(response.get('ETag'))
+
+    except Exception as e:
+        logging.error(f"Error uploading source file {key}: {e}")
+        return None, None
+
+def download_source_artifact(account_settings, source, extension='parquet'):
+    """
+    Download a source's Parquet artifact from S3 into memory.
+
+    The artifact is only used when it was built from the current source CSV,
+    which it records as csv-etag in its object metadata. Sources built by the
+    Lambda have no artifact and are read from CSV.
+
+    Args:
+        account_settings: Setting object containing AWS credentials
+        source: Source object
+        extension: 'parquet' for the columnar artifact, 'rollup.parquet' for the rollups,
+            'pyramid.parquet' for the downsample pyramid
+
+    Returns: Parquet content as bytes, or None if missing or stale
+    """
+    if not source.file_id:
+        return None
+
+    try:
+        file = db.session.get(File, source.file_id)
+        if not file or not file.etag:
+            return None
+
+        s3_client = boto3.client(
+            's3',
+            aws_access_key_id=account_settings.aws_access_key_id,
+            aws_secret_access_key=account_settings.aws_secret_access_key,
+            region_name=os.getenv('AWS_REGION', 'us-east-1')
+        )
+        response = s3_client.get_object(
+            Bucket=account_settings.bucket_name,
+            Key=f".hublink/source/{source.name}.{extension}"
+        )
+
+        if response.get('Metadata', {}).get('csv-etag') != file.etag:
+            logging.info(f"Artifact {extension} for source {source.name} is stale, not using it")
+            return None
+        return response['Body'].read()
+
+    except botocore.exceptions.ClientError as e:
+        if e.response.get('Error', {}).get('Code') not in ('404', 'NoSuchKey'):
+            logging.error(f"Error downloading Parquet artifact for {source.name}: {e}")
+        return None
+    except Exception as e:
+        logging.error(f"Error downloading Parquet artifact for {source.name}: {e}")
+        return None
+
+def open_source_stream(account_settings, source, extension='csv'):
+    """
+    Open a source's CSV, or one of its artifacts, as a stream instead of
+    reading it into memory. Artifacts are only opened when they were built
+    from the current source CSV (see download_source_artifact).
+
+    Args:
+        account_settings: Setting object containing AWS credentials
+        source: Source object
+        extension: 'csv' for the source CSV, or an artifact such as 'parquet'
+
+    Returns: botocore StreamingBody to read and close, or None if missing, stale or error
+    """
+    if not source.file_id:
+        return None
+
+    try:
+        file = db.session.get(File, source.file_id)
+        if not file or (extension != 'csv' and not file.etag):
+            return None
+
+        s3_client = boto3.client(
+            's3',
+            aws_access_key_id=account_settings.aws_access_key_id,
+            aws_secret_access_key=account_settings.aws_secret_access_key,
+            region_name=os.getenv('AWS_REGION', 'us-east-1')
+        )
+        response = s3_client.get_object(
+            Bucket=account_settings.bucket_name,
+            Key=file.key if extension == 'csv' else f".hublink/source/{source.name}.{extension}"
+        )
+
+        if extension != 'csv' and response.get('Metadata', {}).get('csv-etag') != file.etag:
+            logging.info(f"Artifact {extension} for source {source.name} is stale, not using it")
+            response['Body'].close()
+            return None
+        return response['Body']
+
+    except botocore.exceptions.ClientError as e:
+        if e.response.get('Error', {}).get('Code') not in ('404', 'NoSuchKey'):
+            logging.error(f"Error opening {extension} stream for {source.name}: {e}")
+        return None
+    except Exception as e:
+        logging.error(f"Error opening {extension} stream for {source.name}: {e}")
+        return None
+
 def get_source_file_header(account_settings, source, num_lines=2):
     """
     Download only the header and first data row of a source's CSV file from S3.
@@ -928,17 +1328,19 @@ def update_specific_files(account_settings, file_keys):
                     Key=file_key
                 )
                 
+                etag = normalize_etag(obj.get('ETag'))
+
                 if file_key in existing_files:
                     # Update existing file
                     existing_file = existing_files[file_key]
-                    # If size or last_modified has changed, increment version
-                    if (existing_file.size != obj['ContentLength'] or 
-                        existing_file.last_modified != obj['LastModified']):
+                    # If the content has changed, increment version
+                    if file_content_changed(existing_file, obj['ContentLength'], obj['LastModified'], etag):
                         existing_file.version += 1
                         affected_files.append(existing_file)
                     
                     existing_file.size = obj['ContentLength']
                     existing_file.last_modified = obj['LastModified']
+                    existing_file.etag = etag or existing_file.etag
                     existing_file.url = generate_s3_url(account_settings.bucket_name, file_key)
                     db.session.add(existing_file)
                 else:
@@ -949,6 +1351,7 @@ def update_specific_files(account_settings, file_keys):
                         url=generate_s3_url(account_settings.bucket_name, file_key),
                         size=obj['ContentLength'],
                         last_modified=obj['LastModified'],
+                        etag=etag,
                         last_checked=datetime.now(timezone.utc),
                         version=1
                     )
@@ -961,6 +1364,7 @@ def update_specific_files(account_settings, file_keys):
                     # File doesn't exist in S3, remove from DB if present
                     if file_key in existing_files:
                         db.session.delete(existing_files[file_key])
+                        affected_files.append(existing_files[file_key])
                 else:
                     logging.error(f"Error checking file {file_key}: {str(e)}")
                     continue
@@ -971,4 +1375,176 @@ def update_specific_files(account_settings, file_keys):
     except Exception as e:
         logging.error(f"Error in update_specific_files: {str(e)}")
         db.session.rollback()
+        return []
+
+def extract_s3_event_records(payload):
+    """
+    Pull S3 event records out of a notification payload.
+
+    Accepts a raw S3 event, an SNS notification (HTTP or raw delivery), SQS
+    messages whose body carries either of those, or a list of any of these.
+
+    Args:
+        payload: Parsed JSON payload (dict, list or JSON string)
+
+    Returns:
+        List of S3 event record dictionaries
+    """
+    records = []
+
+    if isinstance(payload, str):
+        try:
+            payload = json.loads(payload)
+        except (json.JSONDecodeError, TypeError):
+            return records
+
+    if isinstance(payload, list):
+        for item in payload:
+            records.extend(extract_s3_event_records(item))
+        return records
+
+    if not isinstance(payload, dict):
+        return records
+
+    # SNS envelope: the S3 event is a JSON string in Message
+    if payload.get('Type') == 'Notification' and 'Message' in payload:
+        return extract_s3_event_records(payload['Message'])
+
+    for record in payload.get('Records', []):
+        if not isinstance(record, dict):
+            continue
+        if 's3' in record:
+            records.append(record)
+        elif 'body' in record:
+            # SQS message wrapping an S3 event or SNS notification
+            records.extend(extract_s3_event_records(record['body']))
+        elif 'Sns' in record:
+            records.extend(extract_s3_event_records(record['Sns'].get('Message')))
+
+    return records
+
+def _event_order(event):
+    """Sort key for events on the same object key (sequencer first, then event time)."""
+    try:
+        sequencer = int(event['sequencer'], 16) if event['sequencer'] else -1
+    except ValueError:
+        sequencer = -1
+    return (sequencer, event['last_modified'])
+
+def _as_utc(dt):
+    """Treat naive datetimes from the database as UTC so they compare with event times."""
+    if dt is not None and dt.tzinfo is None:
+        return dt.replace(tzinfo=timezone.utc)
+    return dt
+
+def apply_s3_events(account_settings, records):
+    """
+    Apply S3 event notification records to the File table in bulk.
+
+    Uses the size, ETag and event time carried by each record, so no follow-up
+    S3 calls are made. Only the latest event per key is applied.
+
+    Args:
+        account_settings: Setting object for the account the events belong to
+        records: List of S3 event records (see extract_s3_event_records)
+
+    Returns:
+        List of affected File objects
+    """
+    affected_files = []
+    latest_events = {}
+
+    for record in records:
+        try:
+            event_name = record.get('eventName', '')
+            if event_name.startswith('ObjectCreated'):
+                action = 'created'
+            elif event_name.startswith('ObjectRemoved'):
+                action = 'removed'
+            else:
+                continue
+
+            s3_data = record.get('s3', {})
+            bucket_name = s3_data.get('bucket', {}).get('name')
+            if bucket_name and bucket_name != account_settings.bucket_name:
+                logging.warning(f"Ignoring event for bucket {bucket_name} on account {account_settings.account_id}")
+                continue
+
+            obj = s3_data.get('object', {})
+            # Keys in event notifications are URL-encoded
+            file_key = unquote_plus(obj.get('key', ''))
+            if not file_key:
+                continue
+
+            event_time = record.get('eventTime')
+            event = {
+                'action': action,
+                'size': obj.get('size', 0),
+                'etag': normalize_etag(obj.get('eTag')),
+                'last_modified': parser.parse(event_time) if event_time else datetime.now(timezone.utc),
+                'sequencer': obj.get('sequencer', '')
+            }
+
+            previous = latest_events.get(file_key)
+            if previous is None or _event_order(event) >= _event_order(previous):
+                latest_events[file_key] = event
+        except Exception as e:
+            logging.error(f"Skipping malformed S3 event record: {e}")
+            continue
+
+    if not latest_events:
+        return affected_files
+
+    try:
+        existing_files = {
+            file.key: file
+            for file in File.query.filter_by(
+                account_id=account_settings.account_id
+            ).filter(File.key.in_(list(latest_events.keys()))).all()
+        }
+
+        for file_key, event in latest_events.items():
+            existing_file = existing_files.get(file_key)
+            # Events can arrive out of order; never let an older event overwrite newer state
+            is_stale = (existing_file is not None and existing_file.last_modified is not None and
+                        _as_utc(existing_file.last_modified) > event['last_modified'])
+
+            if event['action'] == 'removed':
+                if existing_file and not is_stale:
+                    affected_files.append(existing_file)
+                    db.session.delete(existing_file)
+                continue
+
+            if existing_file:
+                if is_stale:
+                    continue
+                if file_content_changed(existing_file, event['size'], event['last_modified'], event['etag']):
+                    existing_file.version += 1
+                    affected_files.append(existing_file)
+
+                existing_file.size = event['size']
+                existing_file.last_modified = event['last_modified']
+                existing_file.etag = event['etag'] or existing_file.etag
+                existing_file.url = generate_s3_url(account_settings.bucket_name, file_key)
+            else:
+                new_file = File(
+                    account_id=account_settings.account_id,
+                    key=file_key,
+                    url=generate_s3_url(account_settings.bucket_name, file_key),
+                    size=event['size'],
+                    last_modified=event['last_modified'],
+                    etag=event['etag'],
+                    last_checked=datetime.now(timezone.utc),
+                    version=1
+                )
+                db.session.add(new_file)
+                affected_files.append(new_file)
+
+        db.session.commit()
+        logging.info(f"Applied {len(latest_events)} S3 events for account {account_settings.account_id}")
+        return affected_files
+
+    except Exception as e:
+        logging.error(f"Error in apply_s3_events: {str(e)}")
+        db.session.rollback()
         return []
\ No newline at end of file
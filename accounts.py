@@ -9,20 +9,24 @@ import re
 import requests
 import os
 import json
-from plot_utils import get_plot_info, get_plot_data
+from plot_utils import get_cached_plot_info, get_plot_data, get_plot_window_data, time_window
+from layout_render import render_plots
+from downsample import downsample_indices, point_budget
+from job_queue import enqueue_job, PRIORITY_UPLOAD
 import tempfile
 import zipfile
 from werkzeug.utils import secure_filename
 import io
 import shutil
-from utils import admin_required, get_analytics, initiate_source_refresh, list_source_files, format_datetime
+from utils import admin_required, get_analytics, initiate_source_refresh, source_files_query, format_datetime, invalidate_source_matcher, sync_source_membership, rebuild_source_membership, ensure_source_membership, complete_source_refresh
 import dateutil.parser as parser
 import time
-from sqlalchemy import and_, not_
+from sqlalchemy import and_, not_, inspect
 import pytz
 from sqlalchemy import func, cast, Date
 from sqlalchemy.dialects.postgresql import INTERVAL
 import random
+from urllib.parse import urlparse
 
 # Create logger for this module
 logger = logging.getLogger(__name__)
@@ -238,13 +242,12 @@ def get_source_files(account_url, source_id):
         account = Account.query.filter_by(url=account_url).first_or_404()
         source = Source.query.filter_by(id=source_id, account_id=account.id).first_or_404()
             
-        # Get matching files for this source, excluding archived files
-        matching_files = list_source_files(account, source)
-        matching_files = [f for f in matching_files if not f.archived]
-        
-        # Sort by last_modified in descending order (most recent first) and limit to 300
-        matching_files.sort(key=lambda x: x.last_modified or datetime.min, reverse=True)
-        matching_files = matching_files[:300]  # Limit to 300 most recent files
+        # Get the 300 most recent matching files for this source, excluding archived files
+        matching_files = source_files_query(account, source)\
+            .filter(File.archived == False)\
+            .order_by(File.last_modified.desc())\
+            .limit(300)\
+            .all()
         
         # Filter files up to 12MB cumulative size
         filtered_files = []
@@ -288,27 +291,25 @@ def _update_sources_for_files(account, affected_files):
     
     # Get all sources for this account
     sources = Source.query.filter_by(account_id=account.id).all()
-    affected_sources = set()  # Use set to ensure uniqueness
     
-    # Create a set of affected file keys for efficient lookup
-    affected_file_keys = {file.key for file in affected_files}
-    
-    # For each source, check if any of its matching files were affected
-    for source in sources:
-        try:
-            matching_files = list_source_files(account, source)
-            # Check if any matching files were affected
-            if any(file.key in affected_file_keys for file in matching_files):
-                affected_sources.add(source)
-        except Exception as e:
-            logging.error(f"Error matching pattern for source {source.id}: {e}")
-            continue
+    # Apply the files to the source membership table; only sources whose
+    # membership changed need a refresh
+    affected_source_ids = sync_source_membership(account, sources, affected_files)
+    affected_sources = {source for source in sources if source.id in affected_source_ids}
     
-    # Set do_update=True for each affected source
+    # Set do_update=True for each affected source and queue its refresh, no
+    # sooner than SOURCE_INTERVAL_MINUTES after its last update. Refreshes are
+    # debounced, so the many small batches of one gateway sync become one rebuild
+    interval = timedelta(minutes=int(os.getenv('SOURCE_INTERVAL_MINUTES', '5')))
+    now = datetime.now(timezone.utc)
     refresh_count = 0
     for source in affected_sources:
         try:
             source.do_update = True
+            last_updated = source.last_updated.replace(tzinfo=timezone.utc) if source.last_updated else None
+            run_after = max(now, last_updated + interval) if last_updated else now
+            enqueue_job(account.id, 'source_refresh', source_id=source.id, priority=PRIORITY_UPLOAD,
+                        run_after=run_after, debounce=True)
             refresh_count += 1
             logging.info(f"Marked {account.name}: {source.id}|{source.name} for update")
         except Exception as e:
@@ -326,8 +327,13 @@ def rebuild(account_url):
         account = Account.query.filter_by(url=account_url).first_or_404()
         settings = Setting.query.filter_by(account_id=account.id).first_or_404()
 
+        # Optional S3 Inventory manifest to rebuild from instead of listing the bucket
+        manifest = request.args.get('manifest')
+        if manifest and not manifest.startswith('s3://'):
+            return jsonify({"error": "manifest must be an s3:// URI"}), 400
+
         # Get list of affected files from rebuild operation
-        affected_files = rebuild_S3_files(settings)
+        affected_files = rebuild_S3_files(settings, inventory_manifest=manifest)
         
         # Update sources using helper function
         refresh_count, _ = _update_sources_for_files(account, affected_files)
@@ -381,11 +387,12 @@ def account_plots(account_url):
         source_paths = {}
         
         for source in sources:
-            # Get files for this source
-            files = list_source_files(account, source)
-            if files:
+            # Get the newest file for this source from its membership aggregates
+            ensure_source_membership(account, source)
+            first_file = db.session.get(File, source.newest_file_id) if source.newest_file_id else None
+            if first_file:
                 # Get the first file's path segments, including filename
-                path_segments = files[0].key.split('/')
+                path_segments = first_file.key.split('/')
                 # Create a list of truncated segments (now including the filename)
                 truncated_segments = []
                 for segment in path_segments:
@@ -399,6 +406,9 @@ def account_plots(account_url):
                     })
                 source_paths[source.id] = truncated_segments
         
+        # Persist any membership backfilled above
+        db.session.commit()
+        
         # Get layout plot names for display
         layout_plot_names = {}
         for layout in account.layouts:
@@ -524,7 +534,10 @@ def create_source(account_url):
             db.session.add(source)
             flash_message = 'Source created successfully'
         
+        db.session.flush()
+        rebuild_source_membership(account, source)
         db.session.commit()
+        invalidate_source_matcher(account.id)
         
         # Get settings and initiate refresh
         success, error = initiate_source_refresh(account, source)
@@ -570,6 +583,7 @@ def delete_source(account_url, source_id):
         # Delete the source (this will cascade delete all its plots)
         db.session.delete(source)
         db.session.commit()
+        invalidate_source_matcher(account.id)
         
         flash('Source deleted successfully.', 'success')
     except Exception as e:
@@ -602,7 +616,9 @@ def edit_source(account_url, source_id):
         source.tail_only = tail_only
         source.data_points = data_points
         
+        rebuild_source_membership(source.account, source)
         db.session.commit()
+        invalidate_source_matcher(source.account_id)
 
         # Get settings and initiate refresh
         settings = Setting.query.filter_by(account_id=source.account_id).first_or_404()
@@ -728,6 +744,37 @@ def create_plot(account_url, source_id):
     
     return redirect(url_for('accounts.account_plots', account_url=account_url))
 
+@accounts_bp.route('/<account_url>/plot/<int:plot_id>/data', methods=['GET'])
+def plot_window_data(account_url, plot_id):
+    """
+    Timeline plot data for a zoom window: ?start=&end= (wall-clock times) and
+    ?width= (pixels). Returns the figure's traces at about one point per pixel.
+    """
+    account = Account.query.filter_by(url=account_url).first_or_404()
+    plot = Plot.query.join(Source).filter(Plot.id == plot_id, Source.account_id == account.id).first_or_404()
+    if plot.type != 'timeline':
+        return jsonify({'success': False, 'error': 'Only timeline plots can be zoomed'}), 400
+
+    start, end = request.args.get('start'), request.args.get('end')
+    if not start or not end:
+        return jsonify({'success': False, 'error': 'start and end are required'}), 400
+
+    try:
+        plot_data = get_plot_window_data(plot, start, end, point_budget(request.args.get('width', type=int)))
+        if not plot_data or plot_data.get('error'):
+            return jsonify({'success': False, 'error': (plot_data or {}).get('error', 'No plot data')})
+
+        return app.response_class(plot_data['plotly_json'], mimetype='application/json')
+
+    except ValueError as e:
+        return jsonify({'success': False, 'error': f'Invalid time range: {e}'}), 400
+    except Exception as e:
+        logging.error(f"Error loading window data for plot {plot_id} in {account_url}: {e}")
+        return jsonify({
+            'success': False,
+            'error': 'Error loading plot data'
+        }), 500
+
 @accounts_bp.route('/<account_url>/plot/<int:plot_id>/delete', methods=['POST'])
 def delete_plot(account_url, plot_id):
     account = Account.query.filter_by(url=account_url).first_or_404()
@@ -837,27 +884,22 @@ def _get_layout_data(account, layout):
         # Get all required plots
         plots = Plot.query.filter(Plot.id.in_(required_plot_ids)).all()
         
-        # Get unique sources and pre-fetch their data
-        source_data = {}
-        unique_sources = {plot.source_id: plot.source for plot in plots}
-        
-        # Pre-fetch source data
-        for source in unique_sources.values():
-            start_time = time.time()
-            csv_content = download_source_file(account.settings, source)
-            download_time = time.time() - start_time
-            logging.info(f"Source {source.name} download took {download_time:.2f} seconds")
-            source_data[source.id] = csv_content
-
-        # Generate plot information with source data
-        plot_info_arr = []
-        for plot in plots:
-            start_time = time.time()
-            plot_info = get_plot_info(plot, source_data.get(plot.source_id))
-            plot_time = time.time() - start_time
-            logging.info(f"Plot {plot.name} generation took {plot_time:.2f} seconds")
-            if plot_info:
-                plot_info_arr.append(plot_info)
+        # Rows before the layout's time range are dropped while loading
+        window_start = time_window(layout.time_range, account.settings.timezone if account.settings else None)
+        
+        # Plots whose source hasn't changed since their last render come from the cache
+        cached_info = {plot.id: get_cached_plot_info(plot, window_start) for plot in plots}
+        stale_plots = [plot for plot in plots if cached_info[plot.id] is None]
+        logging.info(f"Layout {layout.id}: {len(plots) - len(stale_plots)} plots cached, {len(stale_plots)} to render")
+
+        # Render the rest concurrently: each source is loaded once, with the columns all
+        # of its plots need, and plots that miss the deadline come back as placeholders
+        start_time = time.time()
+        rendered_info = render_plots(stale_plots, window_start)
+        if stale_plots:
+            logging.info(f"Layout {layout.id}: rendering {len(stale_plots)} plots took {time.time() - start_time:.2f} seconds")
+
+        plot_info_arr = [cached_info[plot.id] or rendered_info[plot.id] for plot in plots]
         
         # Create a new layout object with parsed config
         layout_data = {
@@ -1261,8 +1303,14 @@ def delete_files(account_url):
             flash(error_message or 'Failed to delete files', 'error')
             return jsonify({'error': error_message or 'Failed to delete files'}), 500
             
-        # Rebuild S3 files using target account settings
-        rebuild_S3_files(target_settings)
+        # Deleted files leave their sources (and the source aggregates)
+        deleted_files = [file for file in files if inspect(file).was_deleted]
+        sources = Source.query.filter_by(account_id=target_account.id).all()
+        sync_source_membership(target_account, sources, deleted_files)
+        db.session.commit()
+
+        # Rebuild S3 files using target account settings and apply whatever else changed
+        _update_sources_for_files(target_account, rebuild_S3_files(target_settings))
         
         # Add success flash message
         flash(f'Successfully deleted {len(files)} file(s)', 'success')
@@ -1664,6 +1712,11 @@ def node_battery_history(account_url, uuid):
                 'error': 'No battery history available'
             })
         
+        # Reduce long histories to the point budget (?points=N), keeping every low and high
+        levels = [entry.battery_level for entry in battery_history]
+        keep = downsample_indices(range(len(levels)), levels, request.args.get('points', type=int), method='minmax')
+        battery_history = [battery_history[i] for i in keep]
+        
         # Format data for plotting
         data = {
             'timestamps': [entry.created_at.isoformat() for entry in battery_history],
@@ -1955,14 +2008,9 @@ def source_callback(account_url, source_id):
         key = data.get('key', '').strip()
         error = data.get('error', '').strip()
         
-        # Update source timestamp
-        source.last_updated = datetime.now(timezone.utc)
-        
         # Handle error state (including empty key)
         if error or not key:
-            source.state = 'error'
-            source.error = error if error else 'Empty or missing key field'
-            db.session.commit()
+            complete_source_refresh(account, source, error=error)
             
             return jsonify({
                 'message': 'Source error state updated',
@@ -1971,42 +2019,8 @@ def source_callback(account_url, source_id):
         
         logging.info(f"Processing Lambda callback for source: {source.name} (ID: {source.id})")
         
-        # Update source fields for success case
-        source.state = 'success'
-        source.error = None  # Clear any previous error
-        
-        # Get matching files and calculate max_path_level
-        matching_files = list_source_files(account, source)
-        max_level = 0
-        for file in matching_files:
-            path_segments = file.key.strip('/').split('/')
-            max_level = max(max_level, len(path_segments))
-        
-        source.max_path_level = max_level
-        
-        # Handle file record only if we have a valid key and size
-        if 'size' in data:
-            file = File.query.filter_by(account_id=account.id, key=key).first()
-            if not file:
-                logging.info(f"Creating new file record for key: {key}")
-                file = File(
-                    account_id=account.id,
-                    key=key,
-                    url=generate_s3_url(account.settings.bucket_name, key),
-                    size=data['size'],
-                    last_modified=datetime.now(timezone.utc),
-                    version=1
-                )
-                db.session.add(file)
-                db.session.flush()
-            else:
-                file.size = data['size']
-                file.version += 1
-                file.last_modified = datetime.now(timezone.utc)
-            
-            source.file_id = file.id
-        
-        db.session.commit()
+        # Update source state and its file record (only when a size is provided)
+        complete_source_refresh(account, source, key=key, size=data.get('size'))
         
         return jsonify({
             'message': 'Source updated successfully',
@@ -2193,7 +2207,8 @@ def list_files_json(account_url, since_datetime=None):
         # Format response
         response = [{
             'key': file.key,
-            'size': file.size
+            'size': file.size,
+            'etag': file.etag
         } for file in files]
         
         return jsonify(response)
@@ -2282,6 +2297,124 @@ def update_files(account_url):
             'error': str(e)
         }), 500
 
+"""
+Example curl command to test this endpoint:
+
+curl -X POST http://127.0.0.1:5000/your-account-url/files/exist \
+  -H "Content-Type: application/json" \
+  -d '{
+    "files": [
+      {"filename": "data/file1.csv", "size": 1024, "checksum": "d41d8cd98f00b204e9800998ecf8427e"},
+      {"filename": "data/file2.csv", "size": 2048}
+    ]
+  }'
+
+Response on success (one entry per requested file, in order):
+{
+    "exists": [true, false]
+}
+"""
+@accounts_bp.route('/<account_url>/files/exist', methods=['POST'])
+def files_exist(account_url):
+    """Tell a gateway which files are already stored so unchanged files can be skipped."""
+    try:
+        account = Account.query.filter_by(url=account_url).first_or_404()
+
+        data = request.get_json()
+        if not data or not isinstance(data.get('files'), list):
+            return jsonify({
+                'error': 'Missing files in request body'
+            }), 400
+
+        files = data['files']
+        if any(not isinstance(file, dict) or 'filename' not in file for file in files):
+            return jsonify({
+                'error': 'Each file needs a filename'
+            }), 400
+
+        return jsonify({
+            'exists': do_files_exist(account.id, files)
+        }), 200
+
+    except Exception as e:
+        logging.error(f"Error checking files for {account_url}: {e}")
+        return jsonify({
+            'error': str(e)
+        }), 500
+
+"""
+Example curl command to test this endpoint with a raw S3 event:
+
+curl -X POST http://127.0.0.1:5000/your-account-url/events \
+  -H "Content-Type: application/json" \
+  -d '{
+    "Records": [{
+      "eventName": "ObjectCreated:Put",
+      "eventTime": "2025-01-01T12:00:00.000Z",
+      "s3": {
+        "bucket": {"name": "your-bucket"},
+        "object": {"key": "data/file1.csv", "size": 1024, "eTag": "d41d8cd98f00b204e9800998ecf8427e", "sequencer": "0062E99A88DC407460"}
+      }
+    }]
+  }'
+
+SNS notifications (including the SubscriptionConfirmation handshake) and SQS
+messages carrying S3 events are unwrapped automatically.
+
+Response on success:
+{
+    "message": "Events applied successfully",
+    "records": 1,
+    "affected_files": 1,
+    "marked_for_refresh": 1
+}
+"""
+@accounts_bp.route('/<account_url>/events', methods=['POST'])
+def s3_events(account_url):
+    """Apply S3 event notifications to the file catalog without calling S3."""
+    try:
+        account = Account.query.filter_by(url=account_url).first_or_404()
+        settings = Setting.query.filter_by(account_id=account.id).first_or_404()
+
+        # SNS posts with a text/plain content type, so parse regardless of headers
+        data = request.get_json(force=True, silent=True)
+        if not data:
+            return jsonify({
+                'error': 'Missing event payload in request body'
+            }), 400
+
+        if isinstance(data, dict) and data.get('Type') == 'SubscriptionConfirmation':
+            subscribe_url = data.get('SubscribeURL', '')
+            host = urlparse(subscribe_url).hostname or ''
+            if not subscribe_url.startswith('https://') or not host.endswith('.amazonaws.com'):
+                return jsonify({
+                    'error': 'Invalid SubscribeURL'
+                }), 400
+            requests.get(subscribe_url, timeout=10)
+            logging.info(f"Confirmed SNS subscription for {account.id}|{account.name}")
+            return jsonify({
+                'message': 'Subscription confirmed'
+            }), 200
+
+        records = extract_s3_event_records(data)
+        affected_files = apply_s3_events(settings, records)
+
+        # Update sources using helper function
+        refresh_count, _ = _update_sources_for_files(account, affected_files)
+
+        return jsonify({
+            'message': 'Events applied successfully',
+            'records': len(records),
+            'affected_files': len(affected_files),
+            'marked_for_refresh': refresh_count
+        }), 200
+
+    except Exception as e:
+        logging.error(f"Error applying S3 events for {account_url}: {e}")
+        return jsonify({
+            'error': str(e)
+        }), 500
+
 @accounts_bp.route('/<account_url>/gateway/<int:gateway_id>/delete', methods=['POST'])
 def delete_gateway(account_url, gateway_id):
     try:
@@ -1,6 +1,6 @@
 from flask import Flask, g, redirect, render_template, jsonify, request, url_for, session, flash
 from flask_migrate import Migrate, upgrade
-from models import db, Account, Setting, File, Gateway, Source, Admin, Node # db locations
+from models import db, Account, Setting, File, Gateway, Source, Admin, Node, Job # db locations
 from S3Manager import setup_aws_resources, cleanup_aws_resources, get_storage_usage
 import os
 import logging
@@ -14,6 +14,7 @@ from sqlalchemy import text
 from sqlalchemy.pool import QueuePool
 from functools import wraps
 from utils import admin_required, get_analytics, get_database_statistics, initiate_source_refresh, format_datetime, format_file_size, format_datetime
+from job_queue import work, PRIORITY_UPLOAD
 
 load_dotenv(override=True)
 
@@ -569,11 +570,17 @@ def cronjob():
             app.logger.info(f"Looking for sources not updated since {cutoff_time}")
             print(f"/cronjob: Looking for sources not updated since {cutoff_time}")
             
-            # Find sources that need updating
+            # Find sources that need updating and have no refresh queued or running
+            # (queued refreshes may be waiting out an upload burst)
+            queued_source_ids = db.session.query(Job.source_id).filter(
+                Job.kind == 'source_refresh',
+                Job.status.in_(['pending', 'running'])
+            )
             sources = Source.query.filter(
                 Source.do_update == True,
                 (Source.last_updated == None) | 
-                (Source.last_updated <= cutoff_time.replace(tzinfo=None))  # Remove timezone info for comparison
+                (Source.last_updated <= cutoff_time.replace(tzinfo=None)),  # Remove timezone info for comparison
+                ~Source.id.in_(queued_source_ids)
             ).all()
             
             app.logger.info(f"Found {len(sources)} sources that need updating")
@@ -585,27 +592,39 @@ def cronjob():
                         f"needs_update={(last_updated is None) or (last_updated <= cutoff_time)}")
             
             for source in sources:
-                # Get the account for this source
+                # Get the account for this source; queue any refresh that was missed
                 account = db.session.get(Account, source.account_id)
                 if account:
-                    success, _ = initiate_source_refresh(account, source)
+                    success, _ = initiate_source_refresh(account, source, priority=PRIORITY_UPLOAD)
                     if success:
                         updated_count += 1
         
+        # Work through queued refreshes for a bounded time (set JOB_DRAIN_SECONDS=0 when worker.py runs).
+        # Only refreshes that trigger the Lambda are quick enough to run inside this request; local
+        # builds (SOURCE_BUILDER=local) and other job kinds are left to worker.py
+        drain_seconds = int(os.getenv('JOB_DRAIN_SECONDS', '20'))
+        if os.environ.get('SOURCE_BUILDER') == 'local':
+            drain_seconds = 0
+        jobs_processed = work(f"cronjob:{os.getpid()}", max_seconds=drain_seconds,
+                              kinds=('source_refresh',)) if drain_seconds > 0 else 0
+
+        if app.config['ENVIRONMENT'] == 'production':
             return jsonify({
                 'success': True,
-                'message': f'Processed {len(sources)} sources, updated {updated_count}, cleaned {total_deleted} gateways',
+                'message': f'Processed {len(sources)} sources, updated {updated_count}, ran {jobs_processed} jobs, cleaned {total_deleted} gateways',
                 'processed': len(sources),
                 'updated': updated_count,
+                'jobs_processed': jobs_processed,
                 'gateways_cleaned': total_deleted,
                 'total_old_gateways': total_old_gateways
             })
         else:
             return jsonify({
                 'success': True,
-                'message': f'Cronjob completed successfully (non-production environment), cleaned {total_deleted} gateways',
+                'message': f'Cronjob completed successfully (non-production environment), ran {jobs_processed} jobs, cleaned {total_deleted} gateways',
                 'processed': 0,
                 'updated': 0,
+                'jobs_processed': jobs_processed,
                 'gateways_cleaned': total_deleted,
                 'total_old_gateways': total_old_gateways
             })
@@ -0,0 +1,213 @@
+"""
+Benchmarks for the plot processing in plot_utils.
+
+Builds a synthetic source in memory and times each step against the row-by-row
+implementation it replaced. Not part of the app; run from the repository root:
+
+    python benchmarks/bench_plot_utils.py [points]
+"""
+import base64
+import json
+import os
+import sys
+import time
+from types import SimpleNamespace
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from plot_utils import (short_file_path, short_file_paths, accumulate_across_files, aggregate_time_bins,
+                        process_timeseries_plot, process_timebin_plot)
+from rollups import build_rollups, plot_rollups, combine_rollups
+from stream_stats import QuantileSketch, summarize_chunks
+
+def make_frame(points, files=50, groups=5):
+    """Synthetic source rows: `files` files spread over `groups` device directories."""
+    rng = np.random.default_rng(0)
+    file_index = np.repeat(np.arange(files), -(-points // files))[:points]
+    return pd.DataFrame({
+        'file_path': [f"devices/device_{i % groups:02d}/logs/2024/data_{i:04d}.csv" for i in file_index],
+        'datetime': pd.date_range('2024-01-01', periods=points, freq='min'),
+        'value': rng.normal(10, 2, points)
+    })
+
+def timed(fn, repeat=3):
+    """Best wall time of `repeat` runs, in seconds."""
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+def hover_rows(df):
+    """Previous hover construction: one formatted string per row."""
+    hover_texts = []
+    for _, row in df.iterrows():
+        date_str = row['datetime'].strftime('%Y-%m-%d %H:%M:%S')
+        hover_texts.append(f"Date: {date_str}<br>Value: {row['value']:.2f}<br>File: {short_file_path(row['file_path'])}")
+    return hover_texts
+
+def hover_vectorized(df):
+    """Current hover construction: shortened paths as customdata, the rest is a hovertemplate."""
+    return short_file_paths(df['file_path'])
+
+def bench_hover(points):
+    df = make_frame(points)
+    before = timed(lambda: hover_rows(df), repeat=1)
+    after = timed(lambda: hover_vectorized(df))
+    return before, after
+
+def accumulate_rows(df, value_col, group_col=None):
+    """Previous accumulation: a Python running total that carries over at file boundaries."""
+    parts = []
+    for _, group_df in (df.groupby(group_col, sort=True) if group_col else [(None, df)]):
+        last_value = 0
+        accumulated_data = []
+        current_file = None
+        for _, row in group_df.iterrows():
+            if current_file != row['file_path']:
+                current_file = row['file_path']
+                if accumulated_data:
+                    last_value = accumulated_data[-1]
+            accumulated_data.append(last_value + row[value_col])
+        parts.append(pd.Series(accumulated_data, index=group_df.index))
+    return pd.concat(parts)
+
+def bench_accumulate(points):
+    """Check the vectorized accumulation against the previous loop, then time both."""
+    df = make_frame(points)
+    # Interleave files in time, as happens when devices upload overlapping logs
+    df['datetime'] = df['datetime'].sample(frac=1, random_state=0).to_numpy()
+    df['group'] = df['file_path'].str.split('/').str[1]
+    df = df.sort_values(['group', 'datetime'])
+
+    for group_col in (None, 'group'):
+        ordered = df if group_col else df.sort_values('datetime')
+        expected = accumulate_rows(ordered, 'value', group_col)
+        actual = accumulate_across_files(ordered, 'value', group_col)
+        assert np.allclose(expected.loc[ordered.index], actual), f"accumulate mismatch (group_col={group_col})"
+
+    before = timed(lambda: accumulate_rows(df, 'value', 'group'), repeat=1)
+    after = timed(lambda: accumulate_across_files(df, 'value', 'group'))
+    return before, after
+
+def bin_rows(df, bins):
+    """Previous timebin aggregation: pd.cut, then two groupbys per masked group."""
+    results = []
+    for group in sorted(df['group'].unique()):
+        group_df = df[df['group'] == group].copy()
+        group_df['bin'] = pd.cut(group_df['datetime'], bins=bins, labels=bins[:-1], include_lowest=True)
+        group_df = group_df.dropna(subset=['bin'])
+        results.append((group_df.groupby('bin', observed=True)['value'].sum(),
+                        group_df.groupby('bin', observed=True)['value'].count()))
+    return results
+
+def bench_timebin(points):
+    """Check the single-pass binning against pd.cut + groupby, then time both."""
+    df = make_frame(points, groups=20)
+    df['group'] = df['file_path'].str.split('/').str[1]
+    bins = pd.date_range(df['datetime'].min().normalize(), df['datetime'].max().normalize() + pd.Timedelta(days=1), freq='1h')
+
+    for (expected_sums, expected_counts), (_, starts, sums, counts) in zip(
+            bin_rows(df, bins), aggregate_time_bins(df['datetime'], df['value'], bins, df['group'])):
+        assert list(pd.DatetimeIndex(np.asarray(expected_sums.index))) == list(starts), "timebin bins mismatch"
+        assert np.allclose(expected_sums.to_numpy(), sums) and np.array_equal(expected_counts.to_numpy(), counts), \
+            "timebin values mismatch"
+
+    before = timed(lambda: bin_rows(df, bins))
+    after = timed(lambda: aggregate_time_bins(df['datetime'], df['value'], bins, df['group']))
+    return before, after
+
+def bench_timeseries(points):
+    """End to end timeline plot from CSV source text (includes decimation and JSON encoding)."""
+    df = make_frame(points)
+    source_data = df.to_csv(index=False)
+    plot = SimpleNamespace(
+        id=0, name='bench', type='timeline', group_by=1,
+        config_json={'y_data': 'value'}, advanced_json=[],
+        source=SimpleNamespace(datetime_column='datetime', name='bench')
+    )
+    return timed(lambda: process_timeseries_plot(plot, source_data))
+
+def typed_array(value):
+    """Decode a plot_json typed array."""
+    return np.frombuffer(base64.b64decode(value['bdata']), dtype=np.dtype(value['dtype']).newbyteorder('<'))
+
+def bench_rollups(points):
+    """Check a grouped timebin plot from rollups against the raw rows, then time both."""
+    df = make_frame(points, groups=20)
+    rollups = build_rollups(df, 'datetime')
+    plot = SimpleNamespace(
+        id=0, name='bench', type='timebin', group_by=1,
+        config_json={'y_data': 'value', 'bin_hrs': 6}, advanced_json=[],
+        source=SimpleNamespace(datetime_column='datetime', name='bench')
+    )
+    rows = plot_rollups(rollups, plot)
+
+    raw = process_timebin_plot(plot, df)
+    rolled = process_timebin_plot(plot, None, rows)
+    assert raw['error'] is None and rolled['error'] is None, "timebin plot failed"
+    for expected, actual in zip(json.loads(raw['plotly_json'])['data'], json.loads(rolled['plotly_json'])['data']):
+        assert expected['name'] == actual['name'] and expected['customdata'] == actual['customdata'], \
+            "rollup timebin bins differ from raw rows"
+        assert np.allclose(typed_array(expected['y']), typed_array(actual['y'])), "rollup timebin values differ"
+
+    before = timed(lambda: process_timebin_plot(plot, df))
+    after = timed(lambda: process_timebin_plot(plot, None, rows))
+    return before, after
+
+def bench_stream_stats(points):
+    """Check chunked per-file statistics and sketch quartiles against the whole frame, then time both."""
+    df = make_frame(points)
+    chunks = lambda: (df.iloc[start:start + 10_000] for start in range(0, len(df), 10_000))
+    whole = lambda: df.groupby(df['file_path'].str.split('/').str[1])['value'].agg(['count', 'mean', 'std', 'min', 'max'])
+
+    rows = summarize_chunks(chunks(), ['value'], {'value'})['value']
+    streamed = combine_rollups(rows.assign(group=rows['file_path'].str.split('/').str[1]), 'group')
+    expected = whole()
+    assert np.allclose(expected.to_numpy(), streamed[expected.columns].to_numpy()), "streamed statistics differ"
+
+    sketch = QuantileSketch(seed=0)
+    for file_sketch in rows['sketch']:
+        sketch.merge(file_sketch)
+    values = np.sort(df['value'].to_numpy())
+    for q, estimate in zip((0.25, 0.5, 0.75), sketch.quantiles([0.25, 0.5, 0.75])):
+        assert abs(np.searchsorted(values, estimate) / len(values) - q) < 0.02, "sketch quartile out of bounds"
+
+    before = timed(whole)
+    after = timed(lambda: summarize_chunks(chunks(), ['value'], {'value'}))
+    return before, after
+
+def check_windowed_accumulate():
+    """An accumulating timeline under a layout time range shows the whole-history totals from its start."""
+    df = pd.DataFrame({
+        'file_path': ['a.csv', 'a.csv', 'b.csv', 'b.csv'],
+        'datetime': pd.to_datetime(['2024-06-01', '2024-06-02', '2025-06-01', '2025-06-02']),
+        'value': [10.0, 10.0, 1.0, 1.0]
+    })
+    plot = SimpleNamespace(
+        id=0, name='check', type='timeline', group_by=None,
+        config_json={'y_data': 'value', 'point_budget': 100}, advanced_json=['accumulate'],
+        source=SimpleNamespace(datetime_column='datetime', name='check')
+    )
+    whole = typed_array(json.loads(process_timeseries_plot(plot, df)['plotly_json'])['data'][0]['y'])
+    windowed = process_timeseries_plot(plot, df, since=(pd.Timestamp('2025-01-01'), None))
+    assert windowed['error'] is None, "windowed accumulate plot failed"
+    assert np.array_equal(typed_array(json.loads(windowed['plotly_json'])['data'][0]['y']), whole[2:]), \
+        "accumulated values restart at the time range start"
+
+def report(name, before, after, points):
+    scale = 100_000 / points
+    print(f"{name:<24} before {before * scale * 1000:9.1f} ms/100k   after {after * scale * 1000:9.1f} ms/100k   "
+          f"speedup {before / after:6.1f}x")
+
+if __name__ == '__main__':
+    points = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    check_windowed_accumulate()
+    report('hover text', *bench_hover(points), points)
+    report('accumulate (grouped)', *bench_accumulate(points), points)
+    report('timebin (20 groups)', *bench_timebin(points), points)
+    report('timebin from rollups', *bench_rollups(points), points)
+    report('chunked box/table stats', *bench_stream_stats(points), points)
+    print(f"{'timeline plot (total)':<24} {bench_timeseries(points) * 1000:.1f} ms for {points} points")
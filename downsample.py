@@ -0,0 +1,150 @@
+"""
+Shape-preserving downsampling for plotted series.
+
+Series are reduced to a point budget after they have been parsed, instead of
+skipping rows while reading. Two methods are available:
+
+- 'lttb': Largest-Triangle-Three-Buckets, which keeps the points that carry
+  the visual shape of a line (peaks, dips and turns).
+- 'minmax': the minimum and maximum of each bucket, which guarantees that no
+  spike or alarm value is dropped.
+
+The budget is PLOT_POINT_BUDGET points per series unless a plot or request
+asks for another.
+"""
+import os
+import numpy as np
+
+DEFAULT_POINT_BUDGET = int(os.getenv('PLOT_POINT_BUDGET', '2000'))
+MIN_POINT_BUDGET = 10
+MAX_POINT_BUDGET = 100_000
+
+def point_budget(requested=None):
+    """Clamp a requested point budget (e.g. from a plot config or a viewport width)."""
+    try:
+        budget = int(requested) if requested else DEFAULT_POINT_BUDGET
+    except (TypeError, ValueError):
+        budget = DEFAULT_POINT_BUDGET
+    return max(MIN_POINT_BUDGET, min(budget, MAX_POINT_BUDGET))
+
+def _as_float(values):
+    """Numeric view of x values; datetimes become nanoseconds."""
+    values = np.asarray(values)
+    if np.issubdtype(values.dtype, np.datetime64):
+        return values.astype('datetime64[ns]').astype(np.int64).astype(np.float64)
+    return values.astype(np.float64)
+
+def lttb_indices(x, y, budget):
+    """
+    Select `budget` points with Largest-Triangle-Three-Buckets.
+
+    The first and last points are always kept. The points in between are split
+    into budget - 2 buckets; from each bucket the point forming the largest
+    triangle with the previously selected point and the average of the next
+    bucket is kept. The work within a bucket is vectorized, so the Python loop
+    runs once per output point, not once per input point.
+
+    Args:
+        x: Sorted x values (numbers or datetimes)
+        y: y values without NaNs
+        budget: Number of points to keep
+
+    Returns:
+        Sorted array of selected positions
+    """
+    n = len(y)
+    if budget >= n or n <= 2:
+        return np.arange(n)
+    if budget < 3:
+        return np.array([0, n - 1])
+
+    x = _as_float(x)
+    y = np.asarray(y, dtype=np.float64)
+
+    # Bucket edges over the points between the first and the last
+    edges = np.linspace(1, n - 1, budget - 1).astype(np.int64)
+    # Average of each bucket, used as the third triangle vertex for the bucket before it
+    sums_x = np.add.reduceat(x[1:n - 1], edges[:-1] - 1)
+    sums_y = np.add.reduceat(y[1:n - 1], edges[:-1] - 1)
+    counts = np.diff(edges)
+    avg_x = np.append(sums_x / counts, x[-1])[1:]
+    avg_y = np.append(sums_y / counts, y[-1])[1:]
+
+    selected = np.empty(budget, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    prev = 0
+    for i in range(budget - 2):
+        start, end = edges[i], edges[i + 1]
+        # Twice the triangle area for every candidate in the bucket
+        area = np.abs((x[prev] - avg_x[i]) * (y[start:end] - y[prev])
+                      - (x[prev] - x[start:end]) * (avg_y[i] - y[prev]))
+        prev = start + int(np.argmax(area))
+        selected[i + 1] = prev
+    return selected
+
+def minmax_indices(y, budget):
+    """
+    Keep the minimum and maximum of each of budget / 2 equal-count buckets.
+
+    Args:
+        y: y values without NaNs
+        budget: Number of points to keep (at most)
+
+    Returns:
+        Sorted array of selected positions
+    """
+    n = len(y)
+    if budget >= n:
+        return np.arange(n)
+
+    y = np.asarray(y, dtype=np.float64)
+    buckets = max(1, budget // 2)
+    bucket = np.arange(n) * buckets // n
+    starts = np.searchsorted(bucket, np.arange(buckets))
+
+    # Bucket extremes, then the first position in each bucket that attains them
+    selected = []
+    for extreme in (np.minimum.reduceat(y, starts), np.maximum.reduceat(y, starts)):
+        hits = np.flatnonzero(y == extreme[bucket])
+        _, first = np.unique(bucket[hits], return_index=True)
+        selected.append(hits[first])
+    return np.unique(np.concatenate(selected))
+
+def downsample_indices(x, y, budget=None, method='lttb'):
+    """Select the positions of a series to plot. See lttb_indices and minmax_indices."""
+    budget = point_budget(budget)
+    if method == 'minmax':
+        return minmax_indices(y, budget)
+    return lttb_indices(x, y, budget)
+
+def downsample(df, x_col, y_col, budget=None, method='lttb', group_col=None):
+    """
+    Reduce a DataFrame to at most `budget` rows per series.
+
+    Args:
+        df (pd.DataFrame): Rows sorted by x_col (within each group)
+        x_col (str): x column
+        y_col (str): y column, without NaNs
+        budget (int): Points per series (default PLOT_POINT_BUDGET)
+        method (str): 'lttb' or 'minmax'
+        group_col (str): Optional column splitting df into separate series
+
+    Returns:
+        pd.DataFrame: The selected rows, in their original order
+    """
+    budget = point_budget(budget)
+    if group_col is None:
+        if len(df) <= budget:
+            return df
+        return df.iloc[downsample_indices(df[x_col].to_numpy(), df[y_col].to_numpy(), budget, method)]
+
+    positions = []
+    group_positions = df.groupby(group_col, sort=False, observed=True).indices
+    for rows in group_positions.values():
+        if len(rows) <= budget:
+            positions.append(rows)
+        else:
+            keep = downsample_indices(df[x_col].to_numpy()[rows], df[y_col].to_numpy()[rows], budget, method)
+            positions.append(rows[keep])
+    return df.iloc[np.sort(np.concatenate(positions))] if positions else df
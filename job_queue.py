@@ -0,0 +1,293 @@
+"""
+Durable job queue backed by the job table.
+
+Jobs are enqueued by the web app (source creation, uploads, rebuilds, the
+cronjob, plot warm-ups after a refresh) and processed by worker processes (worker.py) or by the cronjob
+draining the queue for a bounded time. Workers claim jobs with
+SELECT ... FOR UPDATE SKIP LOCKED, so several can run side by side; a claim is
+a lease, and jobs whose lease expired (crashed worker) are claimed again.
+"""
+import logging
+import os
+import random
+import time
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import and_, case, or_, func, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from models import db, Job, Account, Source
+
+# Priorities: user actions jump ahead of refreshes triggered by uploads
+PRIORITY_USER = 10
+PRIORITY_UPLOAD = 0
+PRIORITY_WARMUP = -10  # Plot warm-ups after a refresh wait for pending refreshes
+
+def _now():
+    return datetime.now(timezone.utc)
+
+def _as_utc(dt):
+    """Treat naive datetimes from the database as UTC."""
+    return dt.replace(tzinfo=timezone.utc) if dt is not None and dt.tzinfo is None else dt
+
+def enqueue_job(account_id, kind, source_id=None, priority=PRIORITY_UPLOAD, run_after=None, debounce=False):
+    """
+    Add a job to the queue, merging it into an identical pending job if there is one.
+    A merged job keeps the higher priority and counts the request in `coalesced`.
+    The caller commits.
+
+    Without debounce the earlier start time wins. With debounce (upload bursts)
+    each request pushes the start back by SOURCE_DEBOUNCE_SECONDS of quiet, but
+    never past SOURCE_DEBOUNCE_MAX_SECONDS after the job was first queued, so a
+    long sync still refreshes periodically. A merge involving a user-priority
+    request keeps the earlier start time, debounced or not.
+
+    Args:
+        account_id: ID of the account the job belongs to
+        kind: Job type, 'source_refresh' or 'plot_warmup'
+        source_id: Source the job operates on, if any
+        priority: Higher numbers are claimed first
+        run_after: Earliest time the job may run (default: now)
+        debounce: Wait for a quiet period before running
+    """
+    now = _now()
+    run_after = run_after or now
+    if debounce:
+        quiet = timedelta(seconds=int(os.getenv('SOURCE_DEBOUNCE_SECONDS', '60')))
+        run_after = max(run_after, now + quiet)
+    max_delay = timedelta(seconds=int(os.getenv('SOURCE_DEBOUNCE_MAX_SECONDS', '600')))
+
+    if db.engine.dialect.name == 'postgresql':
+        stmt = pg_insert(Job).values(
+            account_id=account_id, kind=kind, source_id=source_id,
+            priority=priority, run_after=run_after, status='pending'
+        )
+        earliest = func.least(Job.run_after, stmt.excluded.run_after)
+        if debounce:
+            # A user-requested refresh is never pushed back by the uploads that follow it
+            merged_run_after = case(
+                (or_(Job.priority >= PRIORITY_USER, stmt.excluded.priority >= PRIORITY_USER), earliest),
+                else_=func.least(func.greatest(Job.run_after, stmt.excluded.run_after),
+                                 Job.created_at + max_delay)
+            )
+        else:
+            merged_run_after = earliest
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['kind', 'source_id'],
+            index_where=text("status = 'pending'"),
+            set_={
+                'priority': func.greatest(Job.priority, stmt.excluded.priority),
+                'run_after': merged_run_after,
+                'coalesced': Job.coalesced + 1
+            }
+        )
+        db.session.execute(stmt)
+        return
+
+    # Other databases (local development): check, then insert
+    job = Job.query.filter_by(kind=kind, source_id=source_id, status='pending').first()
+    if job:
+        user_requested = max(job.priority, priority) >= PRIORITY_USER
+        job.priority = max(job.priority, priority)
+        if debounce and not user_requested:
+            job.run_after = min(max(_as_utc(job.run_after), run_after), _as_utc(job.created_at) + max_delay)
+        else:
+            job.run_after = min(_as_utc(job.run_after), run_after)
+        job.coalesced += 1
+    else:
+        db.session.add(Job(account_id=account_id, kind=kind, source_id=source_id,
+                           priority=priority, run_after=run_after, status='pending',
+                           attempts=0, coalesced=0, max_attempts=5, created_at=now))
+
+def claim_jobs(worker_id, limit=1, kinds=None):
+    """
+    Claim up to `limit` runnable jobs for a worker.
+
+    Jobs are taken by priority, then start time, skipping rows other workers
+    hold locked and accounts already running JOB_ACCOUNT_CONCURRENCY jobs.
+    The candidates' account rows are locked while running jobs are counted,
+    so concurrent claimers can't both take an account's last slot.
+
+    Args:
+        worker_id: Name recorded on claimed jobs
+        limit: Maximum number of jobs to claim
+        kinds: Only claim jobs of these kinds (default: any)
+
+    Returns:
+        List of claimed Job objects (status 'running', leased to worker_id)
+    """
+    now = _now()
+    account_cap = int(os.getenv('JOB_ACCOUNT_CONCURRENCY', '2'))
+    lease = timedelta(seconds=int(os.getenv('JOB_LEASE_SECONDS', '900')))
+
+    try:
+        candidates = Job.query.filter(or_(
+                and_(Job.status == 'pending', Job.run_after <= now),
+                and_(Job.status == 'running', Job.locked_until <= now)  # Expired lease
+            ))
+        if kinds:
+            candidates = candidates.filter(Job.kind.in_(kinds))
+        candidates = candidates\
+            .order_by(Job.priority.desc(), Job.run_after.asc(), Job.id.asc())\
+            .limit(limit * 10)\
+            .with_for_update(skip_locked=True)\
+            .all()
+        if not candidates:
+            db.session.commit()
+            return []
+
+        # Serialize claimers per account (in id order, so they can't deadlock),
+        # then count what is running, including claims committed meanwhile
+        account_ids = sorted({job.account_id for job in candidates})
+        Account.query.filter(Account.id.in_(account_ids)).order_by(Account.id).with_for_update().all()
+        running = dict(
+            db.session.query(Job.account_id, func.count(Job.id))
+            .filter(Job.status == 'running', Job.locked_until > now, Job.account_id.in_(account_ids))
+            .group_by(Job.account_id)
+            .all()
+        )
+
+        claimed = []
+        for job in candidates:
+            if running.get(job.account_id, 0) >= account_cap:
+                continue
+            job.status = 'running'
+            job.locked_by = worker_id
+            job.locked_until = now + lease
+            job.attempts += 1
+            running[job.account_id] = running.get(job.account_id, 0) + 1
+            if job.attempts == 1 and job.coalesced and job.source_id and job.kind == 'source_refresh':
+                # Record the refreshes this job saved by absorbing repeated requests
+                Source.query.filter_by(id=job.source_id).update(
+                    {Source.refreshes_saved: Source.refreshes_saved + job.coalesced},
+                    synchronize_session=False
+                )
+            claimed.append(job)
+            if len(claimed) >= limit:
+                break
+
+        db.session.commit()
+        return claimed
+
+    except Exception as e:
+        logging.error(f"Error claiming jobs for {worker_id}: {e}")
+        db.session.rollback()
+        return []
+
+def finish_job(job, error=None):
+    """
+    Record the outcome of a job. Failed jobs are retried with exponential backoff
+    until max_attempts is reached.
+    """
+    now = _now()
+    job.locked_by = None
+    job.locked_until = None
+
+    if error is None:
+        job.status = 'done'
+        job.error = None
+        job.finished_at = now
+    else:
+        job.error = str(error)[:500]
+        newer_pending = Job.query.filter(
+            Job.kind == job.kind, Job.source_id == job.source_id,
+            Job.status == 'pending', Job.id != job.id
+        ).first()
+
+        if job.attempts >= job.max_attempts or newer_pending:
+            # Out of attempts, or a newer request will redo the work anyway
+            job.status = 'failed'
+            job.finished_at = now
+        else:
+            base = int(os.getenv('JOB_RETRY_BASE_SECONDS', '30'))
+            delay = min(base * 2 ** (job.attempts - 1), 3600) * random.uniform(0.8, 1.2)
+            job.status = 'pending'
+            job.run_after = now + timedelta(seconds=delay)
+
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # A request for the same work was queued after the check above; it supersedes this retry
+        db.session.rollback()
+        job.status = 'failed'
+        job.error = str(error)[:500]
+        job.finished_at = now
+        job.locked_by = None
+        job.locked_until = None
+        db.session.commit()
+
+def run_job(job):
+    """
+    Execute a claimed job.
+
+    Returns:
+        None on success, otherwise an error message
+    """
+    if job.kind == 'source_refresh':
+        from utils import run_source_refresh
+        account = db.session.get(Account, job.account_id)
+        source = db.session.get(Source, job.source_id) if job.source_id else None
+        if not account or not source:
+            return None  # Deleted since it was queued; nothing to do
+        success, error = run_source_refresh(account, source)
+        return None if success else error
+
+    if job.kind == 'plot_warmup':
+        from layout_render import warm_source_plots
+        account = db.session.get(Account, job.account_id)
+        source = db.session.get(Source, job.source_id) if job.source_id else None
+        if not account or not source or not source.file:
+            return None
+        warm_source_plots(account, source)
+        return None  # Plots that weren't warmed are rendered by their first viewer
+
+    return f"Unknown job kind: {job.kind}"
+
+def work(worker_id, max_jobs=None, max_seconds=None, poll_seconds=5, kinds=None):
+    """
+    Process jobs until the limits are reached. Without limits this runs forever
+    and polls for new jobs; with limits it drains the queue and returns when empty.
+
+    Args:
+        worker_id: Name recorded on claimed jobs
+        max_jobs: Stop after this many jobs
+        max_seconds: Stop claiming new jobs after this many seconds
+        kinds: Only process jobs of these kinds (default: any)
+
+    Returns:
+        Number of jobs processed
+    """
+    started = time.monotonic()
+    processed = 0
+    draining = max_jobs is not None or max_seconds is not None
+
+    while True:
+        if max_jobs is not None and processed >= max_jobs:
+            break
+        if max_seconds is not None and time.monotonic() - started >= max_seconds:
+            break
+
+        jobs = claim_jobs(worker_id, kinds=kinds)
+        if not jobs:
+            if draining:
+                break
+            time.sleep(poll_seconds)
+            continue
+
+        for job in jobs:
+            try:
+                error = run_job(job)
+            except Exception as e:
+                logging.error(f"Job {job.id} ({job.kind}) raised: {e}")
+                db.session.rollback()
+                error = str(e)
+            try:
+                finish_job(job, error)
+            except Exception as e:
+                # The lease expires and the job is claimed again; keep the worker running
+                logging.error(f"Could not record the outcome of job {job.id} ({job.kind}): {e}")
+                db.session.rollback()
+            processed += 1
+            logging.info(f"Job {job.id} ({job.kind}) for source {job.source_id} finished "
+                         f"(coalesced {job.coalesced} requests): {error or 'ok'}")
+
+    return processed
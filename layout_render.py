@@ -0,0 +1,287 @@
+"""
+Concurrent rendering of the plots in a layout.
+
+Sources are fetched and parsed on a thread pool (LAYOUT_FETCH_WORKERS), each
+thread in its own app context and database session. As soon as a source is
+loaded its plots are handed to a small process pool (LAYOUT_PLOT_WORKERS), so
+downloads, parsing and plot generation overlap and CPU-bound work runs outside
+the request thread. Everything shares one deadline (LAYOUT_RENDER_DEADLINE_SECONDS,
+well inside the gunicorn timeout); plots that miss it are returned as
+placeholders and are rendered again on the next request.
+
+Plots that can be answered from a source's rollups (see rollups.py) only
+fetch those, and only their own rows are sent to the pool. Box and table plots
+of large sources are summarized in one chunked pass on the fetch thread (see
+stream_stats.py). The raw rows are loaded for the other plots of the source.
+
+With LAYOUT_PLOT_WORKERS=0 plots are generated in the request thread.
+
+After a source refresh a 'plot_warmup' job (see job_queue.py) renders the
+source's plots the same way, for the whole source and for the time range of
+every layout that shows them, so the first viewer reads them from the plot
+cache. Warm-ups run only in worker.py and share one deadline
+(PLOT_WARMUP_DEADLINE_SECONDS); how long the last one took is kept on the source.
+"""
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from types import SimpleNamespace
+from flask import current_app
+from models import db, Layout, Plot, Setting, Source
+from plot_cache import get_rendered_plot
+from plot_utils import (load_source_frame, load_source_rollups, load_streamed_summaries, generate_plot_data,
+                        build_plot_info, placeholder_plot_info, time_window, accumulates, filter_time_window)
+from rollups import rollup_resolution, plot_rollups
+from stream_stats import streams_statistics
+
+FETCH_WORKERS = int(os.getenv('LAYOUT_FETCH_WORKERS', '4'))
+PLOT_WORKERS = int(os.getenv('LAYOUT_PLOT_WORKERS', '2'))
+RENDER_DEADLINE_SECONDS = float(os.getenv('LAYOUT_RENDER_DEADLINE_SECONDS', '20'))
+# Warm-ups only run in worker.py (the cronjob doesn't drain them), outside any request timeout
+WARMUP_DEADLINE_SECONDS = float(os.getenv('PLOT_WARMUP_DEADLINE_SECONDS', '120'))
+
+_plot_pool = None
+_plot_pool_lock = threading.Lock()
+
+def _get_plot_pool():
+    """Process pool for plot generation, started on first use and kept for the life of the worker."""
+    global _plot_pool
+    with _plot_pool_lock:
+        if _plot_pool is None:
+            # Spawned workers do not inherit the parent's database connections or threads
+            _plot_pool = ProcessPoolExecutor(max_workers=PLOT_WORKERS,
+                                             mp_context=multiprocessing.get_context('spawn'))
+        return _plot_pool
+
+def _reset_plot_pool():
+    """Drop a broken pool (e.g. a worker was killed) so the next render starts a new one."""
+    global _plot_pool
+    with _plot_pool_lock:
+        if _plot_pool is not None:
+            _plot_pool.shutdown(wait=False, cancel_futures=True)
+        _plot_pool = None
+
+def plot_spec(plot):
+    """Picklable copy of the plot fields the processors read."""
+    return SimpleNamespace(
+        id=plot.id,
+        name=plot.name,
+        type=plot.type,
+        group_by=plot.group_by,
+        config=plot.config,
+        config_json=plot.config_json,
+        advanced_json=plot.advanced_json,
+        source=SimpleNamespace(name=plot.source.name, datetime_column=plot.source.datetime_column)
+    )
+
+def render_plot_spec(spec, source_data, rollups=None, since=None):
+    """Generate one plot. Runs in a pool worker process."""
+    try:
+        return generate_plot_data(spec, source_data, rollups, since)
+    except Exception as e:
+        logging.error(f"Error rendering plot {spec.id}: {e}")
+        return {'error': f'Error processing plot data: {str(e)}'}
+
+def _fetch_source_frame(app, source_id, plot_ids, window_start):
+    """
+    Load one source for its plots. Runs on a fetch thread with its own app context.
+
+    Returns:
+        Tuple of (frame, rollups, summaries, accumulated): the source's rollups
+        when some plots can use them (rollups cover the whole source, so not
+        under a time range), streamed summaries by plot id for box and table
+        plots of a large source, and the raw frame when any plot still needs it.
+        Under a time range, accumulating timeline plots count the rows before
+        it: accumulated is then (whole frame, since) for them, else None
+    """
+    with app.app_context():
+        source = db.session.get(Source, source_id)
+        plots = Plot.query.filter(Plot.id.in_(plot_ids)).all()
+        settings = Setting.query.filter_by(account_id=source.account_id).first()
+
+        rollups = None
+        if window_start is None and any(rollup_resolution(plot) for plot in plots):
+            rollups = load_source_rollups(settings, source)
+        raw_plots = [plot for plot in plots if rollups is None or not rollup_resolution(plot)]
+
+        streamed = [plot for plot in raw_plots if streams_statistics(plot, source)]
+        summaries = load_streamed_summaries(settings, source, streamed, window_start) if streamed else {}
+        raw_plots = [plot for plot in raw_plots if plot.id not in summaries]
+
+        if window_start is not None and any(accumulates(plot) for plot in raw_plots):
+            # One download of the whole source: windowed here for the other plots,
+            # and after accumulating for the accumulating ones
+            since = (window_start, settings.timezone if settings else None)
+            whole = load_source_frame(settings, source, raw_plots)
+            frame = filter_time_window(whole, source.datetime_column, *since) if whole is not None else None
+            return frame, rollups, summaries, (whole, since)
+
+        frame = load_source_frame(settings, source, raw_plots, window_start) if raw_plots else None
+        return frame, rollups, summaries, None
+
+def _submit_plot(spec, frame, rollups=None, since=None):
+    """Queue a plot on the process pool, or generate it inline if there is no pool."""
+    if PLOT_WORKERS > 0:
+        try:
+            return _get_plot_pool().submit(render_plot_spec, spec, frame, rollups, since)
+        except (BrokenProcessPool, RuntimeError) as e:
+            logging.error(f"Plot pool unavailable, rendering plot {spec.id} inline: {e}")
+            _reset_plot_pool()
+
+    future = Future()
+    future.set_result(render_plot_spec(spec, frame, rollups, since))
+    return future
+
+def render_plots(plots, window_start=None, deadline_seconds=None):
+    """
+    Render plots concurrently within a deadline.
+
+    Args:
+        plots: Plot objects to render (cache misses)
+        window_start: Optional time_window() start applied to every source
+        deadline_seconds: Time budget for the whole call (default LAYOUT_RENDER_DEADLINE_SECONDS)
+
+    Returns:
+        Dict of plot id to plot info; plots that missed the deadline or failed
+        to load get placeholder info with an error message
+    """
+    if not plots:
+        return {}
+
+    app = current_app._get_current_object()
+    deadline = time.monotonic() + (deadline_seconds or RENDER_DEADLINE_SECONDS)
+    plots_by_source = {}
+    for plot in plots:
+        plots_by_source.setdefault(plot.source_id, []).append(plot)
+    specs = {plot.id: plot_spec(plot) for plot in plots}
+
+    results = {}
+    renders = {}
+    fetch_pool = ThreadPoolExecutor(max_workers=max(1, min(FETCH_WORKERS, len(plots_by_source))))
+    try:
+        fetches = {
+            fetch_pool.submit(_fetch_source_frame, app, source_id,
+                              [plot.id for plot in source_plots], window_start): source_id
+            for source_id, source_plots in plots_by_source.items()
+        }
+        try:
+            for fetch in as_completed(fetches, timeout=max(0, deadline - time.monotonic())):
+                source_plots = plots_by_source[fetches[fetch]]
+                try:
+                    frame, rollups, summaries, accumulated = fetch.result()
+                except Exception as e:
+                    logging.error(f"Error loading source {fetches[fetch]} for layout: {e}")
+                    frame, rollups, summaries, accumulated = None, None, {}, None
+
+                for plot in source_plots:
+                    rows = summaries.get(plot.id)
+                    if rows is None:
+                        rows = plot_rollups(rollups, specs[plot.id])
+                    if accumulated is not None and accumulates(plot):
+                        whole, since = accumulated
+                        if whole is None or len(whole) == 0:
+                            results[plot.id] = placeholder_plot_info(plot, 'No source data available')
+                        else:
+                            renders[_submit_plot(specs[plot.id], whole, since=since)] = plot
+                    elif rows is not None:
+                        renders[_submit_plot(specs[plot.id], None, rows)] = plot
+                    elif frame is None or len(frame) == 0:
+                        results[plot.id] = placeholder_plot_info(plot, 'No source data available')
+                    else:
+                        renders[_submit_plot(specs[plot.id], frame)] = plot
+        except FuturesTimeoutError:
+            logging.warning("Layout render deadline reached while loading sources")
+    finally:
+        # Don't wait for downloads that missed the deadline
+        fetch_pool.shutdown(wait=False, cancel_futures=True)
+
+    done, not_done = wait(renders, timeout=max(0, deadline - time.monotonic()))
+    for future in done:
+        plot = renders[future]
+        try:
+            results[plot.id] = build_plot_info(plot, future.result(), window_start)
+        except BrokenProcessPool as e:
+            logging.error(f"Plot pool broke while rendering plot {plot.id}: {e}")
+            _reset_plot_pool()
+            results[plot.id] = placeholder_plot_info(plot, 'Plot could not be rendered, try again')
+    for future in not_done:
+        future.cancel()
+
+    for plot in plots:
+        if plot.id not in results:
+            logging.warning(f"Plot {plot.id} missed the layout render deadline")
+            results[plot.id] = placeholder_plot_info(plot, 'Plot is taking long to render and will appear on the next refresh')
+    return results
+
+def warmup_windows(account, plots):
+    """
+    The time windows a source's plots are viewed in: the whole source (plot
+    pages and layouts without a time range) and the current start of the time
+    range of each of the account's layouts that shows some of them.
+
+    Returns:
+        Dict of window start (None for the whole source) to the plots shown in it
+    """
+    timezone_name = account.settings.timezone if account.settings else None
+    plots_by_id = {plot.id: plot for plot in plots}
+    windows = {None: list(plots)}
+    for layout in Layout.query.filter_by(account_id=account.id).all():
+        window_start = time_window(layout.time_range, timezone_name)
+        if window_start is None:
+            continue
+        shown = windows.setdefault(window_start, [])
+        for item in layout.config_json:
+            try:
+                plot = plots_by_id.get(int(item['plotId']))
+            except (KeyError, TypeError, ValueError):
+                continue
+            if plot is not None and plot not in shown:
+                shown.append(plot)
+    return {window_start: shown for window_start, shown in windows.items() if shown}
+
+def warm_source_plots(account, source, deadline_seconds=None):
+    """
+    Render and cache a refreshed source's plots ahead of their first viewer.
+    Plots already cached for a window are skipped; plots that miss the deadline
+    are left for the first viewer. Records the time taken on the source.
+
+    Args:
+        account: Account owning the source
+        source: Source whose file was just rebuilt
+        deadline_seconds: Time budget for all windows (default PLOT_WARMUP_DEADLINE_SECONDS)
+
+    Returns:
+        Number of plot renders cached
+    """
+    started = time.monotonic()
+    deadline = started + (deadline_seconds or WARMUP_DEADLINE_SECONDS)
+    plots = Plot.query.filter_by(source_id=source.id).all()
+
+    warmed = 0
+    for window_start, window_plots in warmup_windows(account, plots).items():
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            logging.warning(f"Plot warm-up deadline reached for source {source.id}")
+            break
+        stale_plots = [plot for plot in window_plots if get_rendered_plot(plot, window_start) is None]
+        results = render_plots(stale_plots, window_start, remaining)
+        warmed += sum(1 for info in results.values() if not info['error'])
+
+    elapsed = time.monotonic() - started
+    warmed_at = datetime.now(timezone.utc)
+    since_refresh = ''
+    if source.last_updated:
+        last_updated = source.last_updated if source.last_updated.tzinfo else source.last_updated.replace(tzinfo=timezone.utc)
+        since_refresh = f", {(warmed_at - last_updated).total_seconds():.1f} seconds after the refresh"
+    source.warmed_at = warmed_at
+    source.warmup_seconds = elapsed
+    db.session.commit()
+
+    logging.info(f"Warmed {warmed} plot renders of source {source.id} in {elapsed:.2f} seconds{since_refresh}")
+    return warmed
@@ -0,0 +1,26 @@
+"""Add etag column to file
+
+Revision ID: 3b8d2f6a91c4
+Revises: fe7706017c9b
+Create Date: 2025-08-04 10:12:41.538201
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3b8d2f6a91c4'
+down_revision = 'fe7706017c9b'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('file', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('etag', sa.String(length=100), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('file', schema=None) as batch_op:
+        batch_op.drop_column('etag')
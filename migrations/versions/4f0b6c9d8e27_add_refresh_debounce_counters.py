@@ -0,0 +1,32 @@
+"""Add job.coalesced and source.refreshes_saved
+
+Revision ID: 4f0b6c9d8e27
+Revises: d7a3e58b2c61
+Create Date: 2025-08-18 11:22:45.903716
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4f0b6c9d8e27'
+down_revision = 'd7a3e58b2c61'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('job', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('coalesced', sa.Integer(), server_default='0', nullable=False))
+
+    with op.batch_alter_table('source', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('refreshes_saved', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade():
+    with op.batch_alter_table('source', schema=None) as batch_op:
+        batch_op.drop_column('refreshes_saved')
+
+    with op.batch_alter_table('job', schema=None) as batch_op:
+        batch_op.drop_column('coalesced')
@@ -0,0 +1,27 @@
+"""Add (account_id, key text_pattern_ops) index to file
+
+Revision ID: 8e41c07d5a2f
+Revises: 3b8d2f6a91c4
+Create Date: 2025-08-06 14:27:09.114825
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8e41c07d5a2f'
+down_revision = '3b8d2f6a91c4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('file', schema=None) as batch_op:
+        batch_op.create_index('idx_file_account_key_pattern', ['account_id', 'key'], unique=False,
+                              postgresql_ops={'key': 'text_pattern_ops'})
+
+
+def downgrade():
+    with op.batch_alter_table('file', schema=None) as batch_op:
+        batch_op.drop_index('idx_file_account_key_pattern')
@@ -0,0 +1,40 @@
+"""Add plot_render cache table
+
+Revision ID: a61e4d2c9b70
+Revises: 4f0b6c9d8e27
+Create Date: 2025-08-18 11:37:52.204816
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a61e4d2c9b70'
+down_revision = '4f0b6c9d8e27'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('plot_render',
+        sa.Column('cache_key', sa.String(length=64), nullable=False),
+        sa.Column('plot_id', sa.Integer(), nullable=False),
+        sa.Column('source_id', sa.Integer(), nullable=False),
+        sa.Column('plotly_json', sa.Text(), nullable=False),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+        sa.ForeignKeyConstraint(['plot_id'], ['plot.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['source_id'], ['source.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('cache_key')
+    )
+    with op.batch_alter_table('plot_render', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_plot_render_plot_id'), ['plot_id'], unique=False)
+        batch_op.create_index(batch_op.f('ix_plot_render_source_id'), ['source_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('plot_render', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_plot_render_source_id'))
+        batch_op.drop_index(batch_op.f('ix_plot_render_plot_id'))
+
+    op.drop_table('plot_render')
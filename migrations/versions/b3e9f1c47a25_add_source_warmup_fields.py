@@ -0,0 +1,28 @@
+"""Add source.warmed_at and source.warmup_seconds
+
+Revision ID: b3e9f1c47a25
+Revises: a61e4d2c9b70
+Create Date: 2025-08-19 09:14:06.518342
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b3e9f1c47a25'
+down_revision = 'a61e4d2c9b70'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('source', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('warmed_at', sa.DateTime(timezone=True), nullable=True))
+        batch_op.add_column(sa.Column('warmup_seconds', sa.Float(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('source', schema=None) as batch_op:
+        batch_op.drop_column('warmup_seconds')
+        batch_op.drop_column('warmed_at')
@@ -0,0 +1,54 @@
+"""Add source_file membership table and source aggregates
+
+Revision ID: c52f9a0e7d13
+Revises: 8e41c07d5a2f
+Create Date: 2025-08-11 09:41:52.603318
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c52f9a0e7d13'
+down_revision = '8e41c07d5a2f'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('source_file',
+        sa.Column('source_id', sa.Integer(), nullable=False),
+        sa.Column('file_id', sa.Integer(), nullable=False),
+        sa.Column('size', sa.BigInteger(), server_default='0', nullable=False),
+        sa.Column('depth', sa.Integer(), server_default='1', nullable=False),
+        sa.Column('last_modified', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('version', sa.Integer(), server_default='1', nullable=False),
+        sa.ForeignKeyConstraint(['file_id'], ['file.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['source_id'], ['source.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('source_id', 'file_id')
+    )
+    with op.batch_alter_table('source_file', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_source_file_file_id'), ['file_id'], unique=False)
+
+    # Membership is backfilled lazily, the first time each source is used
+    with op.batch_alter_table('source', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('file_count', sa.Integer(), server_default='0', nullable=False))
+        batch_op.add_column(sa.Column('total_bytes', sa.BigInteger(), server_default='0', nullable=False))
+        batch_op.add_column(sa.Column('newest_file_id', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('last_file_modified', sa.DateTime(timezone=True), nullable=True))
+        batch_op.add_column(sa.Column('members_synced', sa.Boolean(), server_default=sa.text('false'), nullable=False))
+
+
+def downgrade():
+    with op.batch_alter_table('source', schema=None) as batch_op:
+        batch_op.drop_column('members_synced')
+        batch_op.drop_column('last_file_modified')
+        batch_op.drop_column('newest_file_id')
+        batch_op.drop_column('total_bytes')
+        batch_op.drop_column('file_count')
+
+    with op.batch_alter_table('source_file', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_source_file_file_id'))
+
+    op.drop_table('source_file')
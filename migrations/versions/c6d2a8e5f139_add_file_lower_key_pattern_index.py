@@ -0,0 +1,25 @@
+"""Add (account_id, lower(key) text_pattern_ops) index to file
+
+Revision ID: c6d2a8e5f139
+Revises: b3e9f1c47a25
+Create Date: 2025-08-19 10:02:41.337902
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c6d2a8e5f139'
+down_revision = 'b3e9f1c47a25'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('idx_file_account_lower_key_pattern', 'file',
+                    ['account_id', sa.text('lower(key) text_pattern_ops')], unique=False)
+
+
+def downgrade():
+    op.drop_index('idx_file_account_lower_key_pattern', table_name='file')
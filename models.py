@@ -114,6 +114,13 @@ class Setting(db.Model):
 # Define the files model
 class File(db.Model):
     __tablename__ = 'file'
+    __table_args__ = (
+        # Lets prefix LIKE filters on key use an index range scan
+        db.Index('idx_file_account_key_pattern', 'account_id', 'key', postgresql_ops={'key': 'text_pattern_ops'}),
+        # Same for source directory filters, which match regardless of case
+        db.Index('idx_file_account_lower_key_pattern', 'account_id', func.lower(text('key')).label('lower_key'),
+                 postgresql_ops={'lower_key': 'text_pattern_ops'}),
+    )
     id = db.Column(db.Integer, primary_key=True)
     account_id = db.Column(db.Integer, db.ForeignKey('account.id', ondelete='CASCADE'), nullable=False)
     key = db.Column(db.String(200), nullable=False, server_default='')
@@ -121,6 +128,7 @@ class File(db.Model):
     size = db.Column(db.BigInteger, nullable=False, server_default='0')
     last_modified = db.Column(db.DateTime(timezone=True), nullable=False, server_default=func.now())
     version = db.Column(db.Integer, nullable=False, server_default='1')
+    etag = db.Column(db.String(100), nullable=True)
     last_checked = db.Column(db.DateTime(timezone=True), nullable=True)
     archived = db.Column(db.Boolean, nullable=False, server_default=text('false'))
     sources = db.relationship('Source', backref=db.backref('file', lazy=True), cascade="all, delete-orphan")
@@ -140,6 +148,7 @@ class File(db.Model):
             'last_modified': utc_last_modified.isoformat() if utc_last_modified else None,
             'last_checked': utc_last_checked.isoformat() if utc_last_checked else None,
             'version': self.version,
+            'etag': self.etag,
             'archived': self.archived
         }
 
@@ -214,6 +223,15 @@ class Source(db.Model):
     state = db.Column(db.String(50), nullable=False, server_default='created')
     max_path_level = db.Column(db.Integer, nullable=False, server_default='0')
     do_update = db.Column(db.Boolean, nullable=False, server_default=text('false'))
+    # Aggregates over the source_file membership table
+    file_count = db.Column(db.Integer, nullable=False, server_default='0')
+    total_bytes = db.Column(db.BigInteger, nullable=False, server_default='0')
+    newest_file_id = db.Column(db.Integer, nullable=True)
+    last_file_modified = db.Column(db.DateTime(timezone=True), nullable=True)
+    members_synced = db.Column(db.Boolean, nullable=False, server_default=text('false'))
+    refreshes_saved = db.Column(db.Integer, nullable=False, server_default='0')  # Refresh requests merged into queued jobs
+    warmed_at = db.Column(db.DateTime(timezone=True), nullable=True)  # Last background render of the source's plots
+    warmup_seconds = db.Column(db.Float, nullable=True)  # How long that render took
 
     def __repr__(self):
         return f"<Source {self.name} for Account {self.account_id}>"
@@ -234,7 +252,12 @@ class Source(db.Model):
             'error': self.error,
             'file_id': self.file_id,
             'file_size': self.file.size if self.file else 0,
-            'max_path_level': self.max_path_level
+            'max_path_level': self.max_path_level,
+            'file_count': self.file_count,
+            'total_bytes': self.total_bytes,
+            'refreshes_saved': self.refreshes_saved,
+            'warmed_at': self.warmed_at.replace(tzinfo=timezone.utc).isoformat() if self.warmed_at else None,
+            'warmup_seconds': self.warmup_seconds
         }
         return data
 
@@ -245,6 +268,19 @@ class Source(db.Model):
             return None
         return download_source_file(settings, self)
 
+# Define the source membership model (which files currently belong to a source)
+class SourceFile(db.Model):
+    __tablename__ = 'source_file'
+    source_id = db.Column(db.Integer, db.ForeignKey('source.id', ondelete='CASCADE'), primary_key=True)
+    file_id = db.Column(db.Integer, db.ForeignKey('file.id', ondelete='CASCADE'), primary_key=True, index=True)
+    size = db.Column(db.BigInteger, nullable=False, server_default='0')
+    depth = db.Column(db.Integer, nullable=False, server_default='1')
+    last_modified = db.Column(db.DateTime(timezone=True), nullable=True)
+    version = db.Column(db.Integer, nullable=False, server_default='1')
+
+    def __repr__(self):
+        return f"<SourceFile source={self.source_id} file={self.file_id}>"
+
 # Define the plot model
 class Plot(db.Model):
     __tablename__ = 'plot'
@@ -313,6 +349,18 @@ class Plot(db.Model):
             'advanced': self.advanced_json
         }
 
+# Define the rendered plot cache model (final plotly JSON per plot, source version and time range)
+class PlotRender(db.Model):
+    __tablename__ = 'plot_render'
+    cache_key = db.Column(db.String(64), primary_key=True)
+    plot_id = db.Column(db.Integer, db.ForeignKey('plot.id', ondelete='CASCADE'), nullable=False, index=True)
+    source_id = db.Column(db.Integer, db.ForeignKey('source.id', ondelete='CASCADE'), nullable=False, index=True)
+    plotly_json = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime(timezone=True), server_default=func.now())
+
+    def __repr__(self):
+        return f"<PlotRender {self.cache_key[:12]} for Plot {self.plot_id}>"
+
 # Define the layout model
 class Layout(db.Model):
     __tablename__ = 'layout'
@@ -357,3 +405,31 @@ class Layout(db.Model):
             'is_default': self.is_default,
             'show_nav': self.show_nav
         }
+
+# Define the job model (durable queue for background work such as source refreshes)
+class Job(db.Model):
+    __tablename__ = 'job'
+    __table_args__ = (
+        # At most one pending job per kind and source, so identical requests are merged
+        db.Index('uq_job_pending', 'kind', 'source_id', unique=True,
+                 postgresql_where=text("status = 'pending'"), sqlite_where=text("status = 'pending'")),
+        db.Index('idx_job_claim', 'status', 'run_after'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    account_id = db.Column(db.Integer, db.ForeignKey('account.id', ondelete='CASCADE'), nullable=False)
+    source_id = db.Column(db.Integer, db.ForeignKey('source.id', ondelete='CASCADE'), nullable=True)
+    kind = db.Column(db.String(50), nullable=False, server_default='source_refresh')
+    status = db.Column(db.String(20), nullable=False, server_default='pending')  # pending, running, done, failed
+    priority = db.Column(db.Integer, nullable=False, server_default='0')  # Higher runs first
+    attempts = db.Column(db.Integer, nullable=False, server_default='0')
+    coalesced = db.Column(db.Integer, nullable=False, server_default='0')  # Requests merged into this job
+    max_attempts = db.Column(db.Integer, nullable=False, server_default='5')
+    run_after = db.Column(db.DateTime(timezone=True), nullable=False, server_default=func.now())
+    locked_by = db.Column(db.String(100), nullable=True)
+    locked_until = db.Column(db.DateTime(timezone=True), nullable=True)
+    error = db.Column(db.String(500), nullable=True)
+    created_at = db.Column(db.DateTime(timezone=True), nullable=False, server_default=func.now())
+    finished_at = db.Column(db.DateTime(timezone=True), nullable=True)
+
+    def __repr__(self):
+        return f"<Job {self.id} {self.kind} ({self.status}) for Source {self.source_id}>"
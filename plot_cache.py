@@ -0,0 +1,137 @@
+"""
+In-process cache of parsed source frames.
+
+A layout render reads each source once, parses the union of the columns its
+plots need and converts their types; the resulting DataFrame is kept here,
+keyed by the source's file version, so later renders in the same worker skip
+the download and parse. Entries are evicted least recently used once the
+cache holds more than PLOT_FRAME_CACHE_MB of frames.
+
+Finished plots are cached in the plot_render table, shared by all workers:
+the final plotly JSON keyed by a hash of everything the render depends on,
+including the source file id and version, the layout's time window and
+RENDER_VERSION. A source refresh bumps the file version and a deploy that
+changes plot output bumps RENDER_VERSION, so stale renders are never read;
+complete_source_refresh also deletes them. Renders for windows that have
+moved on are deleted after PLOT_RENDER_MAX_AGE_HOURS.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from models import db, PlotRender
+
+# Bump whenever the plot processors or the figure format change, so renders cached
+# by an earlier release (e.g. before typed arrays) are not served to the new layout grid
+RENDER_VERSION = 2
+
+class FrameCache:
+    """Thread-safe LRU cache of DataFrames, bounded by their memory usage."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the cached frame for key (marking it recently used), or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, frame):
+        """Store a frame, evicting the least recently used frames to stay within max_bytes."""
+        nbytes = int(frame.memory_usage(index=True, deep=True).sum())
+        if nbytes > self.max_bytes:
+            logging.info(f"Frame for {key} ({nbytes} bytes) is larger than the cache, not caching")
+            return
+
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= old[1]
+            self._entries[key] = (frame, nbytes)
+            self.size += nbytes
+            while self.size > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.size -= evicted
+
+    def discard(self, match):
+        """Drop all entries whose key satisfies match(key)."""
+        with self._lock:
+            for key in [key for key in self._entries if match(key)]:
+                self.size -= self._entries.pop(key)[1]
+
+frame_cache = FrameCache(int(os.getenv('PLOT_FRAME_CACHE_MB', '256')) * 1024 * 1024)
+
+def plot_render_key(plot, window_start=None):
+    """
+    Hash everything a rendered plot depends on.
+
+    Returns:
+        Hex digest, or None if the source has no built file yet
+    """
+    source = plot.source
+    file = source.file if source else None
+    if not file:
+        return None
+    parts = {
+        'render_version': RENDER_VERSION,
+        'plot': plot.id,
+        'name': plot.name,
+        'type': plot.type,
+        'config': plot.config_json,
+        'advanced': plot.advanced_json,
+        'group_by': plot.group_by,
+        'source': [source.id, source.name, source.datetime_column],
+        'file': [file.id, file.version, file.etag],
+        'window_start': window_start
+    }
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+def get_rendered_plot(plot, window_start=None):
+    """Return the cached plotly JSON for a plot, or None."""
+    key = plot_render_key(plot, window_start)
+    if not key:
+        return None
+    try:
+        render = db.session.get(PlotRender, key)
+        return render.plotly_json if render else None
+    except Exception as e:
+        logging.error(f"Error reading plot cache for plot {plot.id}: {e}")
+        return None
+
+def store_rendered_plot(plot, plotly_json, window_start=None):
+    """Cache a plot's rendered JSON. Concurrent renders of the same key keep the first."""
+    key = plot_render_key(plot, window_start)
+    if not key:
+        return
+    try:
+        # Drop this plot's renders for earlier time windows
+        max_age = timedelta(hours=int(os.getenv('PLOT_RENDER_MAX_AGE_HOURS', '24')))
+        PlotRender.query.filter(
+            PlotRender.plot_id == plot.id,
+            PlotRender.created_at < datetime.now(timezone.utc) - max_age
+        ).delete(synchronize_session=False)
+
+        values = dict(cache_key=key, plot_id=plot.id, source_id=plot.source_id, plotly_json=plotly_json)
+        if db.engine.dialect.name == 'postgresql':
+            db.session.execute(pg_insert(PlotRender).values(**values).on_conflict_do_nothing())
+        elif not db.session.get(PlotRender, key):
+            db.session.add(PlotRender(**values))
+        db.session.commit()
+    except Exception as e:
+        logging.error(f"Error caching render of plot {plot.id}: {e}")
+        db.session.rollback()
+
+def purge_rendered_plots(source_id):
+    """Delete cached renders of a source's plots. The caller commits."""
+    PlotRender.query.filter_by(source_id=source_id).delete(synchronize_session=False)
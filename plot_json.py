@@ -0,0 +1,114 @@
+"""
+Lean plotly figure serialization.
+
+The point-heavy processors build their figures as plain dicts instead of
+go.Figure objects, skipping plotly's per-property validation. Numeric arrays
+are encoded as base64 typed arrays ({'dtype': 'f8', 'bdata': ...}) and
+datetimes as epoch milliseconds on a date axis, which keeps payloads small and
+exact; the layout grid decodes typed arrays before calling Plotly.newPlot.
+The same template fig.to_json() would embed is included, so charts look the
+same as before.
+"""
+import base64
+import json
+import numpy as np
+import pandas as pd
+
+try:
+    import orjson
+except ImportError:  # Fall back to the standard library encoder
+    orjson = None
+
+_TEMPLATE = None
+
+# Integer dtypes plotly.js typed arrays support, smallest first
+_INT_DTYPES = (np.int8, np.uint8, np.int16, np.uint16, np.int32, np.uint32)
+
+def _plotly_template():
+    """The default plotly template, as fig.to_json() embeds it (built once)."""
+    global _TEMPLATE
+    if _TEMPLATE is None:
+        import plotly.io as pio
+        _TEMPLATE = pio.templates[pio.templates.default].to_plotly_json()
+    return _TEMPLATE
+
+def _typed_array(values):
+    return {'dtype': values.dtype.str[1:], 'bdata': base64.b64encode(values.tobytes()).decode('ascii')}
+
+def encode_array(values):
+    """
+    Encode an array for a trace.
+
+    Numbers become typed arrays (the smallest integer type that holds them, else
+    float64), datetimes become epoch milliseconds of their wall-clock time
+    (which is how plotly.js reads dates), anything else a plain list.
+    """
+    if isinstance(values, (pd.Series, pd.Index)):
+        if isinstance(values.dtype, pd.DatetimeTZDtype):
+            values = values.tz_localize(None) if isinstance(values, pd.Index) else values.dt.tz_localize(None)
+        values = values.to_numpy()
+    values = np.asarray(values)
+
+    if np.issubdtype(values.dtype, np.datetime64):
+        ms = values.astype('datetime64[ms]').astype(np.int64).astype(np.float64)
+        ms[np.isnat(values)] = np.nan
+        return _typed_array(ms.astype('<f8'))
+    if np.issubdtype(values.dtype, np.bool_):
+        return values.tolist()
+    if np.issubdtype(values.dtype, np.integer):
+        if len(values):
+            low, high = values.min(), values.max()
+            for dtype in _INT_DTYPES:
+                info = np.iinfo(dtype)
+                if info.min <= low and high <= info.max:
+                    return _typed_array(values.astype(np.dtype(dtype).newbyteorder('<')))
+        return _typed_array(values.astype('<f8'))
+    if np.issubdtype(values.dtype, np.floating):
+        return _typed_array(values.astype('<f8'))
+    return [None if isinstance(value, float) and np.isnan(value) else value for value in values.tolist()]
+
+def figure_layout(layout, date_axes=()):
+    """
+    Expand a layout dict the way fig.update_layout() would and add the template.
+
+    Handles a string title and the 'xaxis_title' / 'yaxis_title' shorthands;
+    axes in date_axes are typed as dates, since their values are sent as numbers.
+    """
+    layout = dict(layout)
+    if isinstance(layout.get('title'), str):
+        layout['title'] = {'text': layout['title']}
+    for axis in ('xaxis', 'yaxis'):
+        if f'{axis}_title' in layout:
+            title = layout.pop(f'{axis}_title')
+            if title is not None:
+                layout[axis] = {**layout.get(axis, {}), 'title': {'text': title}}
+    for axis in date_axes:
+        layout[axis] = {**layout.get(axis, {}), 'type': 'date'}
+    layout['template'] = _plotly_template()
+    return layout
+
+def _default(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, pd.Timestamp):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def figure_json(data, layout, date_axes=()):
+    """
+    Serialize traces and a layout to the JSON string the layout grid plots.
+
+    Args:
+        data: List of trace dicts whose arrays were encoded with encode_array
+        layout: Layout dict (see figure_layout)
+        date_axes: Axes whose values are epoch milliseconds, e.g. ('xaxis',)
+
+    Returns:
+        str: {"data": [...], "layout": {...}}
+    """
+    figure = {'data': data, 'layout': figure_layout(layout, date_axes)}
+    if orjson is not None:
+        return orjson.dumps(figure, default=_default, option=orjson.OPT_SERIALIZE_NUMPY).decode('utf-8')
+    return json.dumps(figure, default=_default, separators=(',', ':'))
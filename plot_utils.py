@@ -1,10 +1,19 @@
 import plotly.express as px
 import pandas as pd
-from io import StringIO
+import numpy as np
+from io import StringIO, BytesIO
 import json
 import logging
-from S3Manager import download_source_file
+import pyarrow as pa
+import pyarrow.parquet as pq
+from S3Manager import download_source_file, download_source_artifact
 from models import db
+from plot_cache import frame_cache, get_rendered_plot, store_rendered_plot
+from downsample import downsample
+from rollups import read_rollups, bucket_ends, combine_rollups
+from pyramid import read_pyramid, pyramid_level, pyramid_window
+from stream_stats import QuantileSketch, box_statistics, iter_source_chunks, summarize_chunks, streams_statistics
+from plot_json import encode_array, figure_json
 import plotly.graph_objects as go
 import os
 
@@ -55,110 +64,412 @@ def prepare_grouped_df(df, plot, preserve_full_name=False):
         preserve_full_name (bool): If True, don't truncate long group names
     
     Returns:
-        pd.DataFrame: DataFrame with a 'group' column for plotting
+        pd.DataFrame: DataFrame with a categorical 'group' column for plotting,
+        its categories in sorted order
     """
     try:
         if 'file_path' not in df.columns:
             logger.error("file_path column not found in DataFrame")
             return df
             
-        # Add group column based on file paths
-        df['group'] = df['file_path'].apply(lambda x: get_group_name(x, plot.group_by, preserve_full_name))
+        # Name the groups of the distinct paths only, then map them back to the rows by code
+        paths = df['file_path'].astype('category')
+        path_groups = [get_group_name(path, plot.group_by, preserve_full_name) for path in paths.cat.categories]
+        group_names = sorted(set(path_groups))
+        # One group code per path code; the trailing -1 serves rows without a path (code -1)
+        group_codes = np.append(np.searchsorted(group_names, path_groups), -1).astype(np.int64)
+        df['group'] = pd.Categorical.from_codes(group_codes[paths.cat.codes.to_numpy()], categories=group_names)
         
         return df
     except Exception as e:
         logger.error(f"Error preparing grouped DataFrame: {str(e)}")
         return df
 
+def load_source_data(account_settings, source):
+    """
+    Fetch a source's data for plotting.
+
+    Returns:
+        Parquet artifact bytes when the source has a current artifact, otherwise
+        the source CSV as a string (None if neither could be downloaded)
+    """
+    artifact = download_source_artifact(account_settings, source)
+    if artifact is not None:
+        return artifact
+    return download_source_file(account_settings, source)
+
+def get_plot_columns(plot):
+    """Return the source columns a plot reads."""
+    config = plot.config_json
+    columns = ['file_path']
+    if isinstance(config, dict) and config.get('y_data'):
+        columns.append(config['y_data'])
+    if plot.type in ('timeline', 'timebin', 'bar') and plot.source and plot.source.datetime_column:
+        columns.append(plot.source.datetime_column)
+    return columns
+
+def accumulates(plot):
+    """Whether a plot shows values accumulated over the whole source (timeline 'accumulate')."""
+    return plot.type == 'timeline' and 'accumulate' in plot.advanced_json
+
+# Layout time ranges: how far back they reach, and how finely their start moves.
+# Starts are floored to the step so renders within one step share cache entries.
+TIME_RANGES = {
+    'day': (pd.Timedelta(days=1), '15min'),
+    'week': (pd.Timedelta(weeks=1), 'h'),
+    'month': (pd.Timedelta(days=30), '6h'),
+    'year': (pd.Timedelta(days=365), 'D')
+}
+
+def time_window(time_range, timezone_name=None):
+    """
+    Start of a layout time range, as a naive timestamp in the account's timezone
+    (the wall-clock time devices write into their files).
+
+    Args:
+        time_range (str): 'all', 'day', 'week', 'month' or 'year'
+        timezone_name (str): Account timezone, e.g. 'America/Chicago'
+
+    Returns:
+        pd.Timestamp, or None for 'all' and unknown ranges
+    """
+    if time_range not in TIME_RANGES:
+        return None
+    span, step = TIME_RANGES[time_range]
+    try:
+        now = pd.Timestamp.now(tz=timezone_name or 'UTC')
+    except Exception:
+        logger.warning(f"Unknown timezone {timezone_name}, using UTC for time range")
+        now = pd.Timestamp.now(tz='UTC')
+    return (now - span).floor(step).tz_localize(None)
+
+def _window_start_for(column_tz, window_start, timezone_name):
+    """Express a naive window start in the timezone of a datetime column (None if naive)."""
+    if column_tz is None:
+        return window_start
+    return window_start.tz_localize(timezone_name or 'UTC').tz_convert(column_tz)
+
+def filter_time_window(df, datetime_column, window_start, timezone_name=None):
+    """Drop rows before window_start (and rows without a valid time) from a parsed frame."""
+    if window_start is None or datetime_column not in df.columns:
+        return df
+    values = df[datetime_column]
+    if not pd.api.types.is_datetime64_any_dtype(values):
+        return df
+    start = _window_start_for(getattr(values.dt, 'tz', None), window_start, timezone_name)
+    return df[values >= start]
+
+def read_source_frame(source_data, columns=None, window=None):
+    """
+    Read source data into a DataFrame, loading only the given columns.
+
+    Args:
+        source_data: Parquet bytes or CSV text as returned by load_source_data,
+            or a DataFrame from load_source_frame
+        columns: Column names to load, or None for all columns
+        window: Optional (datetime_column, window_start, timezone_name). Parquet
+            row groups that end before the start are skipped using their
+            statistics; other formats are filtered by the caller after parsing.
+
+    Returns:
+        pd.DataFrame with the requested columns that exist in the source
+    """
+    if isinstance(source_data, pd.DataFrame):
+        # Already parsed (load_source_frame); select a copy the caller may modify
+        if columns is None:
+            return source_data.copy()
+        return source_data[[col for col in dict.fromkeys(columns) if col in source_data.columns]]
+
+    if isinstance(source_data, bytes):
+        parquet_file = pq.ParquetFile(BytesIO(source_data))
+        schema = parquet_file.schema_arrow
+        if columns is not None:
+            available = set(schema.names)
+            columns = [col for col in dict.fromkeys(columns) if col in available]
+        if window and window[0] in schema.names and pa.types.is_timestamp(schema.field(window[0]).type):
+            datetime_column, window_start, timezone_name = window
+            start = _window_start_for(schema.field(datetime_column).type.tz, window_start, timezone_name)
+            try:
+                return pq.read_table(BytesIO(source_data), columns=columns,
+                                     filters=[(datetime_column, '>=', start.to_pydatetime())]).to_pandas()
+            except Exception as e:
+                logger.warning(f"Could not push time window into Parquet read: {e}")
+        return parquet_file.read(columns=columns).to_pandas()
+
+    wanted = set(columns) if columns is not None else None
+    return pd.read_csv(
+        StringIO(source_data),
+        usecols=(lambda col: col in wanted) if wanted is not None else None,
+        low_memory=False
+    )
+
+def load_source_frame(account_settings, source, plots, window_start=None):
+    """
+    Load a source once for a set of plots: read the union of the columns they
+    need and convert the datetime and value columns up front.
+
+    Parsed frames are cached per source file version, so a later render of an
+    unchanged source skips the download and the parse.
+
+    Args:
+        account_settings: Setting object with the bucket credentials
+        source: Source the plots read
+        plots: Plots that will be generated from the frame
+        window_start: Optional time_window() start; earlier rows are dropped
+
+    Returns:
+        pd.DataFrame to pass to the process_* functions as source_data, or None
+        if the source could not be downloaded
+    """
+    columns = {col for plot in plots for col in get_plot_columns(plot)}
+    if window_start is not None and source.datetime_column:
+        columns.add(source.datetime_column)  # Needed to apply the window, whatever the plots read
+    columns = sorted(columns)
+    value_columns = set(columns) - {'file_path', source.datetime_column}
+
+    file = source.file
+    key = (source.id, file.id, file.version, file.etag, tuple(columns), window_start) if file else None
+    if key:
+        df = frame_cache.get(key)
+        if df is not None:
+            logger.debug(f"Using cached frame for source {source.id}")
+            return df
+
+    source_data = load_source_data(account_settings, source)
+    if not source_data:
+        return None
+
+    timezone_name = account_settings.timezone if account_settings else None
+    window = (source.datetime_column, window_start, timezone_name) \
+        if window_start is not None and source.datetime_column else None
+    df = read_source_frame(source_data, columns, window)
+    if source.datetime_column and source.datetime_column in df.columns:
+        df[source.datetime_column] = pd.to_datetime(df[source.datetime_column], errors='coerce')
+        if window:
+            rows = len(df)
+            df = filter_time_window(df, *window)
+            logger.debug(f"Time window kept {len(df)} of {rows} rows of source {source.id}")
+    for col in value_columns:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors='coerce')
+
+    if key:
+        frame_cache.put(key, df)
+    return df
+
+def _load_derived_artifact(account_settings, source, extension, reader):
+    """Download and decode a derived source artifact, cached per source file version (None if missing)."""
+    file = source.file
+    if not file:
+        return None
+
+    key = (source.id, extension, file.id, file.version, file.etag)
+    frame = frame_cache.get(key)
+    if frame is None:
+        content = download_source_artifact(account_settings, source, extension=extension)
+        # Remember missing artifacts too, so sources without them don't pay a lookup per render
+        frame = reader(content) if content is not None else pd.DataFrame()
+        frame_cache.put(key, frame)
+    return frame if len(frame.columns) else None
+
+def load_source_rollups(account_settings, source):
+    """
+    Load a source's rollups (see rollups.py), cached per source file version.
+
+    Returns:
+        pd.DataFrame, or None if the source has no current rollups (e.g. it was
+        built by the Lambda), in which case plots read the raw rows
+    """
+    return _load_derived_artifact(account_settings, source, 'rollup.parquet', read_rollups)
+
+def load_source_pyramid(account_settings, source):
+    """
+    Load a source's downsample pyramid (see pyramid.py), cached per source file version.
+
+    Returns:
+        pd.DataFrame, or None if the source has no current pyramid
+    """
+    return _load_derived_artifact(account_settings, source, 'pyramid.parquet', read_pyramid)
+
+def load_streamed_summaries(account_settings, source, plots, window_start=None):
+    """
+    Summarize a large source for its box and table plots in one chunked pass,
+    without loading it into memory (see stream_stats).
+
+    Args:
+        account_settings: Setting object with the bucket credentials
+        source: Source the plots read
+        plots: Box and table plots of the source
+        window_start: Optional time_window() start; earlier rows are skipped
+
+    Returns:
+        Dict of plot id to per-file summary rows for the plot's y column, to
+        pass to the processors as rollups
+    """
+    y_columns = {plot.id: plot.config_json.get('y_data') for plot in plots if isinstance(plot.config_json, dict)}
+    value_columns = sorted({col for col in y_columns.values() if col})
+    sketch_columns = {y_columns.get(plot.id) for plot in plots if plot.type == 'box'} - {None}
+
+    timezone_name = account_settings.timezone if account_settings else None
+    window = (source.datetime_column, window_start, timezone_name) \
+        if window_start is not None and source.datetime_column else None
+    columns = ['file_path'] + value_columns + ([source.datetime_column] if window else [])
+
+    summaries = summarize_chunks(iter_source_chunks(account_settings, source, columns),
+                                 value_columns, sketch_columns, window)
+    return {plot_id: summaries[col] for plot_id, col in y_columns.items() if col}
+
+def generate_plot_data(plot, source_data, rollups=None, since=None):
+    """
+    Run the processor for the plot's type. Returns the plot data dict ({} for unknown types).
+
+    Timebin, bar and table plots are answered from rollups (the rows from
+    plot_rollups) when given, and box and table plots from streamed per-file
+    summaries (load_streamed_summaries); source_data isn't read then.
+    `since` is passed to timeline plots (see process_timeseries_plot).
+    """
+    if plot.type == 'timeline':
+        return process_timeseries_plot(plot, source_data, since=since)
+    elif plot.type == 'timebin':
+        return process_timebin_plot(plot, source_data, rollups)
+    elif plot.type == 'box':
+        return process_box_plot(plot, source_data, rollups)
+    elif plot.type == 'bar':
+        return process_bar_plot(plot, source_data, rollups)
+    elif plot.type == 'table':
+        return process_table_plot(plot, source_data, rollups)
+    else:
+        return {}
+
 def get_plot_data(plot, source, account):
     try:
-        csv_content = download_source_file(account.settings, source)
-        if not csv_content:
+        if streams_statistics(plot, source):
+            summaries = load_streamed_summaries(account.settings, source, [plot])
+            return generate_plot_data(plot, None, summaries.get(plot.id))
+
+        source_data = load_source_frame(account.settings, source, [plot])
+        if source_data is None:
             logger.error("Could not download source file")
             return {}
 
-        logger.debug(f"CSV content first 100 chars: {csv_content[:100]}")  # Debug CSV content
-
-        if plot.type == 'timeline':
-            return process_timeseries_plot(plot, csv_content)
-        elif plot.type == 'timebin':
-            return process_timebin_plot(plot, csv_content)
-        elif plot.type == 'box':
-            return process_box_plot(plot, csv_content)
-        elif plot.type == 'bar':
-            return process_bar_plot(plot, csv_content)
-        elif plot.type == 'table':
-            return process_table_plot(plot, csv_content)
-        else:
-            return {}
+        return generate_plot_data(plot, source_data)
 
     except Exception as e:
         logger.error(f"Error processing plot data: {str(e)}", exc_info=True)
         return {}
 
-def get_plot_info(plot, source_data=None):
-    # Get config using the new property
-    config = plot.config_json
-    
-    try:
-        # Use provided source data or fetch it if not provided
-        if source_data is None:
-            source_data = download_source_file(plot.source.account.settings, plot.source)
-            
-        if not source_data:
-            logger.warning(f"No source data available for plot {plot.id}")
-            plotly_json = json.dumps({
-                'data': [],
-                'layout': get_default_layout(plot.name)
-            })
-            return {
-                'plot_id': plot.id,
-                'name': plot.name,
-                'type': plot.type,
-                'source_name': plot.source.name,
-                'config': config,
-                'plotly_json': plotly_json,
-                'error': 'No source data available'
-            }
+def get_plot_window_data(plot, start, end, width):
+    """
+    Timeline series for a zoom window at about one point per pixel.
 
-        # Generate plot data using the source data
-        if plot.type == 'timeline':
-            plot_data = process_timeseries_plot(plot, source_data)
-        elif plot.type == 'timebin':
-            plot_data = process_timebin_plot(plot, source_data)
-        elif plot.type == 'box':
-            plot_data = process_box_plot(plot, source_data)
-        elif plot.type == 'bar':
-            plot_data = process_bar_plot(plot, source_data)
-        elif plot.type == 'table':
-            plot_data = process_table_plot(plot, source_data)
-        else:
-            plot_data = {}
+    Served from the coarsest level of the source's downsample pyramid that is
+    still at least as fine as a pixel; windows finer than any level, plots that
+    accumulate (which need every earlier row) and sources without a pyramid
+    read the raw rows.
+
+    Args:
+        plot: Timeline plot
+        start, end: Window bounds (anything pd.Timestamp accepts), wall-clock time
+        width: Plot width in pixels, the point budget per series
 
-        if not plot_data:
-            logger.warning(f"No plot data generated for plot {plot.id}")
+    Returns:
+        Plot data dict as from process_timeseries_plot
+    """
+    start, end = (pd.Timestamp(ts) for ts in (start, end))
+    start, end = (ts.tz_localize(None) if ts.tzinfo else ts for ts in (start, end))
+    if end <= start:
+        return {'error': 'Invalid time range'}
+
+    source = plot.source
+    settings = source.account.settings
+    y_data = plot.config_json.get('y_data')
+
+    if 'accumulate' not in plot.advanced_json:
+        pyramid = load_source_pyramid(settings, source)
+        level = pyramid_level(pyramid, y_data, start, end, width) if pyramid is not None else None
+        if level is not None:
+            logger.debug(f"Serving plot {plot.id} window from the {level}s pyramid level")
+            frame = pyramid_window(pyramid, y_data, level, start, end, source.datetime_column)
+            return process_timeseries_plot(plot, frame, budget=width)
+
+    source_data = load_source_frame(settings, source, [plot])
+    if source_data is None:
+        return {'error': 'No source data available'}
+    return process_timeseries_plot(plot, source_data, budget=width, window=(start, end))
+
+def get_cached_plot_info(plot, window_start=None):
+    """Return plot info from the rendered plot cache, or None if the plot must be rendered."""
+    plotly_json = get_rendered_plot(plot, window_start)
+    if plotly_json is None:
+        return None
+    return {
+        'plot_id': plot.id,
+        'name': plot.name,
+        'type': plot.type,
+        'source_name': plot.source.name,
+        'config': plot.config_json,
+        'plotly_json': plotly_json,
+        'error': None
+    }
+
+def placeholder_plot_info(plot, error):
+    """Plot info for a plot that could not be rendered: an empty figure and the reason."""
+    plotly_json = json.dumps({
+        'data': [],
+        'layout': get_default_layout(plot.name)
+    })
+    return {
+        'plot_id': plot.id,
+        'name': plot.name,
+        'type': plot.type,
+        'source_name': plot.source.name,
+        'config': plot.config_json,
+        'plotly_json': plotly_json,
+        'error': error
+    }
+
+def build_plot_info(plot, plot_data, window_start=None):
+    """Turn generated plot data into plot info, caching successful renders."""
+    if not plot_data:
+        logger.warning(f"No plot data generated for plot {plot.id}")
+        plotly_json = json.dumps({
+            'data': [],
+            'layout': get_default_layout(plot.name)
+        })
+    else:
+        plotly_json = plot_data.get('plotly_json')
+        if not plotly_json:
+            logger.warning(f"No plotly_json in plot data for plot {plot.id}")
             plotly_json = json.dumps({
                 'data': [],
                 'layout': get_default_layout(plot.name)
             })
-        else:
-            plotly_json = plot_data.get('plotly_json')
-            if not plotly_json:
-                logger.warning(f"No plotly_json in plot data for plot {plot.id}")
-                plotly_json = json.dumps({
-                    'data': [],
-                    'layout': get_default_layout(plot.name)
-                })
+        elif not plot_data.get('error'):
+            store_rendered_plot(plot, plotly_json, window_start)
 
-        return {
-            'plot_id': plot.id,
-            'name': plot.name,
-            'type': plot.type,
-            'source_name': plot.source.name,
-            'config': config,
-            'plotly_json': plotly_json,
-            'error': plot_data.get('error') if plot_data else None
-        }
+    return {
+        'plot_id': plot.id,
+        'name': plot.name,
+        'type': plot.type,
+        'source_name': plot.source.name,
+        'config': plot.config_json,
+        'plotly_json': plotly_json,
+        'error': plot_data.get('error') if plot_data else None
+    }
+
+def get_plot_info(plot, source_data=None, window_start=None):
+    try:
+        # Use provided source data or fetch it if not provided
+        if source_data is None:
+            source_data = load_source_frame(plot.source.account.settings, plot.source, [plot])
+            
+        if source_data is None or len(source_data) == 0:
+            logger.warning(f"No source data available for plot {plot.id}")
+            return placeholder_plot_info(plot, 'No source data available')
+
+        # Generate plot data using the source data
+        plot_data = generate_plot_data(plot, source_data)
+        return build_plot_info(plot, plot_data, window_start)
     except Exception as e:
         logger.error(f"Error getting plot info: {e}", exc_info=True)
         return None
@@ -197,40 +508,69 @@ def get_default_layout(plot_name):
         }
     }
 
+def short_file_path(file_path):
+    """Shorten a file path for hover labels to its last two parts if it is long."""
+    if len(file_path) > 30:
+        file_parts = file_path.split('/')
+        return ".../" + '/'.join(file_parts[-2:]) if len(file_parts) > 1 else file_parts[-1]
+    return file_path
+
+def short_file_paths(file_paths):
+    """Shorten a column of file paths, formatting each distinct path only once."""
+    file_paths = file_paths.astype('category')
+    return file_paths.cat.rename_categories(
+        [short_file_path(path) for path in file_paths.cat.categories]
+    ).astype(object).to_numpy()
+
+def accumulate_across_files(df, value_col, group_col=None):
+    """
+    Accumulate values across consecutive files.
+
+    Each row keeps its own value plus the last value of every earlier run of
+    rows from one file, so counters that restart with each file continue from
+    where the previous file ended. Runs are counted separately per group.
+
+    Args:
+        df (pd.DataFrame): Rows in plotting order (by group, then time)
+        value_col (str): Numeric column to accumulate
+        group_col (str): Optional column whose values accumulate independently
+
+    Returns:
+        pd.Series: Accumulated values aligned with df
+    """
+    boundary = df['file_path'].ne(df['file_path'].shift())
+    if group_col:
+        boundary |= df[group_col].ne(df[group_col].shift())
+    run_id = boundary.cumsum().to_numpy()
+
+    # Last value of each run; each run starts from the sum of the runs before it
+    run_last = df[value_col].groupby(run_id).last()
+    if group_col:
+        run_group = df[group_col].groupby(run_id).first()
+        offsets = run_last.groupby(run_group.to_numpy()).cumsum() - run_last
+    else:
+        offsets = run_last.cumsum() - run_last
+
+    return df[value_col] + offsets.reindex(run_id).to_numpy()
+
 def get_plot_title(plot):
     """Helper function to generate consistent plot titles"""
     if hasattr(plot, 'source') and plot.source:
         return f"{plot.name} ({plot.source.name})"
     return plot.name
 
-def read_and_decimate_csv(csv_content, datetime_col, value_col, max_points=2000):
-    """Read CSV with early decimation to reduce memory usage."""
-    try:
-        # Count total lines first
-        total_lines = sum(1 for _ in StringIO(csv_content))
-        
-        # If file is small enough, read normally
-        if total_lines <= max_points:
-            df = pd.read_csv(StringIO(csv_content), low_memory=False)
-            return df
-            
-        # Calculate skip rate for decimation
-        skip_rows = max(1, total_lines // max_points)
-        
-        # Read only every nth row
-        df = pd.read_csv(
-            StringIO(csv_content),
-            skiprows=lambda x: x > 0 and x % skip_rows != 0,
-            low_memory=False
-        )
-        
-        return df
-    except Exception as e:
-        logger.error(f"Error in read_and_decimate_csv: {e}")
-        # Fallback to normal read if decimation fails
-        return pd.read_csv(StringIO(csv_content), low_memory=False)
+def process_timeseries_plot(plot, source_data, budget=None, window=None, since=None):
+    """
+    Build a timeline plot. Each series is downsampled to a point budget: the
+    `budget` argument (e.g. from the viewport), else the plot's `point_budget`
+    config, else PLOT_POINT_BUDGET. The plot's `downsample` config picks the
+    method ('lttb' or 'minmax').
 
-def process_timeseries_plot(plot, csv_content):
+    An optional window (start, end) of naive wall-clock times keeps only the
+    rows in between, and `since` (window_start, timezone_name) of a layout time
+    range drops the rows before its start. Both are applied after accumulation,
+    so accumulated values still count the rows before them.
+    """
     try:
         logger.info(f"Processing timeseries plot {plot.id}")
         config = plot.config_json
@@ -242,9 +582,8 @@ def process_timeseries_plot(plot, csv_content):
         if not x_data:
             return {'error': 'No datetime column configured for this source'}
         
-        # Use early decimation during CSV reading
-        df = read_and_decimate_csv(csv_content, x_data, y_data)
-        logger.debug(f"DataFrame shape after early decimation: {df.shape}")
+        df = read_source_frame(source_data, ['file_path', x_data, y_data])
+        logger.debug(f"DataFrame shape: {df.shape}")
         
         try:
             df[x_data] = pd.to_datetime(df[x_data], errors='coerce')
@@ -272,120 +611,55 @@ def process_timeseries_plot(plot, csv_content):
         # Handle accumulation if enabled
         if should_accumulate and plot.type == 'timeline':
             logger.info("Accumulating values across files")
-            
-            if plot.group_by:
-                # Process each group separately when grouping is enabled
-                groups = []
-                for group_name, group_df in df.groupby('group'):
-                    # Sort by datetime
-                    group_df = group_df.sort_values(x_data)
-                    
-                    # Initialize accumulation
-                    last_value = 0
-                    accumulated_data = []
-                    current_file = None
-                    
-                    # Process each row
-                    for _, row in group_df.iterrows():
-                        if current_file != row['file_path']:
-                            # New file started
-                            current_file = row['file_path']
-                            if accumulated_data:  # If we have previous data
-                                last_value = accumulated_data[-1]  # Use last accumulated value
-                        
-                        # Add to accumulated value
-                        new_value = last_value + row[y_data]
-                        accumulated_data.append(new_value)
-                    
-                    # Update the group's data with accumulated values
-                    group_df[y_data] = accumulated_data
-                    groups.append(group_df)
-                
-                # Combine all groups back together
-                df = pd.concat(groups)
-            else:
-                # Handle accumulation without grouping
-                df = df.sort_values(x_data)
-                last_value = 0
-                accumulated_data = []
-                current_file = None
-                
-                for _, row in df.iterrows():
-                    if current_file != row['file_path']:
-                        current_file = row['file_path']
-                        if accumulated_data:
-                            last_value = accumulated_data[-1]
-                    new_value = last_value + row[y_data]
-                    accumulated_data.append(new_value)
-                
-                df[y_data] = accumulated_data
+            df[y_data] = accumulate_across_files(df, y_data, 'group' if plot.group_by else None)
         
-        # Create figure using go.Figure for more control
-        fig = go.Figure()
+        if since is not None:
+            df = filter_time_window(df, x_data, *since)
+            if len(df) == 0:
+                return {'error': 'No data points in this time range'}
+
+        if window is not None:
+            tz = getattr(df[x_data].dt, 'tz', None)
+            start, end = (ts.tz_localize(tz) if tz else ts for ts in window)
+            df = df[(df[x_data] >= start) & (df[x_data] <= end)]
+            if len(df) == 0:
+                return {'error': 'No data points in this time range'}
+        
+        # Reduce each series to the point budget, keeping its shape
+        points = len(df)
+        df = downsample(df, x_data, y_data, budget=budget or config.get('point_budget'),
+                        method=config.get('downsample', 'lttb'), group_col='group' if plot.group_by else None)
+        logger.debug(f"Downsampled {points} points to {len(df)}")
+        
+        # Build the figure as a plain dict; arrays are sent as typed arrays
+        traces = []
         colors = px.colors.qualitative.Plotly
         
         if plot.group_by:
-            # Plot each group separately
-            for idx, group in enumerate(sorted(df['group'].unique())):
-                group_data = df[df['group'] == group]
-                color = colors[idx % len(colors)]
-                
-                # Create custom hover text for each point
-                hover_texts = []
-                for _, row in group_data.iterrows():
-                    date_str = row[x_data].strftime('%Y-%m-%d %H:%M:%S')
-                    value = row[y_data]
-                    file_path = row['file_path']
-                    # Format file path - get just the filename if it's too long
-                    if len(file_path) > 30:
-                        file_parts = file_path.split('/')
-                        file_path = ".../" + '/'.join(file_parts[-2:]) if len(file_parts) > 1 else file_parts[-1]
-                    
-                    hover_text = f"Group: {group}<br>Date: {date_str}<br>Value: {value:.2f}<br>File: {file_path}"
-                    hover_texts.append(hover_text)
-                
-                fig.add_trace(go.Scatter(
-                    x=group_data[x_data],
-                    y=group_data[y_data],
-                    name=group,
-                    mode='lines+markers',
-                    marker=dict(size=6, opacity=0.7, color=color),
-                    line=dict(width=2, shape='linear', color=color),
-                    fill='tozeroy',
-                    fillcolor=f'rgba{tuple(list(px.colors.hex_to_rgb(color)) + [0.1])}',
-                    hovertext=hover_texts,
-                    hoverinfo='text'
-                ))
+            # The group is read from the trace name, so paths containing %{ or } can't break the template
+            series = [(group, group_data, "Group: %{fullData.name}<br>")
+                      for group, group_data in df.groupby('group', observed=True, sort=True)]
         else:
             # Plot single line for non-grouped data
-            color = colors[0]
-            
-            # Create custom hover text for each point
-            hover_texts = []
-            for _, row in df.iterrows():
-                date_str = row[x_data].strftime('%Y-%m-%d %H:%M:%S')
-                value = row[y_data]
-                file_path = row['file_path']
-                # Format file path - get just the filename if it's too long
-                if len(file_path) > 30:
-                    file_parts = file_path.split('/')
-                    file_path = ".../" + '/'.join(file_parts[-2:]) if len(file_parts) > 1 else file_parts[-1]
-                
-                hover_text = f"Date: {date_str}<br>Value: {value:.2f}<br>File: {file_path}"
-                hover_texts.append(hover_text)
-            
-            fig.add_trace(go.Scatter(
-                x=df[x_data],
-                y=df[y_data],
-                name=y_data,
-                mode='lines+markers',
-                marker=dict(size=6, opacity=0.7, color=color),
-                line=dict(width=2, shape='linear', color=color),
-                fill='tozeroy',
-                fillcolor=f'rgba{tuple(list(px.colors.hex_to_rgb(color)) + [0.1])}',
-                hovertext=hover_texts,
-                hoverinfo='text'
-            ))
+            series = [(y_data, df, '')]
+        
+        for idx, (name, series_data, hover_prefix) in enumerate(series):
+            color = colors[idx % len(colors)]
+            # Hover labels are formatted by plotly.js from the file paths passed as customdata
+            traces.append({
+                'type': 'scatter',
+                'x': encode_array(series_data[x_data]),
+                'y': encode_array(series_data[y_data]),
+                'name': name,
+                'mode': 'lines+markers',
+                'marker': {'size': 6, 'opacity': 0.7, 'color': color},
+                'line': {'width': 2, 'shape': 'linear', 'color': color},
+                'fill': 'tozeroy',
+                'fillcolor': f'rgba{tuple(list(px.colors.hex_to_rgb(color)) + [0.1])}',
+                'customdata': encode_array(short_file_paths(series_data['file_path'])),
+                'hovertemplate': f"{hover_prefix}Date: %{{x|%Y-%m-%d %H:%M:%S}}<br>"
+                                 "Value: %{y:.2f}<br>File: %{customdata}<extra></extra>"
+            })
         
         # Update layout
         layout = get_default_layout(get_plot_title(plot))
@@ -393,10 +667,9 @@ def process_timeseries_plot(plot, csv_content):
             'xaxis_title': x_data,
             'yaxis_title': y_data
         })
-        fig.update_layout(layout)
         
         return {
-            'plotly_json': fig.to_json(),
+            'plotly_json': figure_json(traces, layout, date_axes=('xaxis',)),
             'error': None
         }
 
@@ -404,47 +677,54 @@ def process_timeseries_plot(plot, csv_content):
         logger.error(f"Error processing timeseries plot: {e}", exc_info=True)
         return {'error': f'Error processing plot data: {str(e)}'}
 
-def process_box_plot(plot, csv_content):
+def process_box_plot(plot, source_data, rollups=None):
     try:
         logger.info(f"Processing box plot {plot.id}")
         config = plot.config_json
         y_data = config['y_data']
         
-        df = pd.read_csv(StringIO(csv_content), low_memory=False)
-        df[y_data] = pd.to_numeric(df[y_data], errors='coerce')
-        df = df.dropna(subset=[y_data])
-        
-        if len(df) == 0:
-            return {'error': 'No valid data points after cleaning'}
+        if rollups is not None:
+            # Per-file summaries streamed from a large source (see stream_stats)
+            traces = summary_box_traces(plot, y_data, rollups)
+            if not traces:
+                return {'error': 'No valid data points after cleaning'}
+        else:
+            df = read_source_frame(source_data, get_plot_columns(plot))
+            df[y_data] = pd.to_numeric(df[y_data], errors='coerce')
+            df = df.dropna(subset=[y_data])
             
-        # Apply grouping if needed
-        if plot.group_by:
-            df = prepare_grouped_df(df, plot)
-        
-        # Create figure
-        fig = go.Figure()
-        colors = px.colors.qualitative.Plotly
-        
-        if plot.group_by:
-            # Plot each group as a separate box
-            for idx, group in enumerate(sorted(df['group'].unique())):
-                group_data = df[df['group'] == group]
-                color = colors[idx % len(colors)]
+            if len(df) == 0:
+                return {'error': 'No valid data points after cleaning'}
                 
-                fig.add_trace(go.Box(
-                    y=group_data[y_data],
-                    name=group,
-                    marker_color=color,
-                    boxpoints='outliers'
-                ))
-        else:
-            # Single box plot for all data
-            fig.add_trace(go.Box(
-                y=df[y_data],
-                name=y_data,
-                marker_color=colors[0],
-                boxpoints='outliers'
-            ))
+            # Apply grouping if needed
+            if plot.group_by:
+                df = prepare_grouped_df(df, plot)
+            
+            # Build the figure as a plain dict; values are sent as typed arrays
+            traces = []
+            colors = px.colors.qualitative.Plotly
+            
+            if plot.group_by:
+                # Plot each group as a separate box
+                for idx, (group, group_data) in enumerate(df.groupby('group', observed=True, sort=True)):
+                    color = colors[idx % len(colors)]
+                    
+                    traces.append({
+                        'type': 'box',
+                        'y': encode_array(group_data[y_data]),
+                        'name': group,
+                        'marker': {'color': color},
+                        'boxpoints': 'outliers'
+                    })
+            else:
+                # Single box plot for all data
+                traces.append({
+                    'type': 'box',
+                    'y': encode_array(df[y_data]),
+                    'name': y_data,
+                    'marker': {'color': colors[0]},
+                    'boxpoints': 'outliers'
+                })
         
         # Update layout
         layout = get_default_layout(get_plot_title(plot))
@@ -452,17 +732,47 @@ def process_box_plot(plot, csv_content):
             'yaxis_title': y_data,
             'showlegend': bool(plot.group_by)  # Convert to boolean - show legend only if grouped
         })
-        fig.update_layout(layout)
         
         return {
-            'plotly_json': fig.to_json(),
+            'plotly_json': figure_json(traces, layout),
             'error': None
         }
     except Exception as e:
         logger.error(f"Error processing box plot {plot.id}: {str(e)}", exc_info=True)
         return {'error': f'Error processing plot data: {str(e)}'}
 
-def process_bar_plot(plot, csv_content):
+def summary_box_traces(plot, y_data, rollups):
+    """
+    Box traces with precomputed statistics from per-file summaries: the files'
+    quantile sketches are merged per group. Individual outliers aren't known,
+    so the boxes show no points.
+    """
+    rows = rollups[rollups['count'] > 0]
+    if len(rows) == 0:
+        return []
+    if plot.group_by:
+        rows = prepare_grouped_df(rows.copy(), plot)
+        groups = rows.groupby('group', observed=True, sort=True)
+    else:
+        groups = [(y_data, rows)]
+
+    traces = []
+    colors = px.colors.qualitative.Plotly
+    for idx, (group, group_rows) in enumerate(groups):
+        sketch = QuantileSketch()
+        for file_sketch in group_rows['sketch']:
+            sketch.merge(file_sketch)
+        stats = box_statistics(sketch, group_rows['min'].min(), group_rows['max'].max())
+        traces.append({
+            'type': 'box',
+            'x': [group],
+            'name': group,
+            'marker': {'color': colors[idx % len(colors)]},
+            **{key: [float(value)] for key, value in stats.items()}
+        })
+    return traces
+
+def process_bar_plot(plot, source_data, rollups=None):
     try:
         logger.info(f"Processing bar plot {plot.id}")
         logger.info(f"Config type: {type(plot.config)}, Config value: {plot.config}")
@@ -492,7 +802,13 @@ def process_bar_plot(plot, csv_content):
         advanced_options = plot.advanced_json
         take_last_value = 'last_value' in advanced_options
         
-        df = pd.read_csv(StringIO(csv_content), low_memory=False)
+        if rollups is not None and not take_last_value:
+            if len(rollups) == 0:
+                return {'error': 'No valid data points after cleaning'}
+            stats, last_dates = rollup_bar_stats(plot, rollups)
+            return bar_figure(plot, y_data, stats, last_dates, take_last_value=False)
+        
+        df = read_source_frame(source_data, get_plot_columns(plot))
         
         # Convert datetime column if available
         if x_data and x_data in df.columns:
@@ -512,13 +828,10 @@ def process_bar_plot(plot, csv_content):
         if plot.group_by:
             df = prepare_grouped_df(df, plot)
             
-            # Store last datetime for each group if available
+            # Store last datetime for each group if available (rows without a valid time are skipped)
             last_dates = {}
             if x_data and x_data in df.columns:
-                for group_name, group_df in df.groupby('group'):
-                    group_df = group_df.sort_values(x_data)
-                    if not group_df.empty:
-                        last_dates[group_name] = group_df[x_data].iloc[-1]
+                last_dates = df.groupby('group', observed=True)[x_data].max().dropna().to_dict()
             
             if take_last_value:
                 # Get the last value for each group
@@ -536,8 +849,8 @@ def process_bar_plot(plot, csv_content):
             last_date = None
             if x_data and x_data in df.columns:
                 df = df.sort_values(x_data)
-                if not df.empty:
-                    last_date = df[x_data].iloc[-1]
+                if df[x_data].notna().any():
+                    last_date = df[x_data].max()
             
             if take_last_value:
                 # Get the last value overall
@@ -552,6 +865,36 @@ def process_bar_plot(plot, csv_content):
                     'count': [len(df)]
                 }, index=['all']).round(2)
         
+        return bar_figure(plot, y_data, stats, last_dates if plot.group_by else last_date, take_last_value)
+    except Exception as e:
+        logger.error(f"Error processing bar plot: {e}", exc_info=True)
+        return {'error': f'Error processing plot data: {str(e)}'}
+
+def rollup_bar_stats(plot, rollups):
+    """Bar statistics (mean, std, count) and last dates from rollup rows, as process_bar_plot computes them from raw rows."""
+    rows = rollups
+    if plot.group_by:
+        rows = prepare_grouped_df(rows.copy(), plot)
+    combined = combine_rollups(rows, 'group' if plot.group_by else None)
+    stats = combined[['mean', 'std', 'count']].round(2)
+    last_dates = combined['t_max'].dropna()
+    if plot.group_by:
+        return stats, last_dates.to_dict()
+    return stats, (last_dates.iloc[0] if len(last_dates) else None)
+
+def bar_figure(plot, y_data, stats, last_dates, take_last_value):
+    """
+    Build the bar figure from per-group statistics.
+
+    Args:
+        stats (pd.DataFrame): 'value' per group, or 'mean', 'std' and 'count'
+        last_dates: Dict of group to last date when grouped, else the last date (or None)
+        take_last_value (bool): Whether stats hold last values
+    """
+    try:
+        if not plot.group_by:
+            last_date = last_dates
+        
         # Create figure
         fig = go.Figure()
         colors = px.colors.qualitative.Plotly
@@ -633,37 +976,46 @@ def process_bar_plot(plot, csv_content):
         logger.error(f"Error processing bar plot: {e}", exc_info=True)
         return {'error': f'Error processing plot data: {str(e)}'}
 
-def process_table_plot(plot, csv_content):
+def process_table_plot(plot, source_data, rollups=None):
     try:
         logger.info(f"Processing table plot {plot.id}")
         config = plot.config_json
         y_data = config['y_data']
         
-        df = pd.read_csv(StringIO(csv_content), low_memory=False)
-        df[y_data] = pd.to_numeric(df[y_data], errors='coerce')
-        df = df.dropna(subset=[y_data])
-        
-        if len(df) == 0:
-            return {'error': 'No valid data points after cleaning'}
-            
-        # Apply grouping if needed
-        if plot.group_by:
-            # Use preserve_full_name=True to show complete group names in tables
-            df = prepare_grouped_df(df, plot, preserve_full_name=True)
-            # Calculate statistics by group, including last value
-            stats = (df.groupby('group', observed=True)[y_data]
-                    .agg(['count', 'mean', 'std', 'min', 'max', ('last', 'last')])
-                    .round(2))
+        if rollups is not None:
+            # Precomputed per-file rollups; group them the same way as raw rows
+            if len(rollups) == 0:
+                return {'error': 'No valid data points after cleaning'}
+            rows = prepare_grouped_df(rollups.copy(), plot, preserve_full_name=True) if plot.group_by else rollups
+            stats = (combine_rollups(rows, 'group' if plot.group_by else None)
+                     .drop(columns='t_max')
+                     .round(2 if plot.group_by else 3))
         else:
-            # Calculate overall statistics, including last value
-            stats = pd.DataFrame({
-                'count': [len(df)],
-                'mean': [df[y_data].mean()],
-                'std': [df[y_data].std()],
-                'min': [df[y_data].min()],
-                'max': [df[y_data].max()],
-                'last': [df[y_data].iloc[-1]]
-            }, index=['all']).round(3)
+            df = read_source_frame(source_data, get_plot_columns(plot))
+            df[y_data] = pd.to_numeric(df[y_data], errors='coerce')
+            df = df.dropna(subset=[y_data])
+            
+            if len(df) == 0:
+                return {'error': 'No valid data points after cleaning'}
+            
+            # Apply grouping if needed
+            if plot.group_by:
+                # Use preserve_full_name=True to show complete group names in tables
+                df = prepare_grouped_df(df, plot, preserve_full_name=True)
+                # Calculate statistics by group, including last value
+                stats = (df.groupby('group', observed=True)[y_data]
+                        .agg(['count', 'mean', 'std', 'min', 'max', ('last', 'last')])
+                        .round(2))
+            else:
+                # Calculate overall statistics, including last value
+                stats = pd.DataFrame({
+                    'count': [len(df)],
+                    'mean': [df[y_data].mean()],
+                    'std': [df[y_data].std()],
+                    'min': [df[y_data].min()],
+                    'max': [df[y_data].max()],
+                    'last': [df[y_data].iloc[-1]]
+                }, index=['all']).round(3)
         
         # Reorder columns to put 'last' after 'count'
         stats = stats.reindex(columns=['count', 'last', 'mean', 'std', 'min', 'max'])
@@ -729,7 +1081,74 @@ def process_table_plot(plot, csv_content):
         logger.error(f"Error processing table plot: {e}", exc_info=True)
         return {'error': f'Error processing plot data: {str(e)}'}
 
-def process_timebin_plot(plot, csv_content):
+def aggregate_time_bins(times, values, bins, groups=None, counts=None):
+    """
+    Sum and count values per time bin (and group) in a single pass.
+
+    Bins follow pd.cut(times, bins, include_lowest=True): bin i holds times in
+    (bins[i], bins[i + 1]], the first bin also holds bins[0], and times after
+    the last edge are dropped. Each row gets an integer (group, bin) code and
+    np.bincount sums and counts all codes at once, so the cost is linear in the
+    number of rows whatever the number of groups or bins.
+
+    Args:
+        times (pd.Series): Datetimes without NaT
+        values (pd.Series): Numeric values without NaN
+        bins (pd.DatetimeIndex): Sorted bin edges
+        groups (pd.Series): Optional group label per row
+        counts (pd.Series): Optional number of points per row, when rows are
+            pre-aggregated (values are then their sums); 1 per row otherwise
+
+    Returns:
+        List of (group, bin_starts, sums, counts) per group, in sorted group
+        order (group is None without groups), keeping only non-empty bins
+    """
+    times = pd.DatetimeIndex(times)
+    if times.tz is not None:
+        times = times.tz_convert('UTC').tz_localize(None)
+        edges = bins.tz_convert('UTC').tz_localize(None)
+    else:
+        edges = bins
+    times = times.to_numpy(dtype='datetime64[ns]').view(np.int64)
+    edges = edges.to_numpy(dtype='datetime64[ns]').view(np.int64)
+    n_bins = len(edges) - 1
+
+    if groups is None:
+        group_codes, group_names = np.zeros(len(times), dtype=np.int64), [None]
+    else:
+        group_codes, group_names = pd.factorize(groups, sort=True)
+    if n_bins < 1:
+        return [(name, bins[:0], np.array([]), np.array([], dtype=np.int64)) for name in group_names]
+
+    bin_index = np.searchsorted(edges, times, side='left') - 1
+    bin_index[times == edges[0]] = 0
+    valid = (bin_index >= 0) & (bin_index < n_bins)
+
+    codes = group_codes[valid] * n_bins + bin_index[valid]
+    weights = values.to_numpy(dtype=np.float64)[valid]
+    row_counts = counts.to_numpy(dtype=np.int64)[valid] if counts is not None else None
+
+    size = len(group_names) * n_bins
+    if size <= 4 * len(codes) + 1_000_000:
+        sums = np.bincount(codes, weights=weights, minlength=size)
+        counts = np.bincount(codes, weights=row_counts, minlength=size).astype(np.int64)
+        present = np.flatnonzero(counts)
+        sums, counts = sums[present], counts[present]
+    else:
+        # Too many (group, bin) cells for dense arrays: count only the codes that occur
+        present, inverse = np.unique(codes, return_inverse=True)
+        sums = np.bincount(inverse, weights=weights)
+        counts = np.bincount(inverse, weights=row_counts).astype(np.int64)
+
+    bin_starts = bins[:-1]
+    boundaries = np.searchsorted(present // n_bins, np.arange(len(group_names) + 1))
+    result = []
+    for code, name in enumerate(group_names):
+        cells = slice(boundaries[code], boundaries[code + 1])
+        result.append((name, bin_starts[present[cells] % n_bins], sums[cells], counts[cells]))
+    return result
+
+def process_timebin_plot(plot, source_data, rollups=None):
     try:
         logger.info(f"Processing timebin plot {plot.id}")
         config = plot.config_json
@@ -748,36 +1167,43 @@ def process_timebin_plot(plot, csv_content):
         if not x_data:
             return {'error': 'No datetime column configured for this source'}
         
-        # Read all data points for timebin plots to ensure accurate sum/mean calculations
-        df = pd.read_csv(StringIO(csv_content), low_memory=False)
-        logger.debug(f"DataFrame shape: {df.shape}")
-        
-        try:
-            df[x_data] = pd.to_datetime(df[x_data], errors='coerce')
-            logger.debug(f"Successfully parsed datetime column {x_data}")
-        except Exception as e:
-            logger.error(f"Failed to parse datetime column {x_data}: {str(e)}")
-            return {'error': f'Could not parse datetime column {x_data}'}
-        
-        # Convert y_data to numeric, handling non-numeric values
-        df[y_data] = pd.to_numeric(df[y_data], errors='coerce')
-        df = df.dropna(subset=[x_data, y_data])
-        
-        if len(df) == 0:
-            return {'error': 'No valid data points after cleaning'}
-
-        # Apply grouping if needed
-        if plot.group_by:
-            df = prepare_grouped_df(df, plot)
-            # Sort by datetime within each group
-            df = df.sort_values(['group', x_data])
+        if rollups is not None:
+            # Precomputed per-file rollups; buckets without a time don't belong to any bin
+            df = rollups[rollups['bin'].notna()]
+            if len(df) == 0:
+                return {'error': 'No valid data points after cleaning'}
+            if plot.group_by:
+                df = prepare_grouped_df(df.copy(), plot)
+            # A bucket (bin, bin + resolution] lies within one time bin, the one holding its end
+            times, values, counts = bucket_ends(df, plot), df['sum'], df['count']
+            min_time, max_time = df['t_min'].min(), df['t_max'].max()
         else:
-            # Just sort by datetime if no grouping
-            df = df.sort_values(x_data)
-        
-        # Create time bins aligned to 00:00
-        min_time = df[x_data].min()
-        max_time = df[x_data].max()
+            # Read all data points for timebin plots to ensure accurate sum/mean calculations
+            df = read_source_frame(source_data, get_plot_columns(plot))
+            logger.debug(f"DataFrame shape: {df.shape}")
+            
+            try:
+                df[x_data] = pd.to_datetime(df[x_data], errors='coerce')
+                logger.debug(f"Successfully parsed datetime column {x_data}")
+            except Exception as e:
+                logger.error(f"Failed to parse datetime column {x_data}: {str(e)}")
+                return {'error': f'Could not parse datetime column {x_data}'}
+            
+            # Convert y_data to numeric, handling non-numeric values
+            df[y_data] = pd.to_numeric(df[y_data], errors='coerce')
+            df = df.dropna(subset=[x_data, y_data])
+            
+            if len(df) == 0:
+                return {'error': 'No valid data points after cleaning'}
+
+            # Apply grouping if needed
+            if plot.group_by:
+                df = prepare_grouped_df(df, plot)
+            
+            times, values, counts = df[x_data], df[y_data], None
+            # Create time bins aligned to 00:00
+            min_time = df[x_data].min()
+            max_time = df[x_data].max()
         
         # Fix bin alignment logic
         start_time = min_time.normalize()
@@ -795,105 +1221,52 @@ def process_timebin_plot(plot, csv_content):
         logger.debug(f"First few bins: {bins[:5]}")
         logger.debug(f"Last few bins: {bins[-5:]}")
         
-        # Function to process a dataframe into bins
-        def process_df_bins(df):
-            # Create a copy of the dataframe to avoid SettingWithCopyWarning
-            df_copy = df.copy()
-            
-            # Cut data into bins - use all bins for labels to avoid data loss
-            df_copy.loc[:, 'bin'] = pd.cut(df_copy[x_data], bins=bins, labels=bins[:-1], include_lowest=True)
-            
-            # Remove any NaN bins (data outside the bin range)
-            df_copy = df_copy.dropna(subset=['bin'])
-            
-            if len(df_copy) == 0:
-                logger.warning("No data points fell within the bin range")
-                return pd.Series(dtype=float), pd.Series(dtype=int)
-            
-            # Group by bin and calculate mean or sum, with observed=True to silence warning
-            if mean_nsum:
-                binned = df_copy.groupby('bin', observed=True)[y_data].mean()
-            else:
-                binned = df_copy.groupby('bin', observed=True)[y_data].sum()
-                
-            # Count points per bin for hover text
-            counts = df_copy.groupby('bin', observed=True)[y_data].count()
-            
-            # Ensure binned and counts have the same index
-            common_index = binned.index.intersection(counts.index)
-            binned = binned.loc[common_index]
-            counts = counts.loc[common_index]
-            
-            return binned, counts
+        # Sum and count every (group, bin) in one pass
+        groups = df['group'] if plot.group_by else None
+        aggregated = aggregate_time_bins(times, values, bins, groups, counts)
         
-        # Create figure
-        fig = go.Figure()
+        # Build the figure as a plain dict; arrays are sent as typed arrays
+        traces = []
         colors = px.colors.qualitative.Plotly
         
+        # Hover labels are formatted by plotly.js; customdata carries the point count per bin
+        bin_hover = (f"Time: %{{x|%Y-%m-%d %H:%M}}<br>{'Mean' if mean_nsum else 'Sum'}: %{{y:.2f}}<br>"
+                     "Points in bin: %{customdata}<extra></extra>")
+        
+        def bin_trace(name, bin_starts, sums, counts, color, hovertemplate):
+            return {
+                'type': 'scatter',
+                'x': encode_array(bin_starts),
+                'y': encode_array(sums / counts if mean_nsum else sums),
+                'name': name,
+                'mode': 'lines+markers',
+                'marker': {'size': 6, 'opacity': 0.7, 'color': color},
+                'line': {'width': 2, 'shape': 'linear', 'color': color},
+                'fill': 'tozeroy',
+                'fillcolor': f'rgba{tuple(list(px.colors.hex_to_rgb(color)) + [0.1])}',
+                'customdata': encode_array(counts),
+                'hovertemplate': hovertemplate
+            }
+        
         if plot.group_by:
-            # Process each group separately
-            for idx, group in enumerate(sorted(df['group'].unique())):
-                group_data = df[df['group'] == group].copy()  # Create a copy here
-                binned, counts = process_df_bins(group_data)
-                
-                if len(binned) == 0:
+            # One trace per group
+            for idx, (group, bin_starts, sums, counts) in enumerate(aggregated):
+                if len(counts) == 0:
                     logger.warning(f"No data for group {group} after binning")
                     continue
                     
-                color = colors[idx % len(colors)]
-                
-                # Create hover text with proper index alignment
-                hover_text = []
-                for bin_time, value in binned.items():
-                    count = counts.get(bin_time, 0)
-                    hover_text.append(f"Group: {group}<br>"
-                                   f"Time: {bin_time.strftime('%Y-%m-%d %H:%M')}<br>"
-                                   f"{'Mean' if mean_nsum else 'Sum'}: {value:.2f}<br>"
-                                   f"Points in bin: {count}")
-                
                 # Add lines with markers for this group
-                fig.add_trace(go.Scatter(
-                    x=binned.index,
-                    y=binned.values,
-                    name=group,
-                    mode='lines+markers',
-                    marker=dict(size=6, opacity=0.7, color=color),
-                    line=dict(width=2, shape='linear', color=color),
-                    fill='tozeroy',
-                    fillcolor=f'rgba{tuple(list(px.colors.hex_to_rgb(color)) + [0.1])}',
-                    hovertext=hover_text,
-                    hoverinfo='text'
-                ))
+                traces.append(bin_trace(group, bin_starts, sums, counts, colors[idx % len(colors)],
+                                        f"Group: %{{fullData.name}}<br>{bin_hover}"))
         else:
-            # Process all data together
-            binned, counts = process_df_bins(df)
+            _, bin_starts, sums, counts = aggregated[0]
             
-            if len(binned) == 0:
+            if len(counts) == 0:
+                logger.warning("No data points fell within the bin range")
                 return {'error': 'No data points fell within the bin range'}
                 
-            color = colors[0]
-            
-            # Create hover text with proper index alignment
-            hover_text = []
-            for bin_time, value in binned.items():
-                count = counts.get(bin_time, 0)
-                hover_text.append(f"Time: {bin_time.strftime('%Y-%m-%d %H:%M')}<br>"
-                               f"{'Mean' if mean_nsum else 'Sum'}: {value:.2f}<br>"
-                               f"Points in bin: {count}")
-            
             # Add single line with markers
-            fig.add_trace(go.Scatter(
-                x=binned.index,
-                y=binned.values,
-                name=y_data,
-                mode='lines+markers',
-                marker=dict(size=6, opacity=0.7, color=color),
-                line=dict(width=2, shape='linear', color=color),
-                fill='tozeroy',
-                fillcolor=f'rgba{tuple(list(px.colors.hex_to_rgb(color)) + [0.1])}',
-                hovertext=hover_text,
-                hoverinfo='text'
-            ))
+            traces.append(bin_trace(y_data, bin_starts, sums, counts, colors[0], bin_hover))
         
         # Update layout
         layout = get_default_layout(get_plot_title(plot))
@@ -902,10 +1275,9 @@ def process_timebin_plot(plot, csv_content):
             'yaxis_title': f"{y_data} ({'Mean' if mean_nsum else 'Sum'} per {bin_hrs}h bin)",
             'showlegend': bool(plot.group_by)  # Only show legend if grouped
         })
-        fig.update_layout(layout)
         
         return {
-            'plotly_json': fig.to_json(),
+            'plotly_json': figure_json(traces, layout, date_axes=('xaxis',)),
             'error': None
         }
 
@@ -0,0 +1,128 @@
+"""
+Multi-resolution downsample pyramid per source, for zooming timeline plots.
+
+When a source is built, every numeric column with at least PYRAMID_MIN_ROWS
+values is reduced level by level: at a level of w seconds each file's rows are
+split into w-second buckets and only the rows holding each bucket's minimum and
+maximum are kept. Bucket widths grow by a factor of 4 (4 s, 16 s, 64 s, ...),
+and every level is built from the one below it. A level is stored only if it
+has at most half the rows of the last stored level. The pyramid is uploaded
+next to the Parquet artifact as .hublink/source/<name>.pyramid.parquet.
+
+A zoom window of `width` pixels is served from the coarsest level whose
+buckets are at most one pixel wide, so each pixel still shows its extremes.
+Windows narrower than the finest level read the raw rows.
+
+Times are stored as naive wall-clock times, which is how the plots show them.
+"""
+import os
+from io import BytesIO
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+PYRAMID_MIN_ROWS = int(os.getenv('PYRAMID_MIN_ROWS', '10000'))
+PYRAMID_LEVELS = [4 ** k for k in range(1, 13)]  # Bucket widths in seconds, 4 s to about 194 days
+
+def _minmax_rows(file_codes, times, values, bucket_ns):
+    """Positions of the minimum and maximum row of every (file, bucket)."""
+    part = pd.DataFrame({'file': file_codes, 'bucket': times // bucket_ns, 'value': values})
+    grouped = part.groupby(['file', 'bucket'], sort=False)['value']
+    return np.unique(np.concatenate([grouped.idxmin().to_numpy(), grouped.idxmax().to_numpy()]))
+
+def build_pyramid(df, datetime_column):
+    """
+    Build the downsample pyramid of a combined source.
+
+    Args:
+        df (pd.DataFrame): Combined source with a file_path column
+        datetime_column (str): The source's datetime column
+
+    Returns:
+        pd.DataFrame with columns column, level (bucket seconds), file_path,
+        time and value, or None if there is nothing to reduce
+    """
+    if not datetime_column or datetime_column not in df.columns or 'file_path' not in df.columns:
+        return None
+    times = pd.to_datetime(df[datetime_column], errors='coerce')
+    if times.dtype.kind != 'M':
+        return None
+    if getattr(times.dt, 'tz', None) is not None:
+        times = times.dt.tz_localize(None)
+
+    paths = df['file_path'].astype('category')
+    frames = []
+    for column in df.columns:
+        if column in ('file_path', datetime_column):
+            continue
+        values = pd.to_numeric(df[column], errors='coerce')
+        valid = (values.notna() & times.notna()).to_numpy()
+        if valid.sum() < PYRAMID_MIN_ROWS:
+            continue
+
+        # Rows of one file in time order, so kept rows stay in plotting order
+        file_codes = paths.cat.codes.to_numpy()[valid]
+        time_ns = times.to_numpy(dtype='datetime64[ns]')[valid].view(np.int64)
+        level_values = values.to_numpy(dtype=np.float64)[valid]
+        order = np.lexsort((time_ns, file_codes))
+        file_codes, time_ns, level_values = file_codes[order], time_ns[order], level_values[order]
+
+        stored_rows = len(level_values)
+        for seconds in PYRAMID_LEVELS:
+            keep = _minmax_rows(file_codes, time_ns, level_values, seconds * 1_000_000_000)
+            if len(keep) == len(level_values):
+                if keep.size <= 2 * len(np.unique(file_codes)):
+                    break  # Every file is down to its overall extremes
+                continue
+            file_codes, time_ns, level_values = file_codes[keep], time_ns[keep], level_values[keep]
+            if len(level_values) * 2 <= stored_rows:
+                stored_rows = len(level_values)
+                frames.append(pd.DataFrame({
+                    'column': column,
+                    'level': seconds,
+                    'file_path': pd.Categorical.from_codes(file_codes, categories=paths.cat.categories),
+                    'time': time_ns.view('datetime64[ns]'),
+                    'value': level_values
+                }))
+
+    if not frames:
+        return None
+    return pd.concat(frames, ignore_index=True)
+
+def pyramid_to_parquet(pyramid):
+    """Encode a pyramid for upload; rows are grouped by column and level so reads can skip the rest."""
+    buffer = BytesIO()
+    pq.write_table(pa.Table.from_pandas(pyramid, preserve_index=False), buffer,
+                   compression='zstd', row_group_size=100_000)
+    return buffer.getvalue()
+
+def read_pyramid(content):
+    """Decode an uploaded pyramid artifact."""
+    pyramid = pq.read_table(BytesIO(content)).to_pandas()
+    for col in ('column', 'file_path'):
+        pyramid[col] = pyramid[col].astype('category')
+    return pyramid
+
+def pyramid_level(pyramid, column, start, end, width):
+    """
+    The level to serve a window from: the coarsest stored level whose buckets
+    are at most one pixel wide, or None if only the raw rows are fine enough.
+    """
+    pixel_seconds = (end - start).total_seconds() / max(1, width)
+    levels = pyramid.loc[pyramid['column'] == column, 'level'].unique()
+    levels = [level for level in levels if level <= pixel_seconds]
+    return int(max(levels)) if levels else None
+
+def pyramid_window(pyramid, column, level, start, end, datetime_column):
+    """
+    The rows of one level within [start, end], as a source-like frame with
+    file_path, the datetime column and the value column.
+    """
+    rows = pyramid[(pyramid['column'] == column) & (pyramid['level'] == level)
+                   & (pyramid['time'] >= start) & (pyramid['time'] <= end)]
+    return pd.DataFrame({
+        'file_path': rows['file_path'].astype(str).to_numpy(),
+        datetime_column: rows['time'].to_numpy(),
+        column: rows['value'].to_numpy()
+    })
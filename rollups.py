@@ -0,0 +1,215 @@
+"""
+Precomputed time-series rollups per source.
+
+When a source is built, every numeric column is summarized per file and per
+fixed time bucket (ROLLUP_RESOLUTIONS) into count, sum, m2 (the sum of squared
+deviations from the bucket mean), min, max and last. The rollups are stored
+next to the Parquet artifact as .hublink/source/<name>.rollup.parquet.
+
+Buckets are right-closed like pd.cut: the bucket labelled t holds the rows in
+(t, t + resolution], so any bin made of whole buckets can be answered from
+them. Rows without a valid time are kept in a bucket without a label, which
+whole-source aggregates (bar, table) include and time bins skip.
+
+Timebin plots whose bin is a multiple of a resolution, and mean/std/count bar
+plots and table plots, are answered from the rollups instead of the raw rows
+when no layout time range applies. Groups are derived from file paths, so one
+set of rollups serves every group_by level.
+"""
+from io import BytesIO
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+ROLLUP_RESOLUTIONS = {
+    '1h': pd.Timedelta(hours=1),
+    '1d': pd.Timedelta(days=1)
+}
+
+# Resolution used for whole-source aggregates; the coarsest has the fewest rows
+TOTAL_RESOLUTION = '1d'
+
+def build_rollups(df, datetime_column=None):
+    """
+    Summarize a combined source per column, file and time bucket.
+
+    Args:
+        df (pd.DataFrame): Combined source with a file_path column, in source row order
+        datetime_column (str): The source's datetime column, if any
+
+    Returns:
+        pd.DataFrame with columns resolution, column, file_path, bin, count, sum,
+        m2, min, max, last, last_row, t_min and t_max; None if the source can't
+        be rolled up (no file_path, or times with a timezone or mixed offsets)
+    """
+    if 'file_path' not in df.columns:
+        return None
+
+    if datetime_column and datetime_column in df.columns:
+        times = pd.to_datetime(df[datetime_column], errors='coerce')
+        if times.dtype.kind != 'M' or getattr(times.dt, 'tz', None) is not None:
+            return None
+    else:
+        times = pd.Series(pd.NaT, index=df.index, dtype='datetime64[ns]')
+
+    paths = df['file_path'].astype('category')
+    rows = np.arange(len(df))
+    # Right-closed bucket labels: (label, label + step]; NaT stays NaT
+    buckets = {resolution: times.dt.ceil(step) - step for resolution, step in ROLLUP_RESOLUTIONS.items()}
+
+    frames = []
+    for column in df.columns:
+        if column in ('file_path', datetime_column):
+            continue
+        values = pd.to_numeric(df[column], errors='coerce')
+        valid = values.notna().to_numpy()
+        if not valid.any():
+            continue
+
+        for resolution, bucket in buckets.items():
+            part = pd.DataFrame({
+                'file_path': paths[valid],
+                'bin': bucket[valid],
+                'value': values[valid],
+                'row': rows[valid],
+                'time': times[valid]
+            })
+            grouped = part.groupby(['file_path', 'bin'], sort=True, observed=True, dropna=False)
+            stats = grouped['value'].agg(['count', 'sum', 'min', 'max', 'last'])
+            stats['m2'] = grouped['value'].var(ddof=0).to_numpy() * stats['count'].to_numpy()
+            stats['last_row'] = grouped['row'].max()
+            stats['t_min'] = grouped['time'].min()
+            stats['t_max'] = grouped['time'].max()
+            stats = stats.reset_index()
+            stats.insert(0, 'column', column)
+            stats.insert(0, 'resolution', resolution)
+            frames.append(stats)
+
+    if not frames:
+        return None
+    rollups = pd.concat(frames, ignore_index=True)
+    rollups['count'] = rollups['count'].astype(np.int64)
+    return rollups[['resolution', 'column', 'file_path', 'bin', 'count', 'sum', 'm2',
+                    'min', 'max', 'last', 'last_row', 't_min', 't_max']]
+
+def rollups_to_parquet(rollups):
+    """Encode rollups for upload."""
+    buffer = BytesIO()
+    pq.write_table(pa.Table.from_pandas(rollups, preserve_index=False), buffer, compression='zstd')
+    return buffer.getvalue()
+
+def read_rollups(content):
+    """Decode an uploaded rollup artifact."""
+    rollups = pq.read_table(BytesIO(content)).to_pandas()
+    for col in ('resolution', 'column', 'file_path'):
+        rollups[col] = rollups[col].astype('category')
+    return rollups
+
+def rollup_resolution(plot):
+    """
+    The rollup resolution a plot can be answered from, or None if it needs the raw rows.
+
+    Timebin plots need a bin that is a whole multiple of a resolution; bar plots
+    qualify unless they show the last value; table plots always qualify.
+    """
+    config = plot.config_json if isinstance(plot.config_json, dict) else {}
+    if not config.get('y_data'):
+        return None
+
+    if plot.type == 'timebin':
+        bin_hrs = config.get('bin_hrs', 24)
+        if not isinstance(bin_hrs, (int, float)) or bin_hrs <= 0:
+            bin_hrs = 24
+        for resolution in sorted(ROLLUP_RESOLUTIONS, key=ROLLUP_RESOLUTIONS.get, reverse=True):
+            step_hrs = ROLLUP_RESOLUTIONS[resolution] / pd.Timedelta(hours=1)
+            if float(bin_hrs / step_hrs).is_integer():
+                return resolution
+        return None
+    if plot.type == 'bar':
+        return None if 'last_value' in plot.advanced_json else TOTAL_RESOLUTION
+    if plot.type == 'table':
+        return TOTAL_RESOLUTION
+    return None
+
+def plot_rollups(rollups, plot):
+    """
+    The rollup rows a plot reads: its y column at its resolution.
+
+    Returns:
+        pd.DataFrame (empty if the column has no numeric values), or None if
+        the plot can't be answered from rollups
+    """
+    resolution = rollup_resolution(plot)
+    if rollups is None or resolution is None:
+        return None
+    rows = rollups[(rollups['resolution'] == resolution) & (rollups['column'] == plot.config_json['y_data'])]
+    return rows.reset_index(drop=True)
+
+def bucket_ends(rows, plot):
+    """Right edge of each rollup row's bucket, the time aggregate_time_bins bins it by."""
+    return rows['bin'] + ROLLUP_RESOLUTIONS[rollup_resolution(plot)]
+
+def merge_rollups(rows, by):
+    """
+    Merge rollup rows that share a key into one row each, in the same form.
+
+    Variances are merged with the parallel formula of Chan et al.: the merged
+    m2 is the sum of the m2s plus count * (row mean - merged mean)^2 per row,
+    which stays accurate where a sum of squares would not.
+
+    Args:
+        rows (pd.DataFrame): Rows with count, sum, m2, min, max, last, last_row,
+            t_min and t_max
+        by: Column name or Series of keys
+
+    Returns:
+        pd.DataFrame indexed by key with the same statistics columns
+    """
+    keys = rows[by] if isinstance(by, str) else by
+    grouped = rows.groupby(keys, observed=True, sort=True)
+
+    count = grouped['count'].sum()
+    total = grouped['sum'].sum()
+    deviation = rows['count'] * (rows['sum'] / rows['count'] - (total / count).reindex(keys).to_numpy()) ** 2
+    last_rows = grouped['last_row'].idxmax()
+
+    merged = pd.DataFrame({
+        'count': count.astype(np.int64),
+        'sum': total,
+        'm2': grouped['m2'].sum() + deviation.groupby(keys, observed=True, sort=True).sum(),
+        'min': grouped['min'].min(),
+        'max': grouped['max'].max(),
+        'last': rows['last'].to_numpy()[rows.index.get_indexer(last_rows)],
+        'last_row': grouped['last_row'].max(),
+        't_min': grouped['t_min'].min(),
+        't_max': grouped['t_max'].max()
+    })
+    merged.index.name = None
+    return merged
+
+def combine_rollups(rows, by=None):
+    """
+    Combine rollup rows into whole-group statistics.
+
+    Args:
+        rows (pd.DataFrame): Rollup rows
+        by (str): Optional grouping column (e.g. 'group'); without it all rows
+            are combined into one row labelled 'all'
+
+    Returns:
+        pd.DataFrame indexed by group with count, mean, std (sample), min, max,
+        last (the value of the last source row) and t_max
+    """
+    merged = merge_rollups(rows, by if by else pd.Series('all', index=rows.index))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        std = np.sqrt(merged['m2'] / (merged['count'] - 1)).where(merged['count'] > 1)
+    return pd.DataFrame({
+        'count': merged['count'],
+        'mean': merged['sum'] / merged['count'],
+        'std': std,
+        'min': merged['min'],
+        'max': merged['max'],
+        'last': merged['last'],
+        't_max': merged['t_max']
+    })
@@ -0,0 +1,343 @@
+"""
+Local source materialization engine.
+
+Builds a source's combined CSV (.hublink/source/<name>.csv) inside this app
+instead of the external Lambda: matching files are parsed in parallel on a
+process pool, annotated with a file_path column, trimmed to the source's
+include_columns and tail settings, concatenated and uploaded to the bucket.
+Next to the CSV a zstd-compressed Parquet artifact with typed columns is
+uploaded, which plot_utils reads column by column, along with precomputed
+per-file rollups (see rollups.py) that aggregate plots are answered from and
+a downsample pyramid (see pyramid.py) that zoomed timeline plots read.
+Enable with SOURCE_BUILDER=local.
+
+Each parsed file is kept as a Parquet fragment on local disk
+(SOURCE_FRAGMENT_DIR, private to the app's user), keyed by the file's version
+and the source's column projection, so a refresh only parses new or changed
+files and splices the cached fragments back in. Fragments of deleted files
+and of projections no source uses any more are pruned periodically.
+"""
+import boto3
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import time
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO, StringIO
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from models import db, File, Source
+from rollups import build_rollups, rollups_to_parquet
+from pyramid import build_pyramid, pyramid_to_parquet
+
+# Same ceiling the Lambda enforced on the combined source
+MAX_SOURCE_ROWS = 1_000_000
+
+FRAGMENT_DIR = os.getenv('SOURCE_FRAGMENT_DIR',
+                         os.path.join(tempfile.gettempdir(), f"hublink-fragments-{os.getuid()}"))
+
+# How often an account's fragment directory is swept for deleted files and unused projections
+FRAGMENT_PRUNE_INTERVAL = int(os.getenv('SOURCE_FRAGMENT_PRUNE_MINUTES', '60')) * 60
+
+def _source_columns(source):
+    """Return the set of columns to keep for a source, or None to keep all."""
+    columns = {col.strip() for col in (source.include_columns or '').split(',') if col.strip()}
+    if not columns:
+        return None
+    if source.datetime_column:
+        columns.add(source.datetime_column)
+    return columns
+
+def _tail_rows(source):
+    """Rows kept from the end of each file, or None to keep them all."""
+    return source.data_points if source.tail_only and source.data_points else None
+
+def _projection_hash(columns, tail_rows):
+    """Identify how a file was projected, so sources with different settings don't share fragments."""
+    projection = f"{sorted(columns) if columns else '*'}|{tail_rows or 0}"
+    return hashlib.sha1(projection.encode('utf-8')).hexdigest()[:12]
+
+def _file_fingerprint(file):
+    """Identify one version of a file's content."""
+    last_modified = file.last_modified.isoformat() if file.last_modified else ''
+    fingerprint = f"{file.version}|{file.size}|{last_modified}|{file.etag or ''}"
+    return hashlib.sha1(fingerprint.encode('utf-8')).hexdigest()[:16]
+
+def fragment_path(account_id, file, projection):
+    """Local path of the cached fragment for a file version and projection."""
+    return os.path.join(FRAGMENT_DIR, str(account_id), str(file.id), f"{_file_fingerprint(file)}-{projection}.parquet")
+
+def _fragment_dir_ready():
+    """
+    Create the fragment directory readable only by this user and check that
+    nobody else can write to it. Returns False if the cache must not be used.
+    """
+    try:
+        os.makedirs(FRAGMENT_DIR, mode=0o700, exist_ok=True)
+        info = os.stat(FRAGMENT_DIR)
+        if info.st_uid != os.getuid() or info.st_mode & 0o022:
+            logging.warning(f"Fragment cache disabled: {FRAGMENT_DIR} is not owned by this user or is writable by others")
+            return False
+        return True
+    except Exception as e:
+        logging.warning(f"Fragment cache disabled: {e}")
+        return False
+
+def _load_fragment(path):
+    """Load a cached fragment, or None if it is missing or unreadable."""
+    if not os.path.exists(path):
+        return None
+    try:
+        return pd.read_parquet(path)
+    except Exception as e:
+        logging.warning(f"Discarding unreadable fragment {path}: {e}")
+        return None
+
+def _store_fragment(path, df):
+    """Write a fragment atomically and drop fragments of older versions of the same file."""
+    try:
+        file_dir = os.path.dirname(path)
+        os.makedirs(file_dir, mode=0o700, exist_ok=True)
+        fingerprint = os.path.basename(path).split('-')[0]
+        for name in os.listdir(file_dir):
+            if not name.startswith(fingerprint):
+                os.remove(os.path.join(file_dir, name))
+
+        # Parsed text columns can mix strings and NaN, which Parquet only takes as strings
+        df = df.copy()
+        for col in df.columns:
+            if df[col].dtype == object:
+                df[col] = df[col].astype('string')
+
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        df.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, path)
+    except Exception as e:
+        logging.warning(f"Could not cache fragment {path}: {e}")
+
+def prune_fragments(account):
+    """
+    Remove an account's fragments for files that no longer exist and for
+    projections none of its sources use any more. Runs at most once per
+    FRAGMENT_PRUNE_INTERVAL per account.
+
+    Args:
+        account: Account object whose fragment directory is swept
+    """
+    account_dir = os.path.join(FRAGMENT_DIR, str(account.id))
+    marker = os.path.join(account_dir, '.pruned')
+    try:
+        if not os.path.isdir(account_dir):
+            return
+        if os.path.exists(marker) and time.time() - os.path.getmtime(marker) < FRAGMENT_PRUNE_INTERVAL:
+            return
+
+        file_ids = {str(file_id) for (file_id,) in
+                    db.session.query(File.id).filter(File.account_id == account.id)}
+        projections = {_projection_hash(_source_columns(source), _tail_rows(source))
+                       for source in Source.query.filter_by(account_id=account.id)}
+
+        removed = 0
+        for name in os.listdir(account_dir):
+            file_dir = os.path.join(account_dir, name)
+            if not os.path.isdir(file_dir):
+                continue
+            if name not in file_ids:
+                shutil.rmtree(file_dir, ignore_errors=True)
+                removed += 1
+                continue
+            for fragment in os.listdir(file_dir):
+                if fragment.endswith('.parquet') and fragment[:-len('.parquet')].split('-')[-1] not in projections:
+                    os.remove(os.path.join(file_dir, fragment))
+                    removed += 1
+
+        with open(marker, 'w'):
+            pass
+        if removed:
+            logging.info(f"Pruned {removed} stale fragment entries for account {account.id}")
+    except Exception as e:
+        logging.warning(f"Could not prune fragments for account {account.id}: {e}")
+
+# Rows per Parquet row group; each group carries min/max statistics per column
+PARQUET_ROW_GROUP_SIZE = 100_000
+
+def to_parquet_bytes(df, datetime_column=None):
+    """
+    Encode a combined source as a compressed Parquet file with typed columns.
+
+    Numeric columns keep the types pandas inferred, the datetime column is stored
+    as a timestamp when it parses, and anything else is stored as strings.
+    """
+    df = df.copy()
+    if datetime_column and datetime_column in df.columns:
+        try:
+            df[datetime_column] = pd.to_datetime(df[datetime_column], errors='coerce')
+        except Exception as e:
+            logging.warning(f"Keeping {datetime_column} as text in Parquet artifact: {e}")
+    for col in df.columns:
+        if df[col].dtype == object:
+            df[col] = df[col].astype('string')
+
+    buffer = BytesIO()
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    pq.write_table(table, buffer, compression='zstd', row_group_size=PARQUET_ROW_GROUP_SIZE)
+    return buffer.getvalue()
+
+def _read_csv_tail(body, rows):
+    """Read the header and only the last `rows` lines of a CSV stream."""
+    lines = (line.decode('utf-8') for line in body.iter_lines())
+    header = next(lines, '')
+    tail = deque(lines, maxlen=rows)
+    return StringIO('\n'.join([header, *tail]))
+
+def load_file_frame(task):
+    """
+    Download and parse one file for a source build. Runs in a worker process,
+    so it only receives plain values and never touches the database.
+
+    Args:
+        task: Dict with credentials, bucket, key, columns and tail_rows
+
+    Returns:
+        DataFrame with a file_path column, or None if the file could not be read
+    """
+    try:
+        s3_client = boto3.client(
+            's3',
+            aws_access_key_id=task['aws_access_key_id'],
+            aws_secret_access_key=task['aws_secret_access_key'],
+            region_name=os.getenv('AWS_REGION', 'us-east-1')
+        )
+        response = s3_client.get_object(Bucket=task['bucket_name'], Key=task['key'])
+
+        if task['tail_rows']:
+            content = _read_csv_tail(response['Body'], task['tail_rows'])
+        else:
+            content = StringIO(response['Body'].read().decode('utf-8'))
+
+        columns = task['columns']
+        df = pd.read_csv(
+            content,
+            usecols=(lambda col: col.strip() in columns) if columns else None,
+            low_memory=False
+        )
+        df.columns = [col.strip() for col in df.columns]
+        df['file_path'] = task['key']
+        return df
+
+    except Exception as e:
+        logging.error(f"Error reading {task['key']} for source build: {e}")
+        return None
+
+def build_source(account, source):
+    """
+    Materialize a source and record the result like the Lambda callback does.
+
+    Args:
+        account: Account object owning the source
+        source: Source object to build
+
+    Returns:
+        Tuple of (success, error_message)
+    """
+    from S3Manager import upload_source_file
+    from utils import source_files_query, complete_source_refresh
+
+    settings = account.settings
+    try:
+        files = source_files_query(account, source).order_by(File.key).all()
+        if not files:
+            raise ValueError('No files match the source filter')
+
+        columns = _source_columns(source)
+        tail_rows = _tail_rows(source)
+        projection = _projection_hash(columns, tail_rows)
+        use_cache = _fragment_dir_ready()
+        if use_cache:
+            prune_fragments(account)
+
+        # Reuse fragments of unchanged files; only the rest are downloaded and parsed
+        fragments = {}
+        tasks = []
+        for file in files:
+            path = fragment_path(account.id, file, projection)
+            fragments[file.id] = _load_fragment(path) if use_cache else None
+            if fragments[file.id] is None:
+                tasks.append((file.id, path, {
+                    'aws_access_key_id': settings.aws_access_key_id,
+                    'aws_secret_access_key': settings.aws_secret_access_key,
+                    'bucket_name': settings.bucket_name,
+                    'key': file.key,
+                    'columns': columns,
+                    'tail_rows': tail_rows
+                }))
+
+        if tasks:
+            # Spawned workers do not inherit the parent's database connections or threads
+            max_workers = int(os.getenv('SOURCE_BUILDER_WORKERS', os.cpu_count() or 1))
+            with ProcessPoolExecutor(max_workers=min(max_workers, len(tasks)),
+                                     mp_context=multiprocessing.get_context('spawn')) as executor:
+                parsed = executor.map(load_file_frame, [task for _, _, task in tasks])
+                for (file_id, path, _), df in zip(tasks, parsed):
+                    if df is not None and use_cache:
+                        _store_fragment(path, df)
+                    fragments[file_id] = df
+
+        logging.info(f"Source {source.id}: reused {len(files) - len(tasks)} fragments, parsed {len(tasks)} files")
+
+        # Splice fragments back together in key order
+        frames = [fragments[file.id] for file in files
+                  if fragments[file.id] is not None and not fragments[file.id].empty]
+
+        if not frames:
+            raise ValueError('None of the matching files could be read')
+
+        combined = pd.concat(frames, ignore_index=True, sort=False)
+        if len(combined) > MAX_SOURCE_ROWS:
+            logging.warning(f"Source {source.id} has {len(combined)} rows, keeping the last {MAX_SOURCE_ROWS}")
+            combined = combined.tail(MAX_SOURCE_ROWS)
+
+        content = combined.to_csv(index=False).encode('utf-8')
+        key, etag = upload_source_file(settings, source.name, content)
+        if not key:
+            raise ValueError('Upload of the source file failed')
+
+        # The Parquet artifact is optional; readers fall back to the CSV if it is missing or stale
+        try:
+            upload_source_file(settings, source.name, to_parquet_bytes(combined, source.datetime_column),
+                               extension='parquet', metadata={'csv-etag': etag or ''})
+        except Exception as e:
+            logging.warning(f"Could not write Parquet artifact for source {source.id}: {e}")
+
+        # Rollups are optional too; without them plots aggregate the raw rows
+        try:
+            rollups = build_rollups(combined, source.datetime_column)
+            if rollups is not None:
+                upload_source_file(settings, source.name, rollups_to_parquet(rollups),
+                                   extension='rollup.parquet', metadata={'csv-etag': etag or ''})
+        except Exception as e:
+            logging.warning(f"Could not write rollups for source {source.id}: {e}")
+
+        try:
+            pyramid = build_pyramid(combined, source.datetime_column)
+            if pyramid is not None:
+                upload_source_file(settings, source.name, pyramid_to_parquet(pyramid),
+                                   extension='pyramid.parquet', metadata={'csv-etag': etag or ''})
+        except Exception as e:
+            logging.warning(f"Could not write downsample pyramid for source {source.id}: {e}")
+
+        logging.info(f"Built source {source.id}|{source.name} from {len(frames)} files, {len(combined)} rows")
+        complete_source_refresh(account, source, key=key, size=len(content), etag=etag)
+        return True, None
+
+    except Exception as e:
+        error_msg = str(e)
+        logging.error(f"Error building source {source.id}: {error_msg}")
+        db.session.rollback()
+        complete_source_refresh(account, source, error=error_msg)
+        return False, error_msg
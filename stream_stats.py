@@ -0,0 +1,222 @@
+"""
+Bounded-memory statistics for box and table plots over large sources.
+
+Sources whose CSV is at least STREAM_STATS_MIN_MB are not loaded into a
+DataFrame for these plots. Instead the source is streamed from S3 in chunks of
+STREAM_CHUNK_ROWS rows (the Parquet artifact is spooled to a temporary file
+first, since Parquet needs random access) and each chunk is folded into
+per-file rows of the rollup form (see rollups.py): count, sum, m2, min, max
+and last, merged with Chan's formula. Box plots additionally keep a
+mergeable quantile sketch per file.
+
+Memory use depends on the chunk size and the number of files, not on the
+number of rows. Smaller sources keep the exact in-memory path.
+"""
+import logging
+import os
+import shutil
+import tempfile
+from contextlib import closing
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+from S3Manager import open_source_stream
+from rollups import merge_rollups
+
+STREAM_STATS_MIN_BYTES = int(os.getenv('STREAM_STATS_MIN_MB', '64')) * 1024 * 1024
+STREAM_CHUNK_ROWS = int(os.getenv('STREAM_CHUNK_ROWS', '100000'))
+SKETCH_SIZE = int(os.getenv('QUANTILE_SKETCH_SIZE', '200'))
+
+class QuantileSketch:
+    """
+    Mergeable quantile sketch (KLL) over float values.
+
+    Values are kept in levels; an item at level h stands for 2**h values. When
+    a level outgrows its capacity it is sorted and every other item (from a
+    random offset) is promoted to the next level. Capacities shrink by 2/3 per
+    level below the top, so the sketch holds O(k) items and answers rank
+    queries within about 1.7% of n for k=200. Until the first compaction all
+    values are kept and quantiles are exact.
+    """
+
+    def __init__(self, k=SKETCH_SIZE, seed=None):
+        self.k = k
+        self.levels = [np.empty(0)]
+        self.count = 0
+        self._rng = np.random.default_rng(seed)
+
+    def _capacity(self, level):
+        depth = len(self.levels) - 1 - level
+        return max(2, int(np.ceil(self.k * (2 / 3) ** depth)))
+
+    def _compress(self):
+        level = 0
+        while level < len(self.levels):
+            items = self.levels[level]
+            if len(items) > self._capacity(level):
+                if level + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                items = np.sort(items)
+                # An odd item out stays at this level (copied, so the sorted buffer is freed)
+                keep = items[len(items) - len(items) % 2:].copy()
+                paired = items[:len(items) - len(items) % 2]
+                promoted = paired[self._rng.integers(2)::2]
+                self.levels[level] = keep
+                self.levels[level + 1] = np.concatenate([self.levels[level + 1], promoted])
+            level += 1
+
+    def update(self, values):
+        """Add an array of values (without NaNs)."""
+        values = np.asarray(values, dtype=np.float64)
+        if len(values):
+            self.levels[0] = np.concatenate([self.levels[0], values])
+            self.count += len(values)
+            self._compress()
+
+    def merge(self, other):
+        """Add another sketch's values to this one."""
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.empty(0))
+        for level, items in enumerate(other.levels):
+            self.levels[level] = np.concatenate([self.levels[level], items])
+        self.count += other.count
+        self._compress()
+
+    @property
+    def exact(self):
+        return len(self.levels) == 1
+
+    def items(self):
+        """Retained values (sorted) and the number of values each stands for."""
+        values = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(items), 2 ** level) for level, items in enumerate(self.levels)])
+        order = np.argsort(values, kind='stable')
+        return values[order], weights[order]
+
+    def quantiles(self, qs):
+        """
+        Quantiles at the fractions in qs. Exact sketches interpolate linearly
+        between order statistics, as np.quantile and plotly's default do.
+        """
+        values, weights = self.items()
+        if self.exact:
+            return np.quantile(values, qs)
+        cumulative = np.cumsum(weights)
+        ranks = np.asarray(qs) * (cumulative[-1] - 1)
+        return values[np.minimum(np.searchsorted(cumulative, ranks, side='right'), len(values) - 1)]
+
+def box_statistics(sketch, minimum, maximum):
+    """
+    Precomputed box plot statistics from a sketch and the exact extremes.
+
+    Fences follow plotly: the furthest values within 1.5 IQR of the quartiles.
+
+    Returns:
+        Dict of q1, median, q3, lowerfence and upperfence
+    """
+    q1, median, q3 = sketch.quantiles([0.25, 0.5, 0.75])
+    values, _ = sketch.items()
+    low, high = q1 - 1.5 * (q3 - q1), q3 + 1.5 * (q3 - q1)
+    inside = values[(values >= low) & (values <= high)]
+    lowerfence = minimum if minimum >= low else (inside.min() if len(inside) else q1)
+    upperfence = maximum if maximum <= high else (inside.max() if len(inside) else q3)
+    return {'q1': q1, 'median': median, 'q3': q3, 'lowerfence': lowerfence, 'upperfence': upperfence}
+
+def iter_source_chunks(account_settings, source, columns, chunk_rows=None):
+    """
+    Stream a source's columns in DataFrame chunks without holding the whole
+    source in memory: from the Parquet artifact when it is current, else from
+    the CSV. Must be consumed inside an app context.
+
+    Yields:
+        pd.DataFrame with the requested columns that exist in the source
+    """
+    chunk_rows = chunk_rows or STREAM_CHUNK_ROWS
+    body = open_source_stream(account_settings, source, extension='parquet')
+    if body is not None:
+        with closing(body), tempfile.TemporaryFile() as spool:
+            shutil.copyfileobj(body, spool, 1024 * 1024)
+            spool.seek(0)
+            parquet_file = pq.ParquetFile(spool)
+            available = set(parquet_file.schema_arrow.names)
+            for batch in parquet_file.iter_batches(batch_size=chunk_rows,
+                                                   columns=[col for col in columns if col in available]):
+                yield batch.to_pandas()
+        return
+
+    body = open_source_stream(account_settings, source)
+    if body is None:
+        raise ValueError(f"Could not open source file for {source.name}")
+    wanted = set(columns)
+    with closing(body):
+        yield from pd.read_csv(body, usecols=lambda col: col in wanted, chunksize=chunk_rows, low_memory=False)
+
+def summarize_chunks(chunks, value_columns, sketch_columns=(), window=None):
+    """
+    Fold source chunks into per-file rollup rows, one set per value column.
+
+    Args:
+        chunks: Iterable of DataFrames with file_path and the value columns
+        value_columns: Columns to summarize
+        sketch_columns: Columns that also get a QuantileSketch per file
+        window: Optional (datetime_column, window_start, timezone_name); rows
+            before the start are dropped from every chunk
+
+    Returns:
+        Dict of column to pd.DataFrame with file_path, count, sum, m2, min, max,
+        last, last_row, t_min, t_max (NaT; the time isn't tracked) and, for
+        sketch columns, sketch
+    """
+    from plot_utils import filter_time_window
+
+    merged = {col: None for col in value_columns}
+    sketches = {col: {} for col in sketch_columns}
+    offset = 0
+    for chunk in chunks:
+        if window and window[0] in chunk.columns:
+            chunk[window[0]] = pd.to_datetime(chunk[window[0]], errors='coerce')
+            chunk = filter_time_window(chunk, *window)
+        rows = offset + np.arange(len(chunk))
+        offset += len(chunk)
+
+        for col in value_columns:
+            if col not in chunk.columns:
+                continue
+            values = pd.to_numeric(chunk[col], errors='coerce')
+            valid = values.notna().to_numpy()
+            if not valid.any():
+                continue
+            part = pd.DataFrame({'file_path': chunk['file_path'].to_numpy()[valid],
+                                 'value': values.to_numpy()[valid], 'row': rows[valid]})
+            grouped = part.groupby('file_path', sort=False)
+            stats = grouped['value'].agg(['count', 'sum', 'min', 'max', 'last'])
+            stats['m2'] = grouped['value'].var(ddof=0).to_numpy() * stats['count'].to_numpy()
+            stats['last_row'] = grouped['row'].max()
+            stats['t_min'] = stats['t_max'] = pd.NaT
+            stats = stats.reset_index()
+
+            combined = stats if merged[col] is None else pd.concat([merged[col], stats], ignore_index=True)
+            merged[col] = merge_rollups(combined, 'file_path').rename_axis('file_path').reset_index()
+
+            if col in sketches:
+                for path, positions in grouped.indices.items():
+                    sketch = sketches[col].setdefault(path, QuantileSketch())
+                    sketch.update(part['value'].to_numpy()[positions])
+
+    summaries = {}
+    for col, rows in merged.items():
+        if rows is None:
+            rows = pd.DataFrame(columns=['file_path', 'count', 'sum', 'm2', 'min', 'max', 'last',
+                                         'last_row', 't_min', 't_max'])
+        if col in sketches:
+            rows['sketch'] = [sketches[col].get(path) for path in rows['file_path']]
+        summaries[col] = rows
+    logging.debug(f"Summarized {offset} rows in chunks for columns {list(value_columns)}")
+    return summaries
+
+def streams_statistics(plot, source):
+    """Whether a plot's statistics are computed by streaming its (large) source in chunks."""
+    file = source.file
+    config = plot.config_json if isinstance(plot.config_json, dict) else {}
+    return (plot.type in ('box', 'table') and bool(config.get('y_data'))
+            and file is not None and (file.size or 0) >= STREAM_STATS_MIN_BYTES)
@@ -1,11 +1,11 @@
 from functools import wraps
 from flask import session, redirect, url_for
-from models import db, Account, Gateway, File, Node
-from sqlalchemy import distinct, func
+from models import db, Account, Gateway, File, Node, Source, SourceFile
+from sqlalchemy import case, distinct, func, insert, inspect, literal, or_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 import logging
 import requests
 import os
-import re
 from datetime import datetime, timezone, timedelta
 import pytz
 
@@ -210,64 +210,363 @@ def get_database_statistics():
         print(f"Error getting database statistics: {e}")
         return None
     
+def _escape_like(value):
+    """Escape LIKE wildcards so a path is matched literally."""
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+def source_files_query(account, source):
+    """Returns a query for the files that match the source's directory filter.
+
+    The filter becomes a prefix range on lower(key) (served by the (account_id,
+    lower(key) text_pattern_ops) index) plus suffix and depth conditions, so only
+    matching rows leave the database. Directories match regardless of case, as
+    they always have. Callers can add ordering and limits to the query.
+    """
+    clean_dir = (source.directory_filter or '').strip('/').lower()
+    prefix = _escape_like(f"{clean_dir}/") if clean_dir else ''
+    lower_key = func.lower(File.key)
+
+    query = File.query.filter(File.account_id == account.id)
+    if prefix:
+        query = query.filter(lower_key.like(f"{prefix}%", escape='\\'))
+
+    query = query.filter(File.key.ilike('%.csv'))\
+        .filter(~File.key.like('.%'))\
+        .filter(~File.key.contains('/.'))
+
+    if not source.include_subdirs:
+        # Only files directly inside the directory
+        query = query.filter(~lower_key.like(f"{prefix}%/%", escape='\\'))
+
+    return query
+
 def list_source_files(account, source):
     """Returns a list of files that match the source's directory filter pattern.
-    Takes a source and a list of files and returns which files match the source pattern.
     Does NOT rebuild or fetch files from S3.
     """
     try:
-        # Get existing files from database
-        files = File.query.filter_by(account_id=account.id)\
-            .filter(~File.key.like('.%'))\
-            .filter(~File.key.contains('/.')) \
-            .all()
-        
-        # Convert glob pattern to regex
-        clean_dir = source.directory_filter.strip('/')
-        if source.include_subdirs:
-            file_filter = f"{clean_dir}/**/*.[cC][sS][vV]"
-        else:
-            file_filter = f"{clean_dir}/*.[cC][sS][vV]"
-            
-        # Convert glob pattern to regex
-        if '**' in file_filter:
-            # Handle recursive matching
-            parts = file_filter.split('**')
-            prefix = parts[0].lstrip('/')
-            # For directory matching, we want exact prefix match
-            pattern_str = f"^{prefix}.*[^/]+\\.csv$"
-            pattern = re.compile(pattern_str, re.IGNORECASE)
-        elif '*' in file_filter:
-            # Handle single-level matching
-            file_filter = file_filter.lstrip('/')
-            base_pattern = file_filter.replace('*.[cC][sS][vV]', '')
-            pattern_str = f"^{base_pattern}[^/]+\\.csv$"
-            pattern = re.compile(pattern_str, re.IGNORECASE)
-        else:
-            pattern = re.compile(file_filter)
-            
-        # Find matching files
-        matching_files = []
-        for file in files:
-            if pattern.match(file.key):
-                matching_files.append(file)
-                
-        return matching_files
+        return source_files_query(account, source).all()
     except Exception as e:
         logging.error(f"Error in list_source_files for source {source.id}: {e}")
         return []
 
-def initiate_source_refresh(account, source):
+class SourceMatcher:
+    """Prefix trie over an account's source directory filters.
+
+    Each trie node is one lowercased path segment. A node holds the sources whose
+    directory_filter ends there, split into those matching only files directly in
+    that directory and those that also match subdirectories. Matching a key walks
+    its directory segments once, so the cost depends on the key length and not on
+    the number of sources or files. Mirrors the rules in list_source_files.
+    """
+
+    def __init__(self, sources):
+        self.root = {'children': {}, 'flat': set(), 'deep': set()}
+        for source in sources:
+            clean_dir = (source.directory_filter or '').strip('/')
+            node = self.root
+            for segment in clean_dir.lower().split('/') if clean_dir else []:
+                node = node['children'].setdefault(segment, {'children': {}, 'flat': set(), 'deep': set()})
+            node['deep' if source.include_subdirs else 'flat'].add(source.id)
+
+    def match(self, key):
+        """Return the ids of the sources whose filter matches the file key."""
+        matched = set()
+        # Hidden files and non-CSV files never belong to a source
+        if key.startswith('.') or '/.' in key or not key.lower().endswith('.csv'):
+            return matched
+
+        segments = key.lower().split('/')
+        if len(segments[-1]) <= len('.csv'):
+            return matched
+
+        node = self.root
+        for segment in segments[:-1]:
+            matched.update(node['deep'])
+            node = node['children'].get(segment)
+            if node is None:
+                return matched
+        matched.update(node['deep'])
+        matched.update(node['flat'])
+        return matched
+
+    def match_keys(self, keys):
+        """Return the ids of the sources matching any of the file keys."""
+        matched = set()
+        for key in keys:
+            matched.update(self.match(key))
+        return matched
+
+# Compiled matchers per account id, stored with the source rules they were built from
+_source_matchers = {}
+
+def get_source_matcher(account_id, sources):
+    """
+    Get the cached SourceMatcher for an account, rebuilding it when its sources changed.
+
+    Args:
+        account_id: ID of the account
+        sources: The account's Source objects
+
+    Returns:
+        SourceMatcher for the given sources
+    """
+    signature = tuple(sorted((source.id, source.directory_filter or '', bool(source.include_subdirs))
+                             for source in sources))
+    cached = _source_matchers.get(account_id)
+    if cached and cached[0] == signature:
+        return cached[1]
+
+    matcher = SourceMatcher(sources)
+    _source_matchers[account_id] = (signature, matcher)
+    return matcher
+
+def invalidate_source_matcher(account_id):
+    """Drop the cached SourceMatcher for an account after its sources change."""
+    _source_matchers.pop(account_id, None)
+
+def _utc(dt):
+    """Treat naive datetimes from the database as UTC so they can be compared."""
+    if dt is not None and dt.tzinfo is None:
+        return dt.replace(tzinfo=timezone.utc)
+    return dt
+
+def _key_depth(column):
+    """SQL expression for the number of path segments in a key."""
+    return func.length(column) - func.length(func.replace(column, '/', '')) + 1
+
+def recompute_source_aggregates(source):
+    """Recompute a source's aggregates from its rows in the source_file table."""
+    file_count, total_bytes, max_depth = db.session.query(
+        func.count(SourceFile.file_id),
+        func.coalesce(func.sum(SourceFile.size), 0),
+        func.coalesce(func.max(SourceFile.depth), 0)
+    ).filter(SourceFile.source_id == source.id).one()
+
+    newest = SourceFile.query.filter_by(source_id=source.id)\
+        .order_by(SourceFile.last_modified.desc(), SourceFile.file_id.desc())\
+        .first()
+
+    source.file_count = file_count
+    source.total_bytes = total_bytes
+    source.max_path_level = max_depth
+    source.newest_file_id = newest.file_id if newest else None
+    source.last_file_modified = newest.last_modified if newest else None
+
+def rebuild_source_membership(account, source):
+    """
+    Rebuild the source_file rows for a source from its directory filter.
+    Used when a source is created or its filter changes, and to backfill lazily.
+    The caller commits.
+    """
+    SourceFile.query.filter_by(source_id=source.id).delete(synchronize_session=False)
+
+    members = source_files_query(account, source).with_entities(
+        literal(source.id), File.id, File.size, _key_depth(File.key), File.last_modified, File.version
+    )
+    db.session.execute(insert(SourceFile.__table__).from_select(
+        ['source_id', 'file_id', 'size', 'depth', 'last_modified', 'version'], members.statement
+    ))
+
+    recompute_source_aggregates(source)
+    source.members_synced = True
+
+def ensure_source_membership(account, source):
+    """Backfill a source's membership if it has never been built. Returns True if it was."""
+    if source.members_synced:
+        return False
+    rebuild_source_membership(account, source)
+    return True
+
+def _insert_source_members(rows):
+    """
+    Insert source_file rows, skipping members another worker inserted first.
+    The caller commits.
+
+    Returns:
+        Set of (source_id, file_id) pairs that were inserted
+    """
+    if not rows:
+        return set()
+    if db.engine.dialect.name == 'postgresql':
+        stmt = pg_insert(SourceFile).values(rows)\
+            .on_conflict_do_nothing(index_elements=['source_id', 'file_id'])\
+            .returning(SourceFile.source_id, SourceFile.file_id)
+        return {tuple(row) for row in db.session.execute(stmt).all()}
+
+    # Other databases (local development): a single writer
+    for row in rows:
+        db.session.add(SourceFile(**row))
+    return {(row['source_id'], row['file_id']) for row in rows}
+
+def _apply_source_deltas(sources_by_id, deltas):
+    """
+    Add membership changes to the source aggregates in SQL, so concurrent syncs
+    of the same source don't overwrite each other's counts. The caller commits.
+    """
+    for source_id, change in deltas.items():
+        values = {
+            Source.file_count: Source.file_count + change['count'],
+            Source.total_bytes: Source.total_bytes + change['bytes'],
+            Source.max_path_level: case((Source.max_path_level < change['depth'], change['depth']),
+                                        else_=Source.max_path_level)
+        }
+        if change['newest'] is not None:
+            last_modified, file_id = change['newest']
+            is_newer = or_(Source.last_file_modified.is_(None), Source.last_file_modified <= last_modified)
+            values[Source.newest_file_id] = case((is_newer, file_id), else_=Source.newest_file_id)
+            values[Source.last_file_modified] = case((is_newer, last_modified), else_=Source.last_file_modified)
+        Source.query.filter_by(id=source_id).update(values, synchronize_session=False)
+        db.session.expire(sources_by_id[source_id], ['file_count', 'total_bytes', 'max_path_level',
+                                                     'newest_file_id', 'last_file_modified'])
+
+def sync_source_membership(account, sources, affected_files):
+    """
+    Apply changed and deleted files to the source_file membership table.
+
+    Upserts adjust the source aggregates incrementally (in SQL, so concurrent
+    workers syncing the same source don't lose updates); deletions recompute
+    them from the membership table. A source only counts as changed when its
+    membership actually changed: a file joined or left it, or a member's
+    version, size or timestamp differs from the stored snapshot.
+
+    Args:
+        account: Account object
+        sources: The account's Source objects
+        affected_files: File objects that were created, updated or deleted
+
+    Returns:
+        Set of ids of the sources whose membership changed
+    """
+    changed_source_ids = set()
+    sources_by_id = {source.id: source for source in sources}
+    matcher = get_source_matcher(account.id, sources)
+
+    upserted_files = [file for file in affected_files if not inspect(file).was_deleted]
+    deleted_files = [file for file in affected_files if inspect(file).was_deleted]
+
+    # Sources without membership yet are built from scratch, which already
+    # includes the affected files
+    matched_source_ids = matcher.match_keys(file.key for file in affected_files)
+    rebuilt_source_ids = set()
+    for source in sources:
+        if ensure_source_membership(account, source):
+            rebuilt_source_ids.add(source.id)
+            if source.id in matched_source_ids:
+                changed_source_ids.add(source.id)
+
+    # Deleted files leave every source they belonged to
+    if deleted_files:
+        deleted_ids = [file.id for file in deleted_files]
+        SourceFile.query.filter(SourceFile.file_id.in_(deleted_ids)).delete(synchronize_session=False)
+        for source_id in matcher.match_keys(file.key for file in deleted_files) - rebuilt_source_ids:
+            recompute_source_aggregates(sources_by_id[source_id])
+            changed_source_ids.add(source_id)
+
+    if not upserted_files:
+        return changed_source_ids
+
+    def lock_members(file_ids):
+        # Row locks keep the size deltas below consistent with other workers
+        return {
+            (member.source_id, member.file_id): member
+            for member in SourceFile.query.filter(SourceFile.file_id.in_(file_ids)).with_for_update().all()
+        }
+
+    deltas = {}
+
+    def record(source_id, file, count, size_delta, depth=0):
+        change = deltas.setdefault(source_id, {'count': 0, 'bytes': 0, 'depth': 0, 'newest': None})
+        change['count'] += count
+        change['bytes'] += size_delta
+        change['depth'] = max(change['depth'], depth)
+        if file.last_modified is not None and (change['newest'] is None or
+                                               _utc(file.last_modified) >= _utc(change['newest'][0])):
+            change['newest'] = (file.last_modified, file.id)
+        changed_source_ids.add(source_id)
+
+    def update_member(source_id, file, member):
+        if (member.version == file.version and member.size == file.size and
+                _utc(member.last_modified) == _utc(file.last_modified)):
+            return
+        record(source_id, file, 0, file.size - member.size)
+        member.size = file.size
+        member.version = file.version
+        member.last_modified = file.last_modified
+
+    existing_members = lock_members([file.id for file in upserted_files])
+    new_members = []
+    for file in upserted_files:
+        for source_id in matcher.match(file.key) - rebuilt_source_ids:
+            member = existing_members.get((source_id, file.id))
+            if member is None:
+                new_members.append((source_id, file))
+            else:
+                update_member(source_id, file, member)
+
+    inserted = _insert_source_members([
+        dict(source_id=source_id, file_id=file.id, size=file.size, depth=file.key.count('/') + 1,
+             last_modified=file.last_modified, version=file.version)
+        for source_id, file in new_members
+    ])
+    conflicted = [(source_id, file) for source_id, file in new_members if (source_id, file.id) not in inserted]
+    raced_members = lock_members([file.id for _, file in conflicted]) if conflicted else {}
+    for source_id, file in new_members:
+        if (source_id, file.id) in inserted:
+            record(source_id, file, 1, file.size, file.key.count('/') + 1)
+        elif (source_id, file.id) in raced_members:
+            # Another worker added it first and counted it; only apply what differs
+            update_member(source_id, file, raced_members[(source_id, file.id)])
+
+    _apply_source_deltas(sources_by_id, deltas)
+    return changed_source_ids
+
+def initiate_source_refresh(account, source, priority=None, run_after=None):
     """
-    Initiates a refresh for a source without any HTTP redirects.
+    Queues a refresh for a source without any HTTP redirects.
+    The job queue runs it (see run_source_refresh).
     Returns (success, error_message) tuple.
     """
+    from job_queue import enqueue_job, PRIORITY_USER
+
     try:
         # Reset source status
         source.success = False
         source.error = None
         source.state = 'running'
         source.do_update = False  # Set do_update to False when refresh is initiated
+
+        enqueue_job(account.id, 'source_refresh', source_id=source.id,
+                    priority=PRIORITY_USER if priority is None else priority,
+                    run_after=run_after)
+        db.session.commit()
+        return True, None
+        
+    except Exception as e:
+        error_msg = str(e)
+        logging.error(f"Error queueing refresh for source {source.id}: {error_msg}")
+        db.session.rollback()
+        if not source.error:  # Only set error if not already set
+            source.error = error_msg
+            source.state = 'error'
+            db.session.commit()
+        return False, error_msg 
+
+def run_source_refresh(account, source):
+    """
+    Runs a queued source refresh: builds the source locally when
+    SOURCE_BUILDER=local, otherwise triggers the Lambda.
+    Returns (success, error_message) tuple.
+    """
+    try:
+        source.state = 'running'
+        source.do_update = False
+        db.session.commit()
+
+        if os.environ.get('SOURCE_BUILDER') == 'local':
+            from source_builder import build_source
+            return build_source(account, source)
+
         # Prepare payload for lambda
         payload = {
             'source': {
@@ -281,7 +580,7 @@ def initiate_source_refresh(account, source):
                 'account_url': account.url
             }
         }
-        
+
         lambda_url = os.environ.get('LAMBDA_URL')
         if not lambda_url:
             raise ValueError("LAMBDA_URL environment variable not set")
@@ -292,7 +591,6 @@ def initiate_source_refresh(account, source):
             # This is expected, ignore it
             pass
         
-        db.session.commit()
         return True, None
         
     except Exception as e:
@@ -304,6 +602,78 @@ def initiate_source_refresh(account, source):
             db.session.commit()
         return False, error_msg 
 
+def complete_source_refresh(account, source, key=None, size=None, error=None, etag=None):
+    """
+    Record the outcome of a source refresh, from the Lambda callback or the local builder.
+
+    Args:
+        account: Account object owning the source
+        source: Source object that was refreshed
+        key: Key of the built source file (an empty key is an error)
+        size: Size of the built source file; the File row is only touched when given
+        error: Error message if the refresh failed
+        etag: ETag of the uploaded source file, if known
+
+    Returns:
+        True if the source was marked successful, False if it was marked as errored
+    """
+    from S3Manager import generate_s3_url
+
+    # Update source timestamp
+    source.last_updated = datetime.now(timezone.utc)
+
+    # Handle error state (including empty key)
+    if error or not key:
+        source.state = 'error'
+        source.error = error if error else 'Empty or missing key field'
+        db.session.commit()
+        return False
+
+    # Update source fields for success case
+    source.state = 'success'
+    source.error = None  # Clear any previous error
+
+    # max_path_level is maintained with the source membership
+    ensure_source_membership(account, source)
+
+    # Handle file record only if we have a size
+    if size is not None:
+        file = File.query.filter_by(account_id=account.id, key=key).first()
+        if not file:
+            logging.info(f"Creating new file record for key: {key}")
+            file = File(
+                account_id=account.id,
+                key=key,
+                url=generate_s3_url(account.settings.bucket_name, key),
+                size=size,
+                last_modified=datetime.now(timezone.utc),
+                etag=etag,
+                version=1
+            )
+            db.session.add(file)
+            db.session.flush()
+        else:
+            file.size = size
+            file.version += 1
+            file.last_modified = datetime.now(timezone.utc)
+            file.etag = etag
+
+        source.file_id = file.id
+
+    # Renders of the previous version can no longer be read; drop them
+    from plot_cache import frame_cache, purge_rendered_plots
+    purge_rendered_plots(source.id)
+    frame_cache.discard(lambda frame_key: frame_key[0] == source.id)
+
+    # Render the source's plots in the background (worker.py) so the first viewer reads them from the cache
+    from models import Plot
+    from job_queue import enqueue_job, PRIORITY_WARMUP
+    if Plot.query.filter_by(source_id=source.id).first():
+        enqueue_job(account.id, 'plot_warmup', source_id=source.id, priority=PRIORITY_WARMUP)
+
+    db.session.commit()
+    return True
+
 def format_file_size(size_in_bytes):
     """Format file size to human readable format (B, KB, MB, GB).
     
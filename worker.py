@@ -0,0 +1,21 @@
+"""
+Job queue worker: processes queued source refreshes and plot warm-ups
+outside the web process.
+
+Usage:
+    python worker.py
+
+Run as many as needed; they coordinate through the job table. /cronjob only
+runs refreshes that trigger the Lambda itself, so a worker is required for
+SOURCE_BUILDER=local and for every other job kind. When at least one worker is
+running, JOB_DRAIN_SECONDS=0 stops /cronjob from processing jobs at all.
+"""
+import os
+import socket
+from app import app
+from job_queue import work
+
+if __name__ == '__main__':
+    with app.app_context():
+        app.logger.info("Job worker started")
+        work(f"{socket.gethostname()}:{os.getpid()}")